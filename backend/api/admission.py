@@ -0,0 +1,183 @@
+"""
+Admission control for the heavy endpoints.
+
+Each order / seal request runs PDF parsing, Gemini calls and workbook
+builds; a burst of uploads used to start all of them at once and every
+request slowed down until they timed out together. AdmissionMiddleware runs
+at most <CONCURRENCY> requests per endpoint group and lets up to <QUEUE>
+more wait (first come, first served):
+
+  - queue full             -> 429 at once, with Retry-After
+  - waited QUEUE_TIMEOUT s -> 503, with Retry-After
+
+Retry-After is estimated from the recent request durations of the group and
+the queue in front of the caller. Requests are admitted before their body is
+read, so a refused upload costs almost nothing. Limits are per worker process.
+
+Groups (their requests share one limit):
+  order   /api/order-invoice, /api/results/<id>/rerender
+  seal    /api/seal
+
+    ADMISSION=0                     (no limits)
+    ORDER_CONCURRENCY=2  ORDER_QUEUE=8
+    SEAL_CONCURRENCY=2   SEAL_QUEUE=8
+    ADMISSION_QUEUE_TIMEOUT=60      (seconds a request may wait for a slot)
+
+Metrics: mamameal_admission_in_flight / mamameal_admission_queue_depth
+(gauges), mamameal_admission_rejected_total{reason=queue_full|timeout} and
+mamameal_admission_wait_seconds.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import deque
+
+from api.metrics import Counter, Gauge, Histogram, REGISTRY
+
+ADMISSION_GROUPS = (
+    ("order", re.compile(r"^/api/(order-invoice|results/\d+/rerender)$")),
+    ("seal", re.compile(r"^/api/seal$")),
+)
+
+IN_FLIGHT = Gauge("mamameal_admission_in_flight", "Requests running per admission group.", ["group"])
+QUEUE_DEPTH = Gauge("mamameal_admission_queue_depth", "Requests waiting for a slot per admission group.",
+                    ["group"])
+REJECTED = Counter("mamameal_admission_rejected_total",
+                   "Requests refused by admission control (queue_full -> 429, timeout -> 503).",
+                   ["group", "reason"])
+WAIT_SECONDS = Histogram("mamameal_admission_wait_seconds", "Time admitted requests waited for a slot.",
+                         ["group"])
+REGISTRY.extend([IN_FLIGHT, QUEUE_DEPTH, REJECTED, WAIT_SECONDS])
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Slots and a bounded FIFO queue for one group. Used from the event loop
+    only (no locks): a released slot is handed directly to the oldest waiter.
+    """
+
+    def __init__(self, group, concurrency, queue, queue_timeout):
+        self.group = group
+        self.concurrency = max(concurrency, 1)
+        self.queue = max(queue, 0)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = deque()
+        # Moving average of request durations, for Retry-After
+        self._avg_seconds = None
+
+    def retry_after(self, position=None):
+        """Seconds until a slot is likely free for a request at `position` in the queue."""
+        position = len(self._waiters) if position is None else position
+        avg = self._avg_seconds or 5.0
+        return max(1, math.ceil(avg * (position + 1) / self.concurrency))
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            IN_FLIGHT.set(self.active, group=self.group)
+            return
+        if len(self._waiters) >= self.queue:
+            REJECTED.inc(group=self.group, reason="queue_full")
+            raise Rejected(429, "queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        QUEUE_DEPTH.set(len(self._waiters), group=self.group)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended: pass it on
+                self.release(observe=None)
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            QUEUE_DEPTH.set(len(self._waiters), group=self.group)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            REJECTED.inc(group=self.group, reason="timeout")
+            raise Rejected(503, "timeout", self.retry_after()) from None
+        WAIT_SECONDS.observe(time.perf_counter() - start, group=self.group)
+
+    def release(self, observe=0.0):
+        """Free the slot (observe: the request's duration, for Retry-After)."""
+        if observe is not None:
+            self._avg_seconds = observe if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * observe
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot moves to the waiter: active stays the same
+                waiter.set_result(None)
+                QUEUE_DEPTH.set(len(self._waiters), group=self.group)
+                return
+        QUEUE_DEPTH.set(0, group=self.group)
+        self.active -= 1
+        IN_FLIGHT.set(self.active, group=self.group)
+
+
+def admission_limiters():
+    """{group: AdmissionLimiter} from the environment ({} when ADMISSION=0)."""
+    if os.getenv("ADMISSION", "1") == "0":
+        return {}
+    timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "60"))
+    return {
+        group: AdmissionLimiter(group, int(os.getenv(f"{group.upper()}_CONCURRENCY", "2")),
+                                int(os.getenv(f"{group.upper()}_QUEUE", "8")), timeout)
+        for group, _ in ADMISSION_GROUPS
+    }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the group limits before the request body is read."""
+
+    def __init__(self, app, limiters=None):
+        self.app = app
+        self.limiters = admission_limiters() if limiters is None else limiters
+
+    def limiter_for(self, path):
+        for group, pattern in ADMISSION_GROUPS:
+            if pattern.match(path):
+                return self.limiters.get(group)
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiter_for(scope.get("path", "")) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await limiter.acquire()
+        except Rejected as e:
+            await self._reject(send, e)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - start)
+
+    @staticmethod
+    async def _reject(send, error):
+        detail = ("Too many requests in the queue, retry later" if error.reason == "queue_full"
+                  else "Timed out waiting for a free slot, retry later")
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({"type": "http.response.start", "status": error.status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"retry-after", str(error.retry_after).encode()),
+                                # The body was not read: the client must not reuse the connection
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
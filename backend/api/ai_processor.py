@@ -1,21 +1,40 @@
-from google import genai
-from google.genai import types
 import json
-import pdfplumber
 import io
 import logging
+import os
 import re
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf_bytes(pdf_bytes: bytes) -> str:
+@lru_cache(maxsize=4)
+def get_genai_client(api_key: str):
     """
-    Extracts all text from a PDF file using pdfplumber.
+    genai.Client per API key, reused across requests (client creation and the
+    underlying HTTP connection pool are not free).
+    GEMINI_BASE_URL points the client at another endpoint (e.g. the fake
+    server of bench/model_scheduler_load.py).
     """
+    # Imported here: google-genai takes ~0.5s to import and only AI requests need it
+    from google import genai
+    base_url = os.getenv("GEMINI_BASE_URL")
+    if base_url:
+        return genai.Client(api_key=api_key, http_options={"base_url": base_url})
+    return genai.Client(api_key=api_key)
+
+def extract_text_from_pdf_bytes(pdf_bytes: bytes, backend: str = None) -> str:
+    """
+    Extracts all text from a PDF file using pdfplumber, or PDFium with
+    backend="pdfium" / PDF_TEXT_BACKEND=pdfium (see api.pdf_text_backend).
+    """
+    from api.pdf_utils import open_pdf, iter_pages
+    from api.pdf_text_backend import text_backend
+    backend = text_backend(backend)
     all_text = ""
     try:
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            for page in pdf.pages:
+        with open_pdf(io.BytesIO(pdf_bytes), backend) as pdf:
+            # Drop the page's parsed objects right away (long PDFs)
+            for page in iter_pages(pdf):
                 text = page.extract_text()
                 if text:
                     all_text += text + "\n"
@@ -32,7 +51,10 @@ def process_order_pdf_with_ai(pdf_bytes: bytes, api_key: str, model_name: str =
     if not api_key:
         raise ValueError("API Key is missing.")
 
-    client = genai.Client(api_key=api_key)
+    from google.genai import types
+    from api.model_scheduler import get_model_scheduler
+
+    client = get_genai_client(api_key)
 
     prompt = """
     You are an expert data extraction assistant.
@@ -92,7 +114,9 @@ def process_order_pdf_with_ai(pdf_bytes: bytes, api_key: str, model_name: str =
     """
 
     try:
-        response = client.models.generate_content(
+        # Rate limited per model, retried on 429 / 5xx (api.model_scheduler)
+        response = get_model_scheduler().call(
+            model_name, client.models.generate_content,
             model=model_name,
             contents=[
                 types.Content(
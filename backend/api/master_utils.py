@@ -1,43 +1,353 @@
+"""
+Master CSVs (商品マスタ / 得意先マスタ) in the assets directory.
+
+Next to every master CSV a columnar snapshot (<csv name>.arrow, Arrow IPC /
+Feather v2, uncompressed so it can be memory-mapped) holds the parsed
+DataFrame. read_master_csv reads the snapshot when it matches the CSV (same
+size and mtime, recorded in the snapshot's schema metadata) and falls back
+to parsing the CSV, writing the snapshot for the next load. save_master_file
+writes it at upload time; migrate_master_snapshots creates missing ones
+(run by the startup warm-up).
+
+Columns stay strings (the CSVs are parsed with dtype=str), so the frames
+are identical either way. Snapshots are optional: without pyarrow, or with
+MASTER_SNAPSHOTS=0, the CSVs are parsed as before.
+
+Versions: uploads never touch the files readers use. Each upload is
+written to its own version directory, masters/<pattern>/<version>/<csv>
+(with its metadata and snapshot; temp file -> fsync -> rename), and then
+the masters/<pattern>/CURRENT pointer is swapped the same way. Readers
+(find_master_file) follow the pointer, so they see the old or the new
+version, never a half-written or missing file. Version files are immutable
+and the previous MASTER_VERSIONS_KEEP versions are kept, so a request that
+resolved the old path can still read it. CSVs directly in the assets
+directory (from before versioning, or committed with the app) are used
+while there is no pointer.
+
+Encodings: uploads are detected once (BOM, then a byte sample) and saved as
+UTF-8; the detected encoding goes to <csv name>.meta.json. A CSV is then
+parsed exactly once, with the encoding from its metadata (or, for files
+without metadata, detected from a byte sample). The old trial-and-error
+over MASTER_ENCODINGS is only the fallback when that parse fails.
+"""
+import codecs
+import datetime
+import hashlib
+import json
 import os
 import glob
+import logging
+import shutil
 import pandas as pd
 
-def load_master_csv(base_path, file_pattern):
-    """Load master CSV from assets directory."""
+MASTER_PATTERNS = ("商品マスタ", "得意先マスタ")
+SNAPSHOT_SUFFIX = ".arrow"
+SNAPSHOT_META_KEY = b"mamameal.master_source"
+METADATA_SUFFIX = ".meta.json"
+MASTER_ENCODINGS = ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis']
+ENCODING_SAMPLE_BYTES = 64 * 1024
+VERSIONS_DIR = "masters"
+CURRENT_POINTER = "CURRENT"
+
+logger = logging.getLogger(__name__)
+
+def fsync_dir(path):
+    # Makes a rename durable; directories cannot be opened on Windows
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path, data):
+    """Write bytes to path via a temp file in the same directory: fsync, rename, fsync the directory."""
+    directory = os.path.dirname(path) or "."
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    fsync_dir(directory)
+
+def versions_dir(base_path, file_pattern):
+    return os.path.join(base_path, VERSIONS_DIR, file_pattern)
+
+def current_master_version(base_path, file_pattern):
+    """The CURRENT pointer of a pattern ({"version", "filename", ...}), or None."""
+    try:
+        with open(os.path.join(versions_dir(base_path, file_pattern), CURRENT_POINTER), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def find_master_file(base_path, file_pattern):
+    """Return the current master CSV path (versioned upload, else the newest matching CSV), or None."""
+    pointer = current_master_version(base_path, file_pattern)
+    if pointer:
+        path = os.path.join(versions_dir(base_path, file_pattern), pointer["version"], pointer["filename"])
+        if os.path.exists(path):
+            return path
     search_path = os.path.join(base_path, f'*{file_pattern}*.csv')
     list_of_files = glob.glob(search_path)
     if not list_of_files:
-        return pd.DataFrame(), None
-    latest_file = max(list_of_files, key=os.path.getmtime)
-    encodings = ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis']
-    for encoding in encodings:
+        return None
+    return max(list_of_files, key=os.path.getmtime)
+
+def snapshots_enabled():
+    if os.getenv("MASTER_SNAPSHOTS", "1") == "0":
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def snapshot_path(csv_path):
+    return csv_path + SNAPSHOT_SUFFIX
+
+def _source_signature(csv_path):
+    stat = os.stat(csv_path)
+    return f"{os.path.basename(csv_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")
+
+def write_master_snapshot(csv_path, df):
+    """Write the snapshot of a parsed master CSV (atomically). Returns False on failure."""
+    if not snapshots_enabled():
+        return False
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    path = snapshot_path(csv_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[SNAPSHOT_META_KEY] = _source_signature(csv_path)
+        feather.write_feather(table.replace_schema_metadata(metadata), tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not write master snapshot {path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+def read_master_snapshot(csv_path):
+    """The snapshot's DataFrame if it exists and matches the CSV, else None."""
+    if not snapshots_enabled():
+        return None
+    path = snapshot_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    import pyarrow as pa
+    try:
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            if (reader.schema.metadata or {}).get(SNAPSHOT_META_KEY) != _source_signature(csv_path):
+                return None
+            return reader.read_all().to_pandas()
+    except Exception as e:
+        logger.warning(f"Could not read master snapshot {path}: {e}")
+        return None
+
+def snapshot_is_current(csv_path):
+    """True when the CSV has a snapshot written from its current version (reads the schema only)."""
+    path = snapshot_path(csv_path)
+    if not snapshots_enabled() or not os.path.exists(path):
+        return False
+    import pyarrow as pa
+    try:
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        return metadata.get(SNAPSHOT_META_KEY) == _source_signature(csv_path)
+    except Exception:
+        return False
+
+def read_master_csv(path):
+    """Parse a master CSV (via its snapshot when up to date), trying the encodings our masters are saved in."""
+    df = read_master_snapshot(path)
+    if df is not None:
+        return df
+    df = parse_master_csv(path)
+    if df is not None:
+        write_master_snapshot(path, df)
+    return df
+
+def detect_encoding(data):
+    """
+    Encoding of CSV bytes: BOM first, then the first of MASTER_ENCODINGS that
+    decodes a sample (the sample may end inside a multi-byte character).
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    sample = data[:ENCODING_SAMPLE_BYTES]
+    final = len(data) <= ENCODING_SAMPLE_BYTES
+    for encoding in MASTER_ENCODINGS[1:]:
         try:
-            df = pd.read_csv(latest_file, encoding=encoding, dtype=str).fillna('')
-            if not df.empty:
-                df.columns = df.columns.str.strip()
-                return df, os.path.basename(latest_file)
-        except Exception:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+            return encoding
+        except UnicodeDecodeError:
             continue
-    return pd.DataFrame(), None
+    return None
 
-def save_master_file(base_path, file_content, filename, file_pattern):
-    """Save uploaded master file to assets directory, removing old ones."""
-    # 1. Delete existing files matching the pattern
-    search_path = os.path.join(base_path, f'*{file_pattern}*.csv')
-    old_files = glob.glob(search_path)
-    for f in old_files:
+def metadata_path(csv_path):
+    return csv_path + METADATA_SUFFIX
+
+def read_master_metadata(csv_path):
+    """The CSV's metadata (written at upload) if it describes the current file, else None."""
+    try:
+        with open(metadata_path(csv_path), encoding="utf-8") as f:
+            metadata = json.load(f)
+        if metadata.get("source") != _source_signature(csv_path).decode("utf-8"):
+            return None
+    except (OSError, ValueError):
+        return None
+    return metadata
+
+def write_master_metadata(csv_path, **fields):
+    metadata = dict(fields, source=_source_signature(csv_path).decode("utf-8"))
+    try:
+        atomic_write(metadata_path(csv_path), json.dumps(metadata, ensure_ascii=False, indent=2).encode("utf-8"))
+    except OSError as e:
+        print(f"Error writing master metadata: {e}")
+
+def master_encoding(path):
+    """Encoding to parse a master CSV with: from its metadata, else detected from a byte sample."""
+    metadata = read_master_metadata(path)
+    if metadata and metadata.get("encoding"):
+        return metadata["encoding"]
+    try:
+        with open(path, "rb") as f:
+            # One byte past the sample tells detect_encoding that the file goes on
+            return detect_encoding(f.read(ENCODING_SAMPLE_BYTES + 1))
+    except OSError:
+        return None
+
+def _parse_csv(path, encoding):
+    try:
+        df = pd.read_csv(path, encoding=encoding, dtype=str).fillna('')
+    except Exception:
+        return None
+    if df.empty:
+        return None
+    df.columns = df.columns.str.strip()
+    return df
+
+def parse_master_csv(path):
+    """Parse a master CSV once with its known / detected encoding (trying the others only if that fails)."""
+    encoding = master_encoding(path)
+    if encoding:
+        df = _parse_csv(path, encoding)
+        if df is not None:
+            return df
+    for fallback in MASTER_ENCODINGS:
+        if fallback == encoding:
+            continue
+        df = _parse_csv(path, fallback)
+        if df is not None:
+            return df
+    return None
+
+def normalize_to_utf8(file_content):
+    """(UTF-8 bytes, source encoding) of an uploaded CSV; the bytes unchanged and None if no encoding fits."""
+    detected = detect_encoding(file_content)
+    candidates = [detected] + [e for e in MASTER_ENCODINGS if e != detected] if detected else MASTER_ENCODINGS
+    for encoding in candidates:
         try:
-            os.remove(f)
-        except Exception as e:
-            print(f"Error removing old file: {e}")
-            return False
+            text = file_content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        return text.encode('utf-8'), encoding
+    return file_content, None
 
-    # 2. Save new file
-    save_path = os.path.join(base_path, filename)
+def load_master_csv(base_path, file_pattern):
+    """Load master CSV from assets directory."""
+    latest_file = find_master_file(base_path, file_pattern)
+    if latest_file is None:
+        return pd.DataFrame(), None
+    df = read_master_csv(latest_file)
+    if df is None:
+        return pd.DataFrame(), None
+    return df, os.path.basename(latest_file)
+
+def save_master_file(base_path, file_content, filename, file_pattern):
+    """
+    Save an uploaded master as a new version (UTF-8, with metadata and
+    snapshot) and make it current by swapping the CURRENT pointer.
+    """
+    filename = os.path.basename(filename)
+    content, source_encoding = normalize_to_utf8(file_content)
+    root = versions_dir(base_path, file_pattern)
+    now = datetime.datetime.now()
+    version = f"{now:%Y%m%dT%H%M%S%f}-{hashlib.sha256(content).hexdigest()[:8]}"
+    save_path = os.path.join(root, version, filename)
     try:
-        with open(save_path, "wb") as f:
-            f.write(file_content)
-        return True
+        # 1. The new version, in a directory nobody reads yet
+        os.makedirs(os.path.dirname(save_path))
+        atomic_write(save_path, content)
     except Exception as e:
         print(f"Error saving file: {e}")
         return False
+    write_master_metadata(
+        save_path,
+        filename=filename,
+        source_encoding=source_encoding,
+        encoding='utf-8' if source_encoding else None,
+        uploaded_at=now.isoformat(timespec="seconds"),
+    )
+
+    # 2. Snapshot for the loaders (best effort: they parse the CSV without it)
+    if snapshots_enabled() and save_path.endswith('.csv'):
+        df = parse_master_csv(save_path)
+        if df is not None:
+            write_master_snapshot(save_path, df)
+
+    # 3. Swap the pointer: new requests use the new version from here on
+    pointer = {"version": version, "filename": filename, "updated_at": now.isoformat(timespec="seconds")}
+    try:
+        atomic_write(os.path.join(root, CURRENT_POINTER), json.dumps(pointer, ensure_ascii=False).encode("utf-8"))
+    except Exception as e:
+        print(f"Error switching master version: {e}")
+        return False
+
+    # 4. Old versions beyond MASTER_VERSIONS_KEEP (never the current one)
+    prune_master_versions(base_path, file_pattern)
+    return True
+
+def prune_master_versions(base_path, file_pattern, keep=None):
+    """Delete the oldest versions, keeping the current one and the `keep` newest others."""
+    keep = max(int(os.getenv("MASTER_VERSIONS_KEEP", "5")) if keep is None else keep, 1)
+    root = versions_dir(base_path, file_pattern)
+    pointer = current_master_version(base_path, file_pattern)
+    current = pointer["version"] if pointer else None
+    try:
+        versions = sorted(name for name in os.listdir(root)
+                          if name != current and os.path.isdir(os.path.join(root, name)))
+    except OSError:
+        return
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def migrate_master_snapshots(base_path):
+    """Write missing / outdated snapshots of the current master CSVs. Returns the CSVs snapshotted."""
+    if not snapshots_enabled():
+        return []
+    written = []
+    for pattern in MASTER_PATTERNS:
+        path = find_master_file(base_path, pattern)
+        if path is None or snapshot_is_current(path):
+            continue
+        df = parse_master_csv(path)
+        if df is not None and write_master_snapshot(path, df):
+            written.append(os.path.basename(path))
+    return written
@@ -0,0 +1,426 @@
+"""
+Per-stage timing for the order / seal pipelines.
+
+Code wraps its stages in span("name"). Each span:
+  - is added to the current request's trace (-> Server-Timing header and one
+    structured JSON log line per request, see main.py middleware)
+  - is observed in a Prometheus-style latency histogram (-> GET /metrics)
+
+Workbooks are built in worker processes; their spans are collected there
+with collect_spans(observe=False) and merged back into the request with
+record_spans(), which observes them in the parent's histograms.
+
+Memory:
+  - peak RSS per request (this process + the workbook workers), sampled in a
+    background thread while requests are in flight (Linux /proc)
+  - MEMORY_PROFILE=1 additionally runs tracemalloc and records, per span, the
+    peak of Python allocations above the level at span start. tracemalloc
+    slows everything down (~2-3x) and its peak is process wide, so numbers from
+    concurrent requests overlap: use it for diagnosis, not in production.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Latency buckets in seconds (AI calls take tens of seconds, cell writes milliseconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Byte buckets for memory histograms (1 MiB .. 4 GiB)
+MEMORY_BUCKETS = tuple(2**20 * mb for mb in (1, 4, 16, 32, 64, 128, 256, 384, 512, 768, 1024, 2048, 4096))
+
+MEMORY_PROFILE = os.getenv("MEMORY_PROFILE", "0") == "1"
+if MEMORY_PROFILE and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+logger = logging.getLogger("mamameal.timing")
+if os.getenv("TIMING_LOG", "1") != "0" and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Histogram:
+    """Minimal thread-safe labelled histogram in the Prometheus text format."""
+
+    def __init__(self, name, documentation, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if idx < len(self.buckets):
+                series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, key))
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """Minimal thread-safe labelled counter in the Prometheus text format."""
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, key))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return "\n".join(lines)
+
+
+class Gauge:
+    """Minimal thread-safe labelled gauge in the Prometheus text format."""
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, key))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram(
+    "mamameal_stage_duration_seconds", "Duration of pipeline stages.", ["stage"]
+)
+REQUEST_SECONDS = Histogram(
+    "mamameal_request_duration_seconds", "Duration of HTTP requests.", ["endpoint", "status"]
+)
+REQUEST_PEAK_RSS = Histogram(
+    "mamameal_request_peak_rss_bytes", "Peak RSS (app + workbook workers) while a request was running.",
+    ["endpoint"], MEMORY_BUCKETS
+)
+STAGE_ALLOC_PEAK = Histogram(
+    "mamameal_stage_alloc_peak_bytes", "Peak Python allocations per stage (MEMORY_PROFILE=1 only).",
+    ["stage"], MEMORY_BUCKETS
+)
+
+# Registry rendered by /metrics (other modules may append their own metrics)
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, REQUEST_PEAK_RSS, STAGE_ALLOC_PEAK]
+
+
+def render_metrics():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class Trace:
+    """Spans recorded while handling one request: [(name, seconds), ...]."""
+
+    def __init__(self):
+        self.spans = []
+        self.memory = []  # [(name, peak allocation bytes), ...] with MEMORY_PROFILE=1
+        self.peak_rss = None
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.spans.append((name, seconds))
+
+    def add_memory(self, name, nbytes):
+        with self._lock:
+            self.memory.append((name, nbytes))
+
+    def server_timing(self):
+        """Value for the Server-Timing response header."""
+        with self._lock:
+            return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans)
+
+    def as_dict(self):
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, seconds in self.spans}
+
+    def memory_dict(self):
+        """{stage: peak allocation MiB}"""
+        with self._lock:
+            return {name: round(nbytes / 2**20, 1) for name, nbytes in self.memory}
+
+
+_current_trace = contextvars.ContextVar("mamameal_trace", default=None)
+# False in worker processes: their spans are observed by the parent (record_spans)
+_observe_spans = contextvars.ContextVar("mamameal_observe_spans", default=True)
+
+
+def start_trace():
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def record_span(name, seconds, observe=True):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+    if observe:
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+def record_memory(name, nbytes, observe=True):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_memory(name, nbytes)
+    if observe:
+        STAGE_ALLOC_PEAK.observe(nbytes, stage=name)
+
+
+def record_spans(spans, memory=()):
+    """Merge spans measured elsewhere (e.g. in a worker process) into this request."""
+    for name, seconds in spans:
+        record_span(name, seconds)
+    for name, nbytes in memory:
+        record_memory(name, nbytes)
+
+
+# --- tracemalloc per span ---
+# tracemalloc has a single process-wide peak. Each span resets it on entry and
+# folds the peak seen so far into the enclosing span first, so nested spans
+# (render > template_load) both get correct numbers.
+
+class _MemoryFrame:
+    __slots__ = ("base", "peak")
+
+    def __init__(self, base):
+        self.base = base
+        self.peak = base
+
+
+_memory_stack = contextvars.ContextVar("mamameal_memory_stack", default=())
+
+
+def _memory_enter():
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    stack = _memory_stack.get()
+    if stack:
+        stack[-1].peak = max(stack[-1].peak, peak)
+    tracemalloc.reset_peak()
+    frame = _MemoryFrame(current)
+    return frame, _memory_stack.set(stack + (frame,))
+
+
+def _memory_exit(state):
+    frame, token = state
+    frame.peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+    _memory_stack.reset(token)
+    stack = _memory_stack.get()
+    if stack:
+        stack[-1].peak = max(stack[-1].peak, frame.peak)
+    return frame.peak - frame.base
+
+
+@contextmanager
+def span(name):
+    memory = _memory_enter() if MEMORY_PROFILE else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe = _observe_spans.get()
+        record_span(name, time.perf_counter() - start, observe=observe)
+        if memory is not None:
+            record_memory(name, _memory_exit(memory), observe=observe)
+
+
+@contextmanager
+def collect_spans(observe=True):
+    """
+    Collect spans into a fresh trace. Worker side: observe=False leaves the
+    histograms to the parent, which observes the spans in record_spans().
+    """
+    if MEMORY_PROFILE and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    trace = Trace()
+    token = _current_trace.set(trace)
+    observe_token = _observe_spans.set(observe)
+    try:
+        yield trace
+    finally:
+        _observe_spans.reset(observe_token)
+        _current_trace.reset(token)
+
+
+# --- Peak RSS per request ---
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_rss_pid_sources = []
+
+
+def register_rss_pids(source):
+    """source(): extra process ids counted in the request RSS (e.g. workbook workers)."""
+    _rss_pid_sources.append(source)
+
+
+def read_rss(pid="self"):
+    """Resident set size in bytes, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def total_rss():
+    """RSS of this process plus registered helper processes."""
+    rss = read_rss()
+    if rss is None:
+        return None
+    for source in _rss_pid_sources:
+        try:
+            pids = list(source())
+        except Exception:
+            continue
+        rss += sum(read_rss(pid) or 0 for pid in pids)
+    return rss
+
+
+class RssSampler:
+    """Samples total_rss() every `interval` seconds while at least one window is open."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self._windows = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _sample(self):
+        rss = total_rss()
+        if rss is None:
+            return
+        with self._lock:
+            for window in self._windows:
+                window.peak = max(window.peak or 0, rss)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._windows:
+                    self._thread = None
+                    return
+            self._sample()
+            time.sleep(self.interval)
+
+    @contextmanager
+    def window(self):
+        """Yields an object whose .peak is the highest RSS seen while the block ran."""
+        window = _RssWindow()
+        with self._lock:
+            self._windows.add(window)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+        self._sample()
+        try:
+            yield window
+        finally:
+            self._sample()
+            with self._lock:
+                self._windows.discard(window)
+
+
+class _RssWindow:
+    __slots__ = ("peak",)
+
+    def __init__(self):
+        self.peak = None
+
+
+rss_sampler = RssSampler()
+
+
+def log_request(endpoint, status, seconds, trace):
+    """One structured (JSON) log line per request with all stage timings in ms."""
+    record = {
+        "event": "request_timing",
+        "endpoint": endpoint,
+        "status": status,
+        "total_ms": round(seconds * 1000, 1),
+        "stages": trace.as_dict() if trace is not None else {},
+    }
+    if trace is not None and trace.peak_rss is not None:
+        record["peak_rss_mb"] = round(trace.peak_rss / 2**20, 1)
+    if trace is not None and trace.memory:
+        record["alloc_peak_mb"] = trace.memory_dict()
+    logger.info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,137 @@
+"""
+Model backends for the AI steps (order bento headers, seal blocks).
+
+  - GeminiBackend: the live Gemini API (process_order_pdf_with_ai / generate_seal_data)
+  - ReplayBackend: recorded JSON responses keyed by the PDF's SHA-256, with
+                   optional artificial latency. No API key or network needed,
+                   so the service can be load-tested offline.
+
+Selected with environment variables (see get_model_backend):
+    MODEL_BACKEND=gemini|replay     (default: gemini)
+    MODEL_CASCADE=0                 (gemini: single model, no cascade; see api.model_cascade)
+    SHARED_CACHE=0                  (gemini: no cross-worker response cache; see api.shared_cache)
+    REPLAY_RESPONSES=<path>         (default: backend/bench/recorded_responses.json)
+    REPLAY_LATENCY=<seconds>        (default: 0)
+    REPLAY_JITTER=<seconds>         (default: 0, uniform extra delay)
+
+Recorded files are written by `python bench/pipeline_bench.py --record`.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+MODEL_BACKENDS = ("gemini", "replay")
+DEFAULT_REPLAY_RESPONSES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench", "recorded_responses.json"
+)
+
+
+def pdf_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+class ModelBackend:
+    """Interface used by the order pipeline and the seal endpoints."""
+
+    name = "base"
+
+    @property
+    def available(self):
+        """False when the backend cannot serve requests (e.g. no API key)."""
+        return True
+
+    def extract_order(self, pdf_bytes, model_name=None):
+        """Order PDF -> {'bento_headers': [...], 'clients': [...]}"""
+        raise NotImplementedError
+
+    def extract_seal(self, pdf_bytes, model_name=None):
+        """Seal PDF -> list of block dicts (client_name, preparations, class_name, ...)"""
+        raise NotImplementedError
+
+    def forget(self, pdf_bytes):
+        """Drop any cached response for this PDF (see api.shared_cache.CachedBackend)."""
+
+
+class GeminiBackend(ModelBackend):
+    name = "gemini"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    @property
+    def available(self):
+        return bool(self.api_key)
+
+    def extract_order(self, pdf_bytes, model_name=None):
+        from api.ai_processor import process_order_pdf_with_ai
+        if not self.api_key:
+            raise ValueError("API Key not configured for AI processing")
+        kwargs = {"model_name": model_name} if model_name else {}
+        return process_order_pdf_with_ai(pdf_bytes, self.api_key, **kwargs)
+
+    def extract_seal(self, pdf_bytes, model_name=None):
+        from api.seal_utils import generate_seal_data
+        kwargs = {"model_name": model_name} if model_name else {}
+        return generate_seal_data(pdf_bytes, api_key=self.api_key, **kwargs)
+
+
+class ReplayBackend(ModelBackend):
+    """
+    Serves recorded responses: {sha256: {"response": ..., ...}} (the format
+    of bench/recorded_responses.json) or plain {sha256: response}.
+    """
+
+    name = "replay"
+
+    def __init__(self, responses_path=DEFAULT_REPLAY_RESPONSES, latency=0.0, jitter=0.0):
+        self.responses_path = responses_path
+        self.latency = latency
+        self.jitter = jitter
+        with open(responses_path, encoding="utf-8") as f:
+            self.responses = json.load(f)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _replay(self, pdf_bytes):
+        key = pdf_hash(pdf_bytes)
+        entry = self.responses.get(key)
+        if entry is None:
+            raise ValueError(f"No recorded response for this PDF (sha256 {key[:12]}) in {self.responses_path}")
+        with self._lock:
+            self.calls += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        response = entry["response"] if isinstance(entry, dict) and "response" in entry else entry
+        # Callers may modify the result: hand out a copy
+        return json.loads(json.dumps(response))
+
+    def extract_order(self, pdf_bytes, model_name=None):
+        return self._replay(pdf_bytes)
+
+    def extract_seal(self, pdf_bytes, model_name=None):
+        return self._replay(pdf_bytes)
+
+
+def get_model_backend(api_key=None):
+    """Backend selected by MODEL_BACKEND (gemini by default)."""
+    name = os.getenv("MODEL_BACKEND", "gemini").strip().lower()
+    if name == "gemini":
+        if os.getenv("MODEL_CASCADE", "1") == "0":
+            backend = GeminiBackend(api_key)
+        else:
+            from api.model_cascade import CascadeBackend
+            backend = CascadeBackend(GeminiBackend(api_key))
+        from api.shared_cache import CachedBackend, get_shared_cache
+        cache = get_shared_cache()
+        return CachedBackend(backend, cache) if cache is not None else backend
+    if name == "replay":
+        return ReplayBackend(
+            os.getenv("REPLAY_RESPONSES", DEFAULT_REPLAY_RESPONSES),
+            latency=float(os.getenv("REPLAY_LATENCY", "0")),
+            jitter=float(os.getenv("REPLAY_JITTER", "0")),
+        )
+    raise ValueError(f"Invalid MODEL_BACKEND: {name}. Use one of {MODEL_BACKENDS}")
@@ -0,0 +1,273 @@
+"""
+Model cascade for the AI steps: the fastest / cheapest model first, a
+stronger model only for what fails validation.
+
+Seal PDFs (4 x 5 blocks per page):
+  - the PDF is split into chunks of SEAL_PAGES_PER_CALL pages (pypdfium2) and
+    every chunk goes to the first model (chunks run in parallel; the model
+    scheduler still applies its rate / concurrency limits)
+  - a chunk passes when it returns one block per block on its pages (counted
+    from the text layer: every block has a "〇〇様" line) and every block has
+    a client name and a parsable meal_count ("35", "35+1")
+  - when the count matches, blocks are attributed to pages in order and only
+    the pages holding invalid blocks are re-run; otherwise the whole chunk is
+    re-run, one page per call, on the next model
+  - the last model's result is kept even if it still fails validation
+
+Order PDFs: one call per model; the next model is tried when bento_headers is
+empty, has blank / duplicate entries, or a client order count is not a number.
+
+A model given explicitly (extract_*(pdf, model_name=...)) bypasses the cascade.
+
+    SEAL_MODEL_CASCADE="gemini-2.0-flash,gemini-3-flash-preview"
+    ORDER_MODEL_CASCADE="gemini-2.0-flash,gemini-2.5-flash"
+    SEAL_PAGES_PER_CALL=4
+    MODEL_CASCADE=0        (get_model_backend: no cascade)
+"""
+import io
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from api.metrics import Counter, REGISTRY
+from api.model_backend import ModelBackend
+
+DEFAULT_SEAL_CASCADE = "gemini-2.0-flash,gemini-3-flash-preview"
+DEFAULT_ORDER_CASCADE = "gemini-2.0-flash,gemini-2.5-flash"
+
+MEAL_COUNT_PATTERN = re.compile(r"^\s*\d+(\s*\+\s*\d+)*\s*$")
+
+CASCADE_RESULTS = Counter(
+    "mamameal_model_cascade_total",
+    "Cascade steps by model and outcome (accepted / escalated / kept after the last model).",
+    ["kind", "model", "outcome"],
+)
+REGISTRY.append(CASCADE_RESULTS)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_models(value, default):
+    models = [m.strip() for m in (value or default).split(",") if m.strip()]
+    return models or [m.strip() for m in default.split(",")]
+
+
+# --- Validation ---
+
+def expected_seal_blocks(pdf_bytes):
+    """Blocks per page from the text layer (one '様' per block), or None per page without text."""
+    from api.pdf_utils import open_pdf, iter_pages, pdfium_page_texts
+    from api.pdf_text_backend import text_backend
+    # PDFium's plain text pass, no layout analysis (pdfplumber only without pypdfium2)
+    texts = pdfium_page_texts(pdf_bytes)
+    if texts is not None:
+        return [text.count("様") or None for text in texts]
+    counts = []
+    with open_pdf(io.BytesIO(pdf_bytes), text_backend()) as pdf:
+        for page in iter_pages(pdf):
+            count = sum(1 for c in page.chars if c.get("text") == "様")
+            counts.append(count or None)
+    return counts
+
+
+def invalid_seal_block(block):
+    """Reason a seal block is unusable, or None."""
+    if not isinstance(block, dict):
+        return "not an object"
+    name = str(block.get("client_name") or "").strip()
+    if not name:
+        return "client_name missing"
+    meal_count = str(block.get("meal_count") or "").strip()
+    # Blank blocks at the end of a sheet only carry "様"
+    if name != "様" and not MEAL_COUNT_PATTERN.match(meal_count):
+        return f"meal_count not a number: {meal_count!r}"
+    return None
+
+
+def seal_response_problems(blocks, expected):
+    """
+    Reasons a seal block list is unusable ([] when it is fine).
+    expected: expected_seal_blocks() of the PDF; the block count is only
+    checked when every page has a text layer.
+    """
+    if not isinstance(blocks, list) or not blocks:
+        return ["no blocks"]
+    problems = []
+    if expected and None not in expected and len(blocks) != sum(expected):
+        problems.append(f"{len(blocks)} blocks, expected {sum(expected)}")
+    invalid = [reason for reason in map(invalid_seal_block, blocks) if reason]
+    if invalid:
+        problems.append(f"{len(invalid)} invalid blocks ({invalid[0]})")
+    return problems
+
+
+def order_response_problems(response):
+    """Reasons an order response is unusable ([] when it is fine)."""
+    if not isinstance(response, dict):
+        return ["response is not an object"]
+    headers = response.get("bento_headers")
+    if not isinstance(headers, list) or not headers:
+        return ["bento_headers missing"]
+    problems = []
+    if any(not isinstance(h, str) or not h.strip() for h in headers):
+        problems.append("blank bento header")
+    elif len(set(headers)) != len(headers):
+        problems.append("duplicate bento headers")
+    for client in response.get("clients") or []:
+        for order in (client.get("orders") or []) if isinstance(client, dict) else []:
+            count = order.get("count") if isinstance(order, dict) else None
+            if count is not None and not MEAL_COUNT_PATTERN.match(str(count)):
+                problems.append(f"order count not a number: {count!r}")
+                break
+    return problems
+
+
+# --- PDF pages ---
+
+def split_pdf(pdf_bytes, page_indexes):
+    """New PDF with only the given pages (0-based)."""
+    import pypdfium2 as pdfium
+    from api.pdf_text_backend import pdfium_lock
+    # Chunks are split from the cascade's worker threads; PDFium is not thread-safe
+    with pdfium_lock:
+        src = pdfium.PdfDocument(pdf_bytes)
+        dst = pdfium.PdfDocument.new()
+        try:
+            dst.import_pages(src, list(page_indexes))
+            buf = io.BytesIO()
+            dst.save(buf)
+            return buf.getvalue()
+        finally:
+            dst.close()
+            src.close()
+
+
+# --- Cascades ---
+
+class SealCascade:
+    """
+    extract(pdf_bytes, model_name) -> blocks is the single-model call
+    (GeminiBackend.extract_seal, or the Streamlit tab's own Gemini call).
+    Chunks run in up to `workers` threads; workers=1 keeps every call in the
+    calling thread.
+    """
+
+    def __init__(self, extract, models=None, pages_per_call=None, workers=4):
+        self.extract = extract
+        self.models = models or parse_models(os.getenv("SEAL_MODEL_CASCADE"), DEFAULT_SEAL_CASCADE)
+        self.pages_per_call = max(pages_per_call or int(os.getenv("SEAL_PAGES_PER_CALL", "4")), 1)
+        self.workers = max(workers, 1)
+
+    def run(self, pdf_bytes):
+        expected = expected_seal_blocks(pdf_bytes)
+        pages = list(range(len(expected)))
+        chunks = [pages[i:i + self.pages_per_call] for i in range(0, len(pages), self.pages_per_call)] or [[]]
+        if len(chunks) == 1:
+            return self._run_pages(pdf_bytes, pdf_bytes, chunks[0], expected, 0)
+        if self.workers == 1:
+            # In the calling thread (Streamlit: st.* calls in extract need the script thread)
+            return [block for chunk in chunks for block in self._run_pages(pdf_bytes, None, chunk, expected, 0)]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+            results = pool.map(lambda chunk: self._run_pages(pdf_bytes, None, chunk, expected, 0), chunks)
+            return [block for blocks in results for block in blocks]
+
+    def _run_pages(self, pdf_bytes, chunk_bytes, pages, expected, level):
+        model = self.models[level]
+        last = level == len(self.models) - 1
+        if chunk_bytes is None:
+            chunk_bytes = split_pdf(pdf_bytes, pages)
+        try:
+            blocks = self.extract(chunk_bytes, model) or []
+        except Exception as e:
+            if last:
+                raise
+            logger.warning(f"Seal cascade: {model} failed on pages {pages} ({e}), escalating")
+            CASCADE_RESULTS.inc(kind="seal", model=model, outcome="escalated")
+            return self._escalate(pdf_bytes, pages, expected, level)
+
+        counts = [expected[p] for p in pages] if pages else []
+        count_ok = not counts or None in counts or len(blocks) == sum(counts)
+        bad = [i for i, block in enumerate(blocks) if invalid_seal_block(block)]
+        if count_ok and not bad:
+            CASCADE_RESULTS.inc(kind="seal", model=model, outcome="accepted")
+            return blocks
+        if last:
+            CASCADE_RESULTS.inc(kind="seal", model=model, outcome="kept")
+            return blocks
+
+        CASCADE_RESULTS.inc(kind="seal", model=model, outcome="escalated")
+        if not count_ok or None in counts:
+            logger.warning(f"Seal cascade: {model} returned {len(blocks)} blocks for pages {pages} "
+                           f"(expected {sum(c or 0 for c in counts)}), escalating")
+            return self._escalate(pdf_bytes, pages, expected, level)
+
+        # Counts match: keep the good pages, re-run only the pages with invalid blocks
+        result, start = [], 0
+        for page, count in zip(pages, counts):
+            page_blocks = blocks[start:start + count]
+            if any(start <= i < start + count for i in bad):
+                logger.warning(f"Seal cascade: {model} invalid blocks on page {page}, escalating")
+                page_blocks = self._run_pages(pdf_bytes, None, [page], expected, level + 1)
+            result.extend(page_blocks)
+            start += count
+        return result
+
+    def _escalate(self, pdf_bytes, pages, expected, level):
+        if len(pages) <= 1:
+            chunk_bytes = None if pages else pdf_bytes
+            return self._run_pages(pdf_bytes, chunk_bytes, pages, expected, level + 1)
+        return [block for page in pages
+                for block in self._run_pages(pdf_bytes, None, [page], expected, level + 1)]
+
+
+def run_order_cascade(extract, pdf_bytes, models=None):
+    """extract(pdf_bytes, model_name) -> response; returns the first valid response (or the last one)."""
+    models = models or parse_models(os.getenv("ORDER_MODEL_CASCADE"), DEFAULT_ORDER_CASCADE)
+    for level, model in enumerate(models):
+        last = level == len(models) - 1
+        try:
+            response = extract(pdf_bytes, model)
+        except Exception as e:
+            if last:
+                raise
+            logger.warning(f"Order cascade: {model} failed ({e}), escalating")
+            CASCADE_RESULTS.inc(kind="order", model=model, outcome="escalated")
+            continue
+        problems = order_response_problems(response)
+        if not problems:
+            CASCADE_RESULTS.inc(kind="order", model=model, outcome="accepted")
+            return response
+        if last:
+            CASCADE_RESULTS.inc(kind="order", model=model, outcome="kept")
+            return response
+        logger.warning(f"Order cascade: {model} response rejected ({'; '.join(problems)}), escalating")
+        CASCADE_RESULTS.inc(kind="order", model=model, outcome="escalated")
+
+
+class CascadeBackend(ModelBackend):
+    """Wraps a single-model backend (GeminiBackend) with the cascades above."""
+
+    def __init__(self, backend, order_models=None, seal_models=None, pages_per_call=None):
+        self.backend = backend
+        self.name = f"{backend.name}-cascade"
+        self.order_models = order_models
+        self.seal_models = seal_models
+        self.pages_per_call = pages_per_call
+
+    @property
+    def available(self):
+        return self.backend.available
+
+    def extract_order(self, pdf_bytes, model_name=None):
+        if model_name:
+            return self.backend.extract_order(pdf_bytes, model_name=model_name)
+        return run_order_cascade(
+            lambda data, model: self.backend.extract_order(data, model_name=model), pdf_bytes, self.order_models)
+
+    def extract_seal(self, pdf_bytes, model_name=None):
+        if model_name:
+            return self.backend.extract_seal(pdf_bytes, model_name=model_name)
+        cascade = SealCascade(lambda data, model: self.backend.extract_seal(data, model_name=model),
+                              self.seal_models, self.pages_per_call)
+        return cascade.run(pdf_bytes)
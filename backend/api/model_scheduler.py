@@ -0,0 +1,299 @@
+"""
+Rate-limit-aware scheduler for Gemini calls.
+
+The generate_content calls of process_order_pdf_with_ai and
+generate_seal_data go through get_model_scheduler().call(model_name, fn, ...).
+Each model has its own lane (queue) with:
+
+  - a token bucket: at most GEMINI_RPM calls per minute, bursts of GEMINI_BURST
+  - bounded concurrency: at most GEMINI_CONCURRENCY calls in flight; further
+    callers wait in FIFO order, for up to GEMINI_QUEUE_TIMEOUT seconds
+  - retries: 429 / RESOURCE_EXHAUSTED, 408 / 5xx and connection errors are
+    retried up to GEMINI_MAX_RETRIES times, with exponential backoff and full
+    jitter (GEMINI_BACKOFF_BASE .. GEMINI_BACKOFF_MAX seconds) or the delay the
+    server asks for (Retry-After / RetryInfo.retryDelay). A 429 pauses the
+    whole lane for that delay, so a burst backs off together instead of every
+    caller hitting the quota again. A caller gives its slot back while it
+    sleeps and queues for one again before the next attempt.
+
+Per-model limits override the defaults:
+    GEMINI_MODEL_LIMITS="gemini-2.5-pro=5:2,gemini-2.0-flash=60:4"   (rpm:concurrency)
+
+MODEL_SCHEDULER=0 calls straight through (no limits, no retries).
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from api.metrics import Counter, Histogram, REGISTRY
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+MODEL_CALL_SECONDS = Histogram(
+    "mamameal_model_call_duration_seconds", "Duration of model API calls (per attempt).", ["model", "outcome"]
+)
+MODEL_QUEUE_SECONDS = Histogram(
+    "mamameal_model_queue_wait_seconds", "Time spent waiting for a model lane slot.", ["model"]
+)
+MODEL_RETRIES = Counter(
+    "mamameal_model_retries_total", "Model API calls retried, by reason.", ["model", "reason"]
+)
+REGISTRY.extend([MODEL_CALL_SECONDS, MODEL_QUEUE_SECONDS, MODEL_RETRIES])
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerTimeout(Exception):
+    """No lane slot became free within the queue timeout."""
+
+
+def error_status(exc):
+    """HTTP-like status of an API error (google-genai, google-api-core, httpx), or None."""
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return int(value)
+    value = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(value, int):
+        return value
+    if "RESOURCE_EXHAUSTED" in str(exc):
+        return 429
+    return None
+
+
+def is_transport_error(exc):
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(exc, httpx.TransportError)
+
+
+def is_retryable(exc):
+    return error_status(exc) in RETRYABLE_STATUS or is_transport_error(exc)
+
+
+def _find_retry_delay(obj):
+    """retryDelay ("12s" / "1.5s") from a google.rpc.RetryInfo anywhere in an error body."""
+    if isinstance(obj, dict):
+        delay = obj.get("retryDelay")
+        if isinstance(delay, str):
+            match = re.fullmatch(r"\s*([\d.]+)s\s*", delay)
+            if match:
+                return float(match.group(1))
+        obj = list(obj.values())
+    if isinstance(obj, list):
+        for item in obj:
+            delay = _find_retry_delay(item)
+            if delay is not None:
+                return delay
+    return None
+
+
+def server_retry_delay(exc):
+    """Delay the server asked for (Retry-After header or RetryInfo), in seconds, or None."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is not None:
+        try:
+            value = headers.get("retry-after")
+            if value is not None:
+                return max(float(value), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return _find_retry_delay(getattr(exc, "details", None))
+
+
+class TokenBucket:
+    """rate tokens per second, up to capacity. acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ModelLane:
+    """Queue, rate limit and concurrency limit of one model."""
+
+    def __init__(self, model_name, rpm, burst, concurrency):
+        self.model_name = model_name
+        self.bucket = TokenBucket(rpm / 60.0, burst)
+        self.concurrency = max(concurrency, 1)
+        self.active = 0
+        self.paused_until = 0.0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def queued(self):
+        with self._cond:
+            return len(self._waiting)
+
+    @contextmanager
+    def slot(self, timeout):
+        """Wait (FIFO) for a free concurrency slot."""
+        ticket = object()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while self._waiting[0] is not ticket or self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SchedulerTimeout(
+                            f"{self.model_name}: no free slot after {timeout:.0f}s ({len(self._waiting)} waiting)")
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._waiting.popleft()
+            self.active += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def pause(self, seconds):
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait_ready(self):
+        """Wait out a lane-wide pause, then take a rate-limit token."""
+        while True:
+            with self._cond:
+                wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self.bucket.acquire()
+
+
+def parse_model_limits(value):
+    """"model=rpm:concurrency,..." -> {model: (rpm, concurrency)}"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        model, spec = item.split("=", 1)
+        rpm, _, concurrency = spec.partition(":")
+        limits[model.strip()] = (float(rpm), int(concurrency) if concurrency else None)
+    return limits
+
+
+class ModelScheduler:
+    def __init__(self, rpm=60, burst=10, concurrency=4, max_retries=5, backoff_base=1.0, backoff_max=60.0,
+                 queue_timeout=300.0, model_limits=None, enabled=True):
+        self.rpm = rpm
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self.model_limits = model_limits or {}
+        self.enabled = enabled
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rpm=float(os.getenv("GEMINI_RPM", "60")),
+            burst=int(os.getenv("GEMINI_BURST", "10")),
+            concurrency=int(os.getenv("GEMINI_CONCURRENCY", "4")),
+            max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "5")),
+            backoff_base=float(os.getenv("GEMINI_BACKOFF_BASE", "1")),
+            backoff_max=float(os.getenv("GEMINI_BACKOFF_MAX", "60")),
+            queue_timeout=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "300")),
+            model_limits=parse_model_limits(os.getenv("GEMINI_MODEL_LIMITS")),
+            enabled=os.getenv("MODEL_SCHEDULER", "1") != "0",
+        )
+
+    def lane(self, model_name):
+        with self._lock:
+            lane = self._lanes.get(model_name)
+            if lane is None:
+                rpm, concurrency = self.model_limits.get(model_name, (self.rpm, None))
+                lane = self._lanes[model_name] = ModelLane(
+                    model_name, rpm, min(self.burst, max(int(rpm), 1)), concurrency or self.concurrency)
+            return lane
+
+    def backoff(self, attempt):
+        """Full jitter: uniform(0, min(max, base * 2^attempt))."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, model_name, fn, *args, **kwargs):
+        """fn(*args, **kwargs) within model_name's limits, retrying transient errors."""
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        lane = self.lane(model_name)
+        attempt = 0
+        while True:
+            queued_at = time.monotonic()
+            # The slot is held for one attempt: a retry sleeps its backoff without it
+            with lane.slot(self.queue_timeout):
+                MODEL_QUEUE_SECONDS.observe(time.monotonic() - queued_at, model=model_name)
+                lane.wait_ready()
+                start = time.monotonic()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    status = error_status(e)
+                    retryable = is_retryable(e)
+                    MODEL_CALL_SECONDS.observe(time.monotonic() - start, model=model_name,
+                                               outcome=str(status) if status else "error")
+                    if not retryable or attempt >= self.max_retries:
+                        raise
+                    delay = server_retry_delay(e)
+                    if delay is None:
+                        delay = self.backoff(attempt)
+                    else:
+                        delay = min(delay, self.backoff_max) + random.uniform(0, self.backoff_base)
+                    if status == 429:
+                        lane.pause(delay)
+                    MODEL_RETRIES.inc(model=model_name, reason=str(status) if status else "transport")
+                    logger.warning(f"Model call to {model_name} failed ({e.__class__.__name__}: {status or e}), "
+                                   f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                else:
+                    MODEL_CALL_SECONDS.observe(time.monotonic() - start, model=model_name, outcome="ok")
+                    return result
+            time.sleep(delay)
+            attempt += 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_model_scheduler():
+    """Process-wide scheduler configured from the environment."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ModelScheduler.from_env()
+        return _scheduler
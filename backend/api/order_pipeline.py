@@ -0,0 +1,370 @@
+"""
+数出表・納品書 order pipeline shared by the FastAPI backend and the Streamlit app.
+
+The pipeline runs in explicit stages so each front-end (and each cache) can
+hook in at the same points:
+
+  1. load_masters  - 商品マスタ / 得意先マスタ, cached per master version
+  2. extract       - bento headers (AI or rule-based table) + client grid from the PDF layout
+  3. build_sheets  - DataFrames for 注文弁当の抽出 / クライアント抽出 / 貼り付け用
+  4. render        - 数出表 (template.xlsm) and 納品書 (nouhinsyo.xlsx)
+
+Stages 3-4 only depend on the extraction output, so after a master or
+template change the workbooks can be regenerated from a saved extraction
+(rerender) without reading the PDF or calling the AI again.
+"""
+import io
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from api.master_utils import find_master_file, read_master_csv
+from api.pdf_utils import (
+    open_pdf, match_bento_data, build_bento_match_index, extract_detailed_client_info_from_pdf, pdf_to_excel_data_for_paste_sheet,
+    extract_table_from_pdf_for_bento, extract_bento_headers_from_table, find_correct_anchor_for_bento,
+    extract_bento_range_for_bento, export_detailed_client_data_to_dataframe
+)
+from api.workbook_utils import build_order_workbooks
+from api.metrics import span
+from api.model_backend import GeminiBackend
+from api.model_cascade import order_response_problems
+
+PRODUCT_MASTER = "商品マスタ"
+CUSTOMER_MASTER = "得意先マスタ"
+TEMPLATE_FILENAME = "template.xlsm"
+NOUHINSYO_FILENAME = "nouhinsyo.xlsx"
+
+CLIENT_BASE_COLUMNS = ['クライアントID', 'クライアント名', 'クライアント名（顧客向け）']
+BENTO_SHEET_COLUMNS = ['商品予定名', 'パン箱入数', '売価単価', '弁当区分']
+# Number of bento columns assumed when no headers could be extracted
+DEFAULT_BENTO_COLS = 5
+
+HEADER_SOURCES = ("ai", "table")
+SHEET_LAYOUTS = ("backend", "streamlit")
+
+# Recorded with every stored extraction; only extractions of the current
+# version are reused. Bump it when the prompt, the PDF parsing or the model
+# cascade changes what an extraction contains.
+EXTRACTION_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MasterSet:
+    """
+    Parsed master data of one master version. Shared between requests and
+    never modified after load_masters: a request keeps the MasterSet it
+    started with while a master upload swaps in a new one.
+    """
+    product: pd.DataFrame
+    customer: pd.DataFrame
+    product_filename: Optional[str] = None
+    customer_filename: Optional[str] = None
+    # master_key() of the files this set was parsed from
+    key: Optional[tuple] = None
+    # 得意先CD(A列) -> 得意先名(B列)
+    customer_name_map: Dict[str, str] = field(default_factory=dict)
+    # 商品マスタの弁当名照合インデックス (build_bento_match_index)
+    bento_index: Optional[dict] = None
+
+
+@dataclass
+class OrderExtraction:
+    """Everything the pipeline reads from the order PDF."""
+    bento_headers: List[str]
+    clients: List[dict]
+    paste_sheet: Optional[pd.DataFrame] = None
+
+    def to_dict(self) -> dict:
+        """JSON-serialisable form (kept by the result store for re-rendering)."""
+        return {
+            "bento_headers": list(self.bento_headers or []),
+            "clients": self.clients,
+            "paste_sheet": self.paste_sheet.values.tolist() if self.paste_sheet is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "OrderExtraction":
+        rows = data.get("paste_sheet")
+        return cls(
+            bento_headers=list(data.get("bento_headers") or []),
+            clients=list(data.get("clients") or []),
+            paste_sheet=pd.DataFrame(rows) if rows is not None else None,
+        )
+
+
+@dataclass
+class OrderSheets:
+    """DataFrames written into the 数出表 / 納品書 workbooks."""
+    bento_headers: List[str]
+    client_sheet: Optional[pd.DataFrame]
+    bento_sheet: Optional[pd.DataFrame]
+    paste_sheet: pd.DataFrame
+
+
+@dataclass
+class OrderResult:
+    template_bytes: bytes
+    nouhinsyo_bytes: bytes
+    extraction: OrderExtraction
+    sheets: OrderSheets
+    # MasterSet.key of the masters the workbooks were rendered with
+    master_key: Optional[tuple] = None
+
+
+def build_customer_name_map(df_customer_master: pd.DataFrame) -> Dict[str, str]:
+    """Create lookup dictionary: 得意先CD(A列) -> 得意先名(B列, 顧客向け正式名称)"""
+    customer_name_map = {}
+    if df_customer_master.empty:
+        return customer_name_map
+    col_names = list(df_customer_master.columns)
+    if len(col_names) >= 2:
+        ids = df_customer_master[col_names[0]].astype(str).str.strip()
+        names = df_customer_master[col_names[1]].astype(str).str.strip()
+        for cid, cname in zip(ids, names):
+            if cid and cname:
+                customer_name_map[cid] = cname
+    return customer_name_map
+
+
+def bento_search_key(b_name: str) -> str:
+    """
+    User requested grouping logic:
+    "Charaben..." -> Search "キャラ", "Red..." -> Search "赤"
+    """
+    if "キャラ弁" in b_name:
+        return "キャラ"
+    if b_name.startswith("赤 ") or b_name == "赤":  # Match "赤 飯あり..."
+        return "赤"
+    return b_name
+
+
+class OrderPipeline:
+    """
+    Converts an order PDF into the 数出表 and 納品書 workbooks.
+
+    header_source selects how the bento column headers are read:
+      - "ai":    the model backend (Gemini by default, which requires api_key;
+                 pass model_backend=ReplayBackend(...) to replay recorded responses)
+      - "table": rule-based lattice table extraction (no API key needed);
+                 also fills the legacy 貼り付け用 sheet from the first page
+
+    model_name pins the AI model; None leaves the choice to the backend
+    (gemini-2.0-flash, or the fast -> strong cascade of api.model_cascade).
+
+    sheet_layout selects what goes into 注文弁当の抽出 / クライアント抽出:
+      - "backend":   bento names read from the header rows (table mode) and
+                     matched by search key; clients as ID / name / customer
+                     name + one student and one teacher column per bento,
+                     under a header row
+      - "streamlit": the layout of the root template.xlsm the Streamlit app
+                     writes: the bento columns between 飯なし and おやつ matched
+                     as they are; clients as クライアント名 + 園児の給食の数1-3 +
+                     先生の給食の数1-2, without a header row
+    """
+
+    def __init__(self, assets_dir: str, api_key: Optional[str] = None,
+                 header_source: str = "ai", model_name: Optional[str] = None,
+                 model_backend=None, sheet_layout: str = "backend"):
+        if header_source not in HEADER_SOURCES:
+            raise ValueError(f"Invalid header_source: {header_source}. Use one of {HEADER_SOURCES}")
+        if sheet_layout not in SHEET_LAYOUTS:
+            raise ValueError(f"Invalid sheet_layout: {sheet_layout}. Use one of {SHEET_LAYOUTS}")
+        self.assets_dir = assets_dir
+        self.api_key = api_key
+        self.header_source = header_source
+        self.model_name = model_name
+        self.sheet_layout = sheet_layout
+        self.model_backend = model_backend if model_backend is not None else GeminiBackend(api_key)
+        # Current MasterSet; replaced as a whole (a single reference swap), so reads need no lock
+        self._masters = None
+
+    # --- Stage 1: Masters ---
+    def master_key(self) -> tuple:
+        """(path, mtime) of the current product / customer master files (the master version)."""
+        paths = (find_master_file(self.assets_dir, PRODUCT_MASTER),
+                 find_master_file(self.assets_dir, CUSTOMER_MASTER))
+        return tuple((p, os.path.getmtime(p)) if p else None for p in paths)
+
+    def template_key(self) -> tuple:
+        """(path, mtime) of both templates, for caching rendered output."""
+        return tuple((p, os.path.getmtime(p)) for p in self.template_paths())
+
+    def load_masters(self, key: Optional[tuple] = None) -> MasterSet:
+        """
+        Masters of the current version (or of `key`, a master_key() taken
+        earlier), re-parsing only when the version changed.
+        """
+        if key is None:
+            key = self.master_key()
+        current = self._masters
+        if current is not None and current.key == key:
+            return current
+        product_path = key[0][0] if key[0] else None
+        customer_path = key[1][0] if key[1] else None
+
+        df_product = read_master_csv(product_path) if product_path else None
+        df_customer = read_master_csv(customer_path) if customer_path else None
+        masters = MasterSet(
+            product=df_product if df_product is not None else pd.DataFrame(),
+            customer=df_customer if df_customer is not None else pd.DataFrame(),
+            product_filename=os.path.basename(product_path) if df_product is not None else None,
+            customer_filename=os.path.basename(customer_path) if df_customer is not None else None,
+            key=key,
+        )
+        masters.customer_name_map = build_customer_name_map(masters.customer)
+        masters.bento_index = build_bento_match_index(masters.product)
+
+        # Concurrent loads of the same new version may both parse; the last one wins, both are equal
+        if key == self.master_key():
+            self._masters = masters
+        return masters
+
+    def invalidate(self):
+        """Drop cached masters (call after a master upload)."""
+        self._masters = None
+
+    def template_paths(self) -> Tuple[str, str]:
+        template_path = os.path.join(self.assets_dir, TEMPLATE_FILENAME)
+        nouhinsyo_path = os.path.join(self.assets_dir, NOUHINSYO_FILENAME)
+        if not os.path.exists(template_path) or not os.path.exists(nouhinsyo_path):
+            raise FileNotFoundError("Template files not found")
+        return template_path, nouhinsyo_path
+
+    # --- Stage 2: Extraction ---
+    def extract_bento_headers(self, pdf_bytes: bytes, pdf=None, release_pages: bool = True) -> List[str]:
+        if self.header_source == "ai":
+            with span("ai_call"):
+                ai_result = self.model_backend.extract_order(pdf_bytes, model_name=self.model_name)
+            # The model sometimes answers with a bare list / string: no headers, like a reply without them
+            # (the cascade already escalated it; an extraction without headers is never reused)
+            headers = ai_result.get('bento_headers') if isinstance(ai_result, dict) else None
+            if not isinstance(headers, list):
+                logger.warning(f"Order extraction: unusable AI response "
+                               f"({'; '.join(order_response_problems(ai_result))}), no bento headers")
+                return []
+            return headers
+
+        with span("table_extract"):
+            tables = extract_table_from_pdf_for_bento(pdf if pdf is not None else io.BytesIO(pdf_bytes),
+                                                      release_pages=release_pages)
+            if not tables:
+                return []
+            main_table = max(tables, key=len)
+            if self.sheet_layout == "streamlit":
+                anchor_col = find_correct_anchor_for_bento(main_table)
+                return extract_bento_range_for_bento(main_table, anchor_col) if anchor_col != -1 else []
+            return extract_bento_headers_from_table(main_table)
+
+    def extract(self, pdf_bytes: bytes) -> OrderExtraction:
+        # Parse the PDF once and share it between the extractors. Pages are
+        # released by the last extractor that reads them (layout_extract), so
+        # memory stays at one page in "ai" mode. "table" mode keeps the pages
+        # parsed until then instead of parsing them twice.
+        table_mode = self.header_source == "table"
+        with open_pdf(io.BytesIO(pdf_bytes)) as pdf:
+            bento_headers = self.extract_bento_headers(pdf_bytes, pdf, release_pages=not table_mode)
+
+            paste_sheet = None
+            if table_mode:
+                with span("paste_extract"):
+                    paste_sheet = pdf_to_excel_data_for_paste_sheet(pdf, release_pages=False)
+                if paste_sheet is None:
+                    raise ValueError("Failed to extract layout data from PDF")
+
+            # Clients always come from the layout extraction ('extract_text_with_layout'),
+            # which robustly finds the student / teacher rows.
+            with span("layout_extract"):
+                clients = extract_detailed_client_info_from_pdf(pdf, compact=self.sheet_layout == "streamlit")
+
+        return OrderExtraction(bento_headers=bento_headers, clients=clients, paste_sheet=paste_sheet)
+
+    # --- Stage 3: Sheets ---
+    def build_client_sheet(self, extraction: OrderExtraction, masters: MasterSet) -> Optional[pd.DataFrame]:
+        if self.sheet_layout == "streamlit":
+            return export_detailed_client_data_to_dataframe(extraction.clients) if extraction.clients else None
+        bento_headers = extraction.bento_headers
+        num_bento_cols = len(bento_headers) if bento_headers else DEFAULT_BENTO_COLS
+
+        client_rows = []
+        for info in extraction.clients:
+            s_list = info.get('student_meals', [])
+            t_list = info.get('teacher_meals', [])
+            client_id = str(info.get('client_id', '')).strip()
+
+            # Add client_id (A列), client_name (B列), customer_facing_name (C列)
+            row = {
+                'クライアントID': info.get('client_id', ''),
+                'クライアント名': info['client_name'],
+                'クライアント名（顧客向け）': masters.customer_name_map.get(client_id, '')
+            }
+            # Dynamic Columns: Student 1..N (D列から開始), then Teacher 1..N
+            for i in range(num_bento_cols):
+                row[f's_{i}'] = s_list[i] if i < len(s_list) else ''
+            for i in range(num_bento_cols):
+                row[f't_{i}'] = t_list[i] if i < len(t_list) else ''
+            client_rows.append(row)
+
+        if not client_rows:
+            return None
+        # Enforce column order: ID, Client, CustomerName, S...S, T...T
+        cols = CLIENT_BASE_COLUMNS + [f's_{i}' for i in range(num_bento_cols)] + [f't_{i}' for i in range(num_bento_cols)]
+        return pd.DataFrame(client_rows)[cols]
+
+    def build_bento_sheet(self, extraction: OrderExtraction, masters: MasterSet) -> Optional[pd.DataFrame]:
+        if not extraction.bento_headers:
+            return None
+        if self.sheet_layout == "streamlit":
+            matched_data = match_bento_data(extraction.bento_headers, masters.product, index=masters.bento_index)
+            return pd.DataFrame(matched_data, columns=BENTO_SHEET_COLUMNS)
+        matched_data = []
+        for b_name in extraction.bento_headers:
+            # We use search_key to find the row, but keep b_name for the Excel Name column
+            match_res = match_bento_data([bento_search_key(b_name)], masters.product, index=masters.bento_index)
+            if match_res:
+                m_row = match_res[0]
+                # [Original_Name, Box, Price, Type]
+                matched_data.append([b_name, m_row[1], m_row[2], m_row[3]])
+        return pd.DataFrame(matched_data, columns=BENTO_SHEET_COLUMNS)
+
+    def build_sheets(self, extraction: OrderExtraction, masters: MasterSet) -> OrderSheets:
+        paste_sheet = extraction.paste_sheet if extraction.paste_sheet is not None else pd.DataFrame()
+        with span("client_sheet"):
+            client_sheet = self.build_client_sheet(extraction, masters)
+        with span("bento_match"):
+            bento_sheet = self.build_bento_sheet(extraction, masters)
+        return OrderSheets(
+            bento_headers=extraction.bento_headers,
+            client_sheet=client_sheet,
+            bento_sheet=bento_sheet,
+            paste_sheet=paste_sheet,
+        )
+
+    # --- Stage 4: Render ---
+    def render(self, sheets: OrderSheets, masters: MasterSet) -> Tuple[bytes, bytes]:
+        template_path, nouhinsyo_path = self.template_paths()
+        with span("render"):
+            return build_order_workbooks(
+                template_path, nouhinsyo_path,
+                masters.product, masters.customer,
+                sheets.paste_sheet, sheets.bento_sheet, sheets.client_sheet,
+                sheets.bento_headers, client_header=self.sheet_layout == "backend"
+            )
+
+    def run(self, pdf_bytes: bytes) -> OrderResult:
+        # Fail before the expensive stages if the templates are missing
+        self.template_paths()
+        return self.rerender(self.extract(pdf_bytes))
+
+    def rerender(self, extraction: OrderExtraction) -> OrderResult:
+        """Stages 3-4 only: workbooks from an existing extraction with the current masters / templates."""
+        self.template_paths()
+        with span("masters"):
+            masters = self.load_masters()
+        sheets = self.build_sheets(extraction, masters)
+        template_bytes, nouhinsyo_bytes = self.render(sheets, masters)
+        return OrderResult(template_bytes, nouhinsyo_bytes, extraction, sheets, masters.key)
@@ -0,0 +1,305 @@
+"""
+Text backends for the layout extraction (api.pdf_utils).
+
+extract_text_with_layout / get_vertical_boundaries only use a few members of
+a pdfplumber page: chars, extract_words(), extract_text() and lines. Two
+backends provide them:
+
+  - "pdfplumber": pdfplumber / pdfminer.six (pure Python layout analysis)
+  - "pdfium":     PdfiumPDF / PdfiumPage below. Characters (loose glyph boxes)
+                  and straight line segments come from PDFium (pypdfium2), so
+                  the page is parsed in C. Words and text are still built by
+                  pdfplumber's WordExtractor from those chars, with the same
+                  x/y tolerances, so rows and columns match pdfplumber's.
+
+PDFium sizes glyphs of non-embedded fonts from the substitute font it renders
+with, while pdfminer uses the widths declared in the PDF, so the boxes (and
+the word splits) can differ. Pages that use a non-embedded font are therefore
+read with pdfplumber even when the pdfium backend is selected (page.backend
+says which one was used).
+
+Only text / words / lines: table extraction (page.extract_table) and
+page.rects stay on pdfplumber.
+
+The backend is chosen per call (backend="pdfium") or by environment:
+    PDF_TEXT_BACKEND=pdfplumber|pdfium    (default pdfplumber)
+
+bench/pdf_text_backend_bench.py checks parity with pdfplumber and times both.
+
+PDFium is not thread-safe: every call into it holds pdfium_lock.
+"""
+import io
+import logging
+import os
+import threading
+
+PDF_TEXT_BACKENDS = ("pdfplumber", "pdfium")
+DEFAULT_PDF_TEXT_BACKEND = "pdfplumber"
+
+pdfium_lock = threading.RLock()
+
+logger = logging.getLogger(__name__)
+
+
+def text_backend(backend=None):
+    """backend, or PDF_TEXT_BACKEND, or the default; unknown names raise ValueError."""
+    name = (backend or os.getenv("PDF_TEXT_BACKEND") or DEFAULT_PDF_TEXT_BACKEND).strip().lower()
+    if name not in PDF_TEXT_BACKENDS:
+        raise ValueError(f"Unknown PDF text backend: {name!r} (expected one of {', '.join(PDF_TEXT_BACKENDS)})")
+    return name
+
+
+def _multiply(m, n):
+    """Matrix product m x n of (a, b, c, d, e, f) PDF matrices (apply m, then n)."""
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a * a2 + b * c2, a * b2 + b * d2,
+            c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2)
+
+
+def _object_matrix(raw_obj):
+    import ctypes
+    import pypdfium2.raw as pdfium_c
+    matrix = pdfium_c.FS_MATRIX()
+    if not pdfium_c.FPDFPageObj_GetMatrix(raw_obj, ctypes.byref(matrix)):
+        return (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    return (matrix.a, matrix.b, matrix.c, matrix.d, matrix.e, matrix.f)
+
+
+class PdfiumPage:
+    """
+    The pdfplumber.Page members the layout extraction uses, from PDFium.
+    Chars and lines are read in one pass on first access; the PDFium page is
+    closed right after, so only the Python dicts stay until close().
+    """
+
+    def __init__(self, pdf, index, doctop):
+        self.pdf = pdf
+        self.page_number = index + 1
+        self.initial_doctop = doctop
+        self.backend = "pdfium"
+        self._chars = None
+        self._lines = None
+        self._fallback = None
+        self.width = self.height = None
+        self.bbox = None
+
+    @property
+    def chars(self):
+        self._ensure_loaded()
+        return self._fallback.chars if self._fallback is not None else self._chars
+
+    @property
+    def lines(self):
+        self._ensure_loaded()
+        return self._fallback.lines if self._fallback is not None else self._lines
+
+    def extract_words(self, **kwargs):
+        from pdfplumber import utils
+        self._ensure_loaded()
+        if self._fallback is not None:
+            return self._fallback.extract_words(**kwargs)
+        return utils.extract_words(self._chars, **kwargs)
+
+    def extract_text(self, **kwargs):
+        from pdfplumber import utils
+        self._ensure_loaded()
+        if self._fallback is not None:
+            return self._fallback.extract_text(**kwargs)
+        return utils.extract_text(self._chars, **kwargs)
+
+    def close(self):
+        if self._fallback is not None:
+            self._fallback.close()
+        self._chars = None
+        self._lines = None
+        self._fallback = None
+
+    def _ensure_loaded(self):
+        if self._chars is None and self._fallback is None:
+            self._load()
+
+    def _load(self):
+        with pdfium_lock:
+            page = self.pdf.doc[self.page_number - 1]
+            try:
+                x0, y0, x1, y1 = page.get_mediabox()
+                self.bbox = (0.0, 0.0, x1 - x0, y1 - y0)
+                self.width, self.height = x1 - x0, y1 - y0
+                # pdfplumber coordinates: origin at the top left of the media box
+                to_plumber = (1.0, 0.0, 0.0, -1.0, -x0, y1)
+                textpage = page.get_textpage()
+                try:
+                    chars = self._read_chars(textpage, to_plumber)
+                finally:
+                    textpage.close()
+                if chars is not None:
+                    self._lines = self._read_lines(page, to_plumber)
+            finally:
+                page.close()
+        if chars is None:
+            logger.debug(f"Page {self.page_number} uses a non-embedded font, reading it with pdfplumber")
+            self.backend = "pdfplumber"
+            self._fallback = self.pdf.plumber_page(self.page_number - 1)
+        else:
+            self._chars = chars
+
+    def _read_chars(self, textpage, to_plumber):
+        """Chars in pdfplumber's format, or None when a font is not embedded."""
+        import ctypes
+        import pypdfium2.raw as pdfium_c
+        raw = textpage.raw
+        embedded = {}
+        left, bottom, right, top = (ctypes.c_double() for _ in range(4))
+        rect = pdfium_c.FS_RECTF()
+        matrix = pdfium_c.FS_MATRIX()
+        _, _, _, _, dx, page_top = to_plumber
+        chars = []
+        count = pdfium_c.FPDFText_CountChars(raw)
+        i = 0
+        while i < count:
+            index = i
+            i += 1
+            # Spaces / line breaks PDFium infers from the layout are not in the content stream
+            if pdfium_c.FPDFText_IsGenerated(raw, index):
+                continue
+            font = pdfium_c.FPDFTextObj_GetFont(pdfium_c.FPDFText_GetTextObject(raw, index))
+            font_id = ctypes.cast(font, ctypes.c_void_p).value
+            if font_id not in embedded:
+                embedded[font_id] = bool(font) and bool(pdfium_c.FPDFFont_GetIsEmbedded(font))
+            if not embedded[font_id]:
+                return None
+            code = pdfium_c.FPDFText_GetUnicode(raw, index)
+            if 0xD800 <= code < 0xDC00 and i < count:
+                low = pdfium_c.FPDFText_GetUnicode(raw, i)
+                if 0xDC00 <= low < 0xE000:
+                    code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                    i += 1
+            text = chr(code)
+            if text in "\r\n\x00\ufffe":
+                continue
+            if pdfium_c.FPDFText_GetLooseCharBox(raw, index, ctypes.byref(rect)):
+                cx0, cx1, cy0, cy1 = rect.left, rect.right, rect.bottom, rect.top
+            elif pdfium_c.FPDFText_GetCharBox(raw, index, left, right, bottom, top):
+                cx0, cx1, cy0, cy1 = left.value, right.value, bottom.value, top.value
+            else:
+                continue
+            upright = True
+            if pdfium_c.FPDFText_GetMatrix(raw, index, ctypes.byref(matrix)):
+                # pdfminer: upright when the glyph is neither rotated nor mirrored
+                upright = matrix.a * matrix.d > 0 and matrix.b * matrix.c <= 0
+            char_top, char_bottom = page_top - cy1, page_top - cy0
+            chars.append({
+                "object_type": "char",
+                "page_number": self.page_number,
+                "text": text,
+                "x0": cx0 + dx,
+                "x1": cx1 + dx,
+                "top": char_top,
+                "bottom": char_bottom,
+                "doctop": self.initial_doctop + char_top,
+                "width": cx1 - cx0,
+                "height": char_bottom - char_top,
+                "size": (char_bottom - char_top) if upright else (cx1 - cx0),
+                "upright": upright,
+            })
+        return chars
+
+    def _read_lines(self, page, to_plumber):
+        """
+        Straight segments, like pdfminer's LTLine: every subpath of a path
+        object that is a single move + line ("m l", optionally closed).
+        Paths inside form XObjects are included (with the form matrix).
+        """
+        import pypdfium2.raw as pdfium_c
+        lines = []
+
+        def visit(raw_obj, parent_matrix):
+            obj_type = pdfium_c.FPDFPageObj_GetType(raw_obj)
+            if obj_type == pdfium_c.FPDF_PAGEOBJ_FORM:
+                matrix = _multiply(_object_matrix(raw_obj), parent_matrix)
+                for k in range(pdfium_c.FPDFFormObj_CountObjects(raw_obj)):
+                    visit(pdfium_c.FPDFFormObj_GetObject(raw_obj, k), matrix)
+            elif obj_type == pdfium_c.FPDF_PAGEOBJ_PATH:
+                self._path_lines(raw_obj, _multiply(_object_matrix(raw_obj), parent_matrix), lines)
+
+        for k in range(pdfium_c.FPDFPage_CountObjects(page.raw)):
+            visit(pdfium_c.FPDFPage_GetObject(page.raw, k), to_plumber)
+        return lines
+
+    def _path_lines(self, raw_obj, matrix, lines):
+        import ctypes
+        import pypdfium2.raw as pdfium_c
+        a, b, c, d, e, f = matrix
+        fill_mode, stroke = ctypes.c_int(), ctypes.c_int()
+        pdfium_c.FPDFPath_GetDrawMode(raw_obj, ctypes.byref(fill_mode), ctypes.byref(stroke))
+        x, y = ctypes.c_float(), ctypes.c_float()
+        subpaths, current = [], None
+        for k in range(pdfium_c.FPDFPath_CountSegments(raw_obj)):
+            segment = pdfium_c.FPDFPath_GetPathSegment(raw_obj, k)
+            kind = pdfium_c.FPDFPathSegment_GetType(segment)
+            pdfium_c.FPDFPathSegment_GetPoint(segment, ctypes.byref(x), ctypes.byref(y))
+            point = (a * x.value + c * y.value + e, b * x.value + d * y.value + f)
+            if kind == pdfium_c.FPDF_SEGMENT_MOVETO or current is None:
+                current = []
+                subpaths.append(current)
+            current.append((kind, point))
+        for subpath in subpaths:
+            kinds = [kind for kind, _ in subpath]
+            if kinds != [pdfium_c.FPDF_SEGMENT_MOVETO, pdfium_c.FPDF_SEGMENT_LINETO]:
+                continue
+            (px0, ptop0), (px1, ptop1) = (point for _, point in subpath)
+            x0, x1 = min(px0, px1), max(px0, px1)
+            top, bottom = min(ptop0, ptop1), max(ptop0, ptop1)
+            lines.append({
+                "object_type": "line",
+                "page_number": self.page_number,
+                "x0": x0, "x1": x1, "top": top, "bottom": bottom,
+                "doctop": self.initial_doctop + top,
+                "width": x1 - x0, "height": bottom - top,
+                "pts": [(px0, ptop0), (px1, ptop1)],
+                "stroke": bool(stroke.value), "fill": bool(fill_mode.value),
+            })
+
+
+class PdfiumPDF:
+    """
+    pdfplumber.PDF stand-in (pages / close / with) backed by PdfiumPage.
+    plumber_pdf: an already open pdfplumber.PDF of the same file, used for the
+    fallback pages (otherwise the source is opened with pdfplumber on demand).
+    """
+
+    def __init__(self, source, plumber_pdf=None):
+        import pypdfium2 as pdfium
+        self.source = source
+        self._plumber = plumber_pdf
+        self._owns_plumber = plumber_pdf is None
+        with pdfium_lock:
+            self.doc = pdfium.PdfDocument(source)
+            self.pages = []
+            doctop = 0.0
+            for i in range(len(self.doc)):
+                self.pages.append(PdfiumPage(self, i, doctop))
+                doctop += self.doc.get_page_size(i)[1]
+
+    def plumber_page(self, index):
+        import pdfplumber
+        if self._plumber is None:
+            source = io.BytesIO(self.source) if isinstance(self.source, bytes) else self.source
+            self._plumber = pdfplumber.open(source)
+        return self._plumber.pages[index]
+
+    def close(self):
+        with pdfium_lock:
+            for page in self.pages:
+                page.close()
+            self.doc.close()
+        if self._plumber is not None and self._owns_plumber:
+            self._plumber.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -18,8 +18,48 @@ import pandas as pd
 import pdfplumber
 import re
 import unicodedata
+from contextlib import contextmanager
 from typing import List, Dict, Any
 
+from api.pdf_text_backend import PdfiumPDF, pdfium_lock, text_backend
+
+@contextmanager
+def open_pdf(pdf_file, backend="pdfplumber"):
+    """
+    pdfplumber.open のラッパー。既に開いている PDF はそのまま使い回す
+    (close は開いた側が行う) ので、1 回のパースを複数の抽出処理で共有できる。
+    backend="pdfium" ならテキスト / 単語 / 罫線だけを pypdfium2 で読む
+    PdfiumPDF を返す (api.pdf_text_backend。extract_table は使えない)。
+    """
+    if backend == "pdfium":
+        if isinstance(pdf_file, PdfiumPDF):
+            yield pdf_file
+        else:
+            plumber_pdf = pdf_file if isinstance(pdf_file, pdfplumber.PDF) else None
+            with PdfiumPDF(_raw_pdf_source(pdf_file), plumber_pdf) as pdf:
+                yield pdf
+    elif isinstance(pdf_file, pdfplumber.PDF):
+        yield pdf_file
+    else:
+        with pdfplumber.open(pdf_file) as pdf:
+            yield pdf
+
+def iter_pages(pdf, release=True, limit=None):
+    """
+    ページを 1 枚ずつ返す。release=True なら使い終わったページの解析結果
+    (chars / words / lines / textmap のキャッシュ) をすぐ解放するので、
+    ページ数が増えてもメモリ使用量は 1 ページ分で頭打ちになる。
+    同じ PDF を後続の抽出処理でも読む場合は release=False で再パースを避ける。
+    """
+    for i, page in enumerate(pdf.pages):
+        if limit is not None and i >= limit:
+            break
+        try:
+            yield page
+        finally:
+            if release:
+                page.close()
+
 def safe_write_df(worksheet, df, start_row=1):
     """DataFrameをExcelシートに安全に書き込む"""
     num_cols = df.shape[1]
@@ -42,27 +82,30 @@ def paste_dataframe_to_sheet(ws, df, start_row=1, start_col=1):
         for c_idx, value in enumerate(row, start=start_col):
             ws.cell(row=start_row + r_idx + 1, column=c_idx, value=value)
 
-def match_bento_data(pdf_bento_list: List[str], master_df: pd.DataFrame) -> List[List[str]]:
+BENTO_MATCH_COLUMNS = ['商品予定名', 'パン箱入数', '売価単価', '弁当区分']
+
+def build_bento_match_index(master_df: pd.DataFrame) -> Dict[str, Any]:
     """
-    PDFの弁当名リストを商品マスタと照合し、関連データを返す。
-    CSVのヘッダー問題を吸収し、安全な列名でデータを取得する。
+    商品マスタから弁当名照合用のインデックスを作成する。
+    マスタが変わらない限り使い回せる (match_bento_data の index 引数に渡す)。
     """
     if master_df is None or master_df.empty:
-        return [[name, "", "", ""] for name in pdf_bento_list]
+        return {'missing': None, 'empty': True, 'exact': {}, 'entries': []}
 
-    master_df.columns = master_df.columns.str.strip()
+    # 共有の MasterSet を書き換えないよう、列名の空白除去はローカルのコピーで行う
+    if any(col != col.strip() for col in master_df.columns):
+        master_df = master_df.rename(columns=str.strip)
 
     # --- ▼修正点：取得する列名を変更 ---
-    required_cols = ['商品予定名', 'パン箱入数', '売価単価', '弁当区分']
+    required_cols = BENTO_MATCH_COLUMNS
     # --- ▲修正点▲ ---
 
     if not all(col in master_df.columns for col in required_cols):
         missing = ", ".join([col for col in required_cols if col not in master_df.columns])
-        return [[name, "", f"マスタ列不足: {missing}", ""] for name in pdf_bento_list]
-    
+        return {'missing': missing, 'empty': False, 'exact': {}, 'entries': []}
+
     master_tuples = master_df[required_cols].astype(str).to_records(index=False).tolist()
-    matched_results = []
-    
+
     # --- ▼修正点：変数名を分かりやすく変更 ---
     norm_master = [
         (unicodedata.normalize('NFKC', name).replace(" ", ""), name, pan_box, price, bento_type)
@@ -70,71 +113,152 @@ def match_bento_data(pdf_bento_list: List[str], master_df: pd.DataFrame) -> List
     ]
     # --- ▲修正点▲ ---
 
+    # 完全一致用: 正規化名 -> 最初に出現した行
+    exact = {}
+    for norm_m, orig_m, pan_box, price, bento_type in norm_master:
+        exact.setdefault(norm_m, [orig_m, pan_box, price, bento_type])
+    # 部分一致用: 空の名前は対象外
+    entries = [entry for entry in norm_master if entry[0]]
+    return {'missing': None, 'empty': False, 'exact': exact, 'entries': entries}
+
+def match_bento_data(pdf_bento_list: List[str], master_df: pd.DataFrame, index: Dict[str, Any] = None) -> List[List[str]]:
+    """
+    PDFの弁当名リストを商品マスタと照合し、関連データを返す。
+    CSVのヘッダー問題を吸収し、安全な列名でデータを取得する。
+    index: build_bento_match_index の結果 (省略時はマスタから都度作成)
+    """
+    if index is None:
+        index = build_bento_match_index(master_df)
+
+    if index['empty']:
+        return [[name, "", "", ""] for name in pdf_bento_list]
+    if index['missing']:
+        return [[name, "", f"マスタ列不足: {index['missing']}", ""] for name in pdf_bento_list]
+
+    matched_results = []
     for pdf_name in pdf_bento_list:
         pdf_name_stripped = pdf_name.strip()
         norm_pdf = unicodedata.normalize('NFKC', pdf_name_stripped).replace(" ", "")
         result_data = [pdf_name_stripped, "", "", ""]
-        best_match = None
-        
+
         # 1. 完全一致で検索
-        for norm_m, orig_m, pan_box, price, bento_type in norm_master:
-            if norm_m == norm_pdf:
-                best_match = [orig_m, pan_box, price, bento_type]
-                break
-        
+        best_match = index['exact'].get(norm_pdf)
+
         # 2. 部分一致で検索
         if not best_match:
             candidates = []
-            for norm_m, orig_m, pan_box, price, bento_type in norm_master:
-                if norm_m and norm_m in norm_pdf:
+            for norm_m, orig_m, pan_box, price, bento_type in index['entries']:
+                if norm_m in norm_pdf:
                     candidates.append((orig_m, pan_box, price, bento_type))
             if candidates:
                 best_match = max(candidates, key=lambda x: len(x[0]))
 
         if best_match:
-            result_data = best_match
+            result_data = list(best_match)
         
         matched_results.append(result_data)
         
     return matched_results
 
-# ──────────────────────────────────────────────
-# 以下の関数は変更ありません
-# ──────────────────────────────────────────────
-def extract_detailed_client_info_from_pdf(pdf_file_obj):
+def extract_detailed_client_info_from_pdf(pdf_file_obj, release_pages=True, backend=None, compact=False):
+    """compact: parse_client_rows を参照"""
     client_data = []
+    backend = text_backend(backend)
     try:
-        with pdfplumber.open(pdf_file_obj) as pdf:
-            for page in pdf.pages:
+        with open_pdf(pdf_file_obj, backend) as pdf:
+            for page in iter_pages(pdf, release_pages):
                 rows = extract_text_with_layout(page)
-                if not rows: continue
-                garden_row_idx = -1
-                for i, row in enumerate(rows):
-                    if '園名' in ''.join(str(c) for c in row if c):
-                        garden_row_idx = i
-                        break
-                if garden_row_idx == -1: continue
-                current_client_id, current_client_name = None, None
-                for i in range(garden_row_idx + 1, len(rows)):
-                    row = rows[i]
-                    if '10001' in ''.join(str(c) for c in row if c): break
-                    if not any(str(c).strip() for c in row): continue
-                    if row and row[0]:
-                        left_cell = str(row[0]).strip()
-                        if re.match(r'^\d+$', left_cell):
-                            if current_client_id and current_client_name:
-                                client_info = extract_meal_numbers_from_row(rows, i - 1, current_client_id, current_client_name)
-                                if client_info: client_data.append(client_info)
-                            current_client_id, current_client_name = left_cell, None
-                        elif not re.match(r'^\d+$', left_cell) and current_client_id:
-                            current_client_name = left_cell
-                if current_client_id and current_client_name:
-                    client_info = extract_meal_numbers_from_row(rows, len(rows) - 1, current_client_id, current_client_name)
-                    if client_info: client_data.append(client_info)
+                if rows:
+                    client_data.extend(parse_client_rows(rows, compact=compact))
     except Exception:
         pass
     return client_data
 
+def _meal_vector(row):
+    """row[1:] -> 数値セルは int、それ以外は '' (列位置を保つ)"""
+    # str.isdecimal() == re.match(r'^\d+$') (Unicode Nd) for stripped strings
+    return [int(c) if c.isdecimal() else '' for c in map(str.strip, map(str, row[1:]))]
+
+def _leading_meals(row):
+    """row[1:] の先頭から続く数値 (空セルは飛ばし、数値以外の文字で打ち切る)"""
+    meals = []
+    for c in map(str.strip, map(str, row[1:])):
+        if c.isdecimal():
+            meals.append(int(c))
+        elif c:
+            break
+    return meals
+
+def parse_client_rows(rows, compact=False):
+    """
+    1 ページ分のレイアウト行 (extract_text_with_layout) からクライアント行を読む。
+
+    行を 1 回だけ走査する状態機械:
+      ヘッダー探索 ('園名' の行まで) -> グリッド ('10001' の行で終了)
+    グリッドでは左端セルが数字の行で新しいクライアント (ID) が始まり、
+    次の数字以外の左端セルが名前になる。次の ID 行が来た時点で前の
+    クライアントを確定し、その前後の行 (±3 行の窓) から ID 行 = 園児、
+    名前行 = 先生の給食数ベクトルを取り出す
+    (旧 extract_meal_numbers_from_row と同じ窓・同じ結果)。
+
+    compact=True は Streamlit 版の集計: 列位置は保たず、窓内の ID 行 / 名前行の
+    先頭から続く数値を詰めて園児 3 個・先生 2 個まで返す
+    (export_detailed_client_data_to_dataframe の列)。
+    """
+    n = len(rows)
+    # 左端セル (窓内の照合用) とその行の給食数ベクトルは 1 回だけ計算する
+    left_cells = [str(row[0]).strip() if row else None for row in rows]
+    meal_cache = {}
+
+    def meals_at(k):
+        meals = meal_cache.get(k)
+        if meals is None:
+            meals = meal_cache[k] = _meal_vector(rows[k])
+        return meals
+
+    def emit(anchor, client_id, client_name):
+        student, teacher = [], []
+        for k in range(max(0, anchor - 3), min(n, anchor + 3)):
+            left = left_cells[k]
+            if compact:
+                if left == client_id:
+                    student = student + _leading_meals(rows[k])
+                elif left == client_name:
+                    teacher = teacher + _leading_meals(rows[k])
+            elif left == client_id:
+                student = meals_at(k)
+            elif left == client_name:
+                teacher = meals_at(k)
+        if compact:
+            student, teacher = student[:3], teacher[:2]
+        return {'client_id': client_id, 'client_name': client_name,
+                'student_meals': list(student), 'teacher_meals': list(teacher)}
+
+    clients = []
+    in_grid = False
+    client_id, client_name = None, None
+    for i, row in enumerate(rows):
+        joined = ''.join(map(str, filter(None, row)))
+        if not in_grid:
+            in_grid = '園名' in joined
+            continue
+        if '10001' in joined:
+            break
+        if not row or not row[0]:
+            continue
+        left = left_cells[i]
+        if not left and not any(str(c).strip() for c in row):
+            continue
+        if left.isdecimal():
+            if client_id and client_name:
+                clients.append(emit(i - 1, client_id, client_name))
+            client_id, client_name = left, None
+        elif client_id:
+            client_name = left
+    if client_id and client_name:
+        clients.append(emit(n - 1, client_id, client_name))
+    return clients
+
 def extract_meal_numbers_from_row(rows, row_idx, client_id, client_name):
     """
     Extracts meal numbers while PRESERVING column alignment (sparse grid).
@@ -182,7 +306,8 @@ def export_detailed_client_data_to_dataframe(client_data):
 def extract_text_with_layout(page) -> List[List[str]]:
     words = page.extract_words(x_tolerance=3, y_tolerance=3, keep_blank_chars=False)
     if not words: return []
-    boundaries = get_vertical_boundaries(page)
+    # 上と同じ設定 (pdfplumber の既定値) なので、境界の計算にも同じ単語を使う
+    boundaries = get_vertical_boundaries(page, words=words)
     if len(boundaries) < 2:
         text = page.extract_text(layout=False, x_tolerance=3, y_tolerance=3)
         return [[line] for line in text.split('\n') if line.strip()] if text else []
@@ -208,10 +333,15 @@ def get_line_groups(words: List[Dict[str, Any]], y_tolerance: float = 1.2) -> Li
     groups.append(sorted(current_group, key=lambda w: w['x0']))
     return groups
 
-def get_vertical_boundaries(page, tolerance: float = 2) -> List[float]:
+def get_vertical_boundaries(page, tolerance: float = 2, words=None) -> List[float]:
+    """
+    列の境界 = 縦罫線 + 文字の左端 / 右端。
+    words: page.extract_words() の結果 (呼び出し側で抽出済みなら渡して再抽出を避ける)
+    """
     lines = page.lines
     v_lines_x = sorted(list(set(round(line['x0'], 1) for line in lines if line['height'] > 0 and line['width'] < tolerance)))
-    words = page.extract_words()
+    if words is None:
+        words = page.extract_words()
     if not words: return v_lines_x
     doc_left = min(word['x0'] for word in words)
     doc_right = max(word['x1'] for word in words)
@@ -234,12 +364,14 @@ def split_line_using_boundaries(line: List[Dict[str, Any]], boundaries: List[flo
                 break
     return columns
 
-def pdf_to_excel_data_for_paste_sheet(pdf_file):
+def pdf_to_excel_data_for_paste_sheet(pdf_file, release_pages=True, backend=None):
+    backend = text_backend(backend)
     try:
-        with pdfplumber.open(pdf_file) as pdf:
+        with open_pdf(pdf_file, backend) as pdf:
             if not pdf.pages: return None
-            page = pdf.pages[0]
-            rows = extract_text_with_layout(page)
+            rows = None
+            for page in iter_pages(pdf, release_pages, limit=1):
+                rows = extract_text_with_layout(page)
             if not rows: return None
             df = pd.DataFrame(rows)
             df.replace({None: ""}, inplace=True)
@@ -247,12 +379,88 @@ def pdf_to_excel_data_for_paste_sheet(pdf_file):
     except Exception:
         return None
 
-def extract_table_from_pdf_for_bento(pdf_file_obj):
+BENTO_TABLE_KEYWORDS = ("園名", "飯あり", "キャラ弁")
+
+def _raw_pdf_source(pdf_file):
+    """pypdfium2 に渡せる元データ (bytes / パス)。取れなければ None。"""
+    if isinstance(pdf_file, pdfplumber.PDF):
+        pdf_file = pdf_file.stream
+    if isinstance(pdf_file, (bytes, str)):
+        return pdf_file
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    if hasattr(pdf_file, "read") and hasattr(pdf_file, "seek"):
+        # pdfminer seeks before every read, but restore the position anyway
+        pos = pdf_file.tell()
+        try:
+            pdf_file.seek(0)
+            return pdf_file.read()
+        finally:
+            pdf_file.seek(pos)
+    return None
+
+def pdfium_page_texts(pdf_file):
+    """
+    ページごとのテキスト (pdfium のテキスト層、レイアウト解析なし) のリスト。
+    pdfplumber の extract_text より 1 桁以上速い。
+    pypdfium2 が使えない / 読めない場合は None。
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        return None
+    source = _raw_pdf_source(pdf_file)
+    if source is None:
+        return None
+    with pdfium_lock:
+        try:
+            doc = pdfium.PdfDocument(source)
+        except Exception:
+            return None
+        try:
+            texts = []
+            for i in range(len(doc)):
+                page = doc[i]
+                textpage = page.get_textpage()
+                try:
+                    texts.append(textpage.get_text_range())
+                finally:
+                    textpage.close()
+                    page.close()
+            return texts
+        finally:
+            doc.close()
+
+def keyword_pages(pdf_file, keywords):
+    """
+    keywords のいずれかを含むページ番号 (0 始まり) の集合。
+    pdfium_page_texts で判定する。空白は無視して照合する。
+    pypdfium2 が使えない / 読めない場合は None (呼び出し側で全ページを調べる)。
+    """
+    texts = pdfium_page_texts(pdf_file)
+    if texts is None:
+        return None
+    return {i for i, text in enumerate(texts) if any(kw in "".join(text.split()) for kw in keywords)}
+
+def extract_table_from_pdf_for_bento(pdf_file_obj, release_pages=True, prefilter=True):
+    """
+    弁当表 (罫線の表) を含むページの表を返す。
+    prefilter=True なら keyword_pages で表のないページ (表紙・備考など) を
+    pdfplumber で解析する前に除外する。pdfium のテキストが取れない / 化けて
+    どのページも該当しない場合は、従来どおり extract_text で全ページを調べる。
+    """
     tables = []
-    with pdfplumber.open(pdf_file_obj) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if not text or not any(kw in text for kw in ["園名", "飯あり", "キャラ弁"]): continue
+    candidates = keyword_pages(pdf_file_obj, BENTO_TABLE_KEYWORDS) if prefilter else None
+    if not candidates:
+        candidates = None
+    with open_pdf(pdf_file_obj) as pdf:
+        for i, page in enumerate(iter_pages(pdf, release_pages)):
+            if candidates is not None:
+                if i not in candidates: continue
+            else:
+                text = page.extract_text()
+                if not text or not any(kw in text for kw in BENTO_TABLE_KEYWORDS): continue
+            # page.lines and extract_table's edges come from the same parsed page objects
             if not page.lines: continue
             table = page.extract_table({"vertical_strategy": "lines", "horizontal_strategy": "lines"})
             if table: tables.append(table)
@@ -284,3 +492,35 @@ def extract_bento_range_for_bento(table, start_col):
         cell_text = header_row[col] if col < len(header_row) else ""
         if cell_text and str(cell_text).strip(): bento_list.append(str(cell_text).strip())
     return bento_list
+
+def extract_bento_headers_from_table(table):
+    """
+    表のヘッダー3段 (弁当名 / 飯あり・おにぎり等 / 100・三角等) を結合し、
+    園名列の右から「おやつ」列の手前までの弁当名リストを返す。
+    例: "キャラ弁(学食) 飯あり 100", "赤 おにぎり 半俵", "クリスマス"
+    """
+    name_row_idx, name_col = -1, -1
+    for r_idx, row in enumerate(table):
+        for c_idx, cell in enumerate(row):
+            if cell and "園名" in cell:
+                name_row_idx, name_col = r_idx, c_idx
+                break
+        if name_row_idx != -1: break
+    if name_row_idx == -1: return []
+
+    name_row = table[name_row_idx]
+    end_col = len(name_row)
+    for c_idx, cell in enumerate(name_row):
+        if cell and "おやつ" in cell: end_col = c_idx; break
+
+    sub_rows = table[name_row_idx + 1:name_row_idx + 3]
+    bento_list, current_name = [], ""
+    for col in range(name_col + 1, end_col):
+        cell = name_row[col] if col < len(name_row) else None
+        # None = merged with the cell on the left (e.g. キャラ弁当 spans 3 columns)
+        if cell is not None:
+            current_name = str(cell).strip()
+        parts = [current_name] + [str(r[col]).strip() for r in sub_rows if col < len(r) and r[col]]
+        header = unicodedata.normalize('NFKC', " ".join(p for p in parts if p))
+        if header: bento_list.append(header)
+    return bento_list
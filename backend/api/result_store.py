@@ -0,0 +1,249 @@
+"""
+Persistent store for order conversion results.
+
+Each processed order PDF is recorded with its SHA-256, the extraction output
+(bento headers, client rows, 貼り付け用 rows) and the generated 数出表 /
+納品書 workbooks, so past outputs can be listed and downloaded again without
+calling the AI or rebuilding the workbooks.
+
+Layout under the store directory (RESULTS_DIR, default <ASSETS_DIR>/results):
+
+  results.sqlite3         one row per conversion (metadata + extraction JSON)
+  blobs/ab/abcdef...      file contents, content-addressed by SHA-256
+
+Blobs are written to a temp file and renamed into place, so a crash never
+leaves a truncated file behind; identical files are stored once. Old
+results are pruned at most every prune_interval seconds, not on every save.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    source_filename TEXT,
+    pdf_sha256 TEXT NOT NULL,
+    pdf_blob TEXT,
+    extraction_json TEXT NOT NULL,
+    inputs_json TEXT,
+    files_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_pdf_sha256 ON results (pdf_sha256);
+"""
+
+# files_json: {"template": {"filename": ..., "blob": sha256, "size": n}, "nouhinsyo": {...}}
+FILE_MEDIA_TYPES = {
+    ".xlsm": "application/vnd.ms-excel.sheet.macroEnabled.12",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".pdf": "application/pdf",
+}
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultStore:
+    def __init__(self, root_dir: str, max_entries: int = 0, prune_interval: float = 600):
+        """
+        max_entries > 0 keeps only the newest N results (older rows and unused
+        blobs are removed by a save, at most once per prune_interval seconds).
+        """
+        self.root_dir = root_dir
+        self.blob_dir = os.path.join(root_dir, "blobs")
+        self.db_path = os.path.join(root_dir, "results.sqlite3")
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._prune_lock = threading.Lock()
+        self._last_prune = None
+
+    # --- SQLite ---
+    def _connect(self):
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    os.makedirs(self.blob_dir, exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=30)
+                    try:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(SCHEMA)
+                        conn.commit()
+                    finally:
+                        conn.close()
+                    self._initialized = True
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # --- Blobs ---
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def put_blob(self, data: bytes) -> str:
+        digest = sha256(data)
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            try:
+                # Fresh mtime: a concurrent prune must not delete a blob about to be referenced again
+                os.utime(path)
+                return digest
+            except FileNotFoundError:
+                pass  # pruned meanwhile: write it again
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def read_blob(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), "rb") as f:
+            return f.read()
+
+    # --- Results ---
+    def save_order(self, source_filename, pdf_bytes, extraction, files, inputs=None, keep_pdf=True,
+                   pdf_sha256=None) -> int:
+        """
+        Record one order conversion.
+        files: {"template": (filename, bytes), "nouhinsyo": (filename, bytes)}
+        pdf_bytes may be None (re-render without the PDF) when pdf_sha256 is given.
+        Returns the result id.
+        """
+        files_json = {}
+        for key, (filename, data) in files.items():
+            files_json[key] = {"filename": filename, "blob": self.put_blob(data), "size": len(data)}
+        pdf_digest = pdf_sha256 or sha256(pdf_bytes)
+        pdf_blob = self.put_blob(pdf_bytes) if keep_pdf and pdf_bytes is not None else None
+
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO results (created_at, kind, source_filename, pdf_sha256, pdf_blob,"
+                " extraction_json, inputs_json, files_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (datetime.now().isoformat(timespec="seconds"), "order", source_filename, pdf_digest, pdf_blob,
+                 json.dumps(extraction.to_dict(), ensure_ascii=False),
+                 json.dumps(inputs or {}, ensure_ascii=False),
+                 json.dumps(files_json, ensure_ascii=False)),
+            )
+            result_id = cur.lastrowid
+        if self.max_entries > 0 and self._prune_due():
+            self.prune(self.max_entries)
+        return result_id
+
+    def _prune_due(self) -> bool:
+        """True for one caller once prune_interval seconds have passed since the last prune."""
+        now = time.monotonic()
+        with self._prune_lock:
+            if self._last_prune is not None and now - self._last_prune < self.prune_interval:
+                return False
+            self._last_prune = now
+            return True
+
+    @staticmethod
+    def _summary(row) -> dict:
+        files = json.loads(row["files_json"])
+        return {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "kind": row["kind"],
+            "source_filename": row["source_filename"],
+            "pdf_sha256": row["pdf_sha256"],
+            "inputs": json.loads(row["inputs_json"] or "{}"),
+            "files": {key: {"filename": f["filename"], "size": f["size"]} for key, f in files.items()},
+        }
+
+    def list(self, limit=50, offset=0, pdf_sha256=None) -> list:
+        query = "SELECT * FROM results"
+        params = []
+        if pdf_sha256:
+            query += " WHERE pdf_sha256 = ?"
+            params.append(pdf_sha256)
+        query += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self._connect() as conn:
+            return [self._summary(row) for row in conn.execute(query, params)]
+
+    def get(self, result_id: int):
+        """Summary + extraction for one result, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM results WHERE id = ?", (result_id,)).fetchone()
+        if row is None:
+            return None
+        result = self._summary(row)
+        result["extraction"] = json.loads(row["extraction_json"])
+        result["has_pdf"] = row["pdf_blob"] is not None
+        return result
+
+    def find_extraction(self, pdf_sha256: str, **inputs):
+        """
+        Newest (result_id, extraction dict) for this PDF whose recorded inputs
+        match the given ones (e.g. header_source / model_name), or None.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, inputs_json, extraction_json FROM results"
+                                " WHERE pdf_sha256 = ? AND kind = 'order' ORDER BY id DESC", (pdf_sha256,))
+            for row in rows:
+                recorded = json.loads(row["inputs_json"] or "{}")
+                if all(recorded.get(k) == v for k, v in inputs.items()):
+                    return row["id"], json.loads(row["extraction_json"])
+        return None
+
+    def get_file(self, result_id: int, key: str):
+        """(filename, bytes) of a stored file ('template', 'nouhinsyo' or 'pdf'), or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT source_filename, pdf_blob, files_json FROM results WHERE id = ?",
+                               (result_id,)).fetchone()
+        if row is None:
+            return None
+        if key == "pdf":
+            if row["pdf_blob"] is None:
+                return None
+            return row["source_filename"] or f"{result_id}.pdf", self.read_blob(row["pdf_blob"])
+        entry = json.loads(row["files_json"]).get(key)
+        if entry is None:
+            return None
+        return entry["filename"], self.read_blob(entry["blob"])
+
+    def prune(self, max_entries: int):
+        """Keep the newest max_entries results and delete blobs nobody references any more."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE id NOT IN (SELECT id FROM results ORDER BY id DESC LIMIT ?)",
+                         (max_entries,))
+            referenced = set()
+            for row in conn.execute("SELECT pdf_blob, files_json FROM results"):
+                if row["pdf_blob"]:
+                    referenced.add(row["pdf_blob"])
+                referenced.update(f["blob"] for f in json.loads(row["files_json"]).values())
+        # Recent blobs may belong to a save that has not inserted its row yet
+        cutoff = time.time() - 3600
+        for sub in os.listdir(self.blob_dir):
+            sub_dir = os.path.join(self.blob_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                path = os.path.join(sub_dir, name)
+                if name.startswith(".tmp-") or name in referenced:
+                    continue
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+def media_type_for(filename: str) -> str:
+    return FILE_MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
@@ -1,8 +1,5 @@
-from google import genai
-from google.genai import types
 import json
 import os
-from openpyxl import Workbook, load_workbook
 import io
 
 def generate_seal_data(pdf_bytes, model_name="gemini-3-flash-preview", api_key=None):
@@ -12,7 +9,11 @@ def generate_seal_data(pdf_bytes, model_name="gemini-3-flash-preview", api_key=N
     if not api_key:
         raise ValueError("API Key is required for Gemini generation")
 
-    client = genai.Client(api_key=api_key)
+    from google.genai import types
+    from api.ai_processor import get_genai_client
+    from api.model_scheduler import get_model_scheduler
+
+    client = get_genai_client(api_key)
     
     seal_prompt = """
 このPDFはシール表です。横4つ × 縦5つ(合計約20個)のブロックで構成されています。
@@ -40,7 +41,9 @@ def generate_seal_data(pdf_bytes, model_name="gemini-3-flash-preview", api_key=N
 重要: 全てのブロックを抽出してください。完全で有効なJSONのみを返してください。
 """
     try:
-        response = client.models.generate_content(
+        # Rate limited per model, retried on 429 / 5xx (api.model_scheduler)
+        response = get_model_scheduler().call(
+            model_name, client.models.generate_content,
             model=model_name,
             contents=[
                 types.Content(
@@ -95,6 +98,8 @@ def create_seal_excel(blocks):
     Create Excel file from seal blocks using template.
     Writes data to the 'Gemini抽出データ' sheet in the template.
     """
+    from openpyxl import Workbook, load_workbook
+
     # Get template path from environment or use default
     assets_dir = os.getenv("ASSETS_DIR", os.path.join(os.path.dirname(__file__), 'assets'))
     template_path = os.path.join(assets_dir, 'seal.xlsx')
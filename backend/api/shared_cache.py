@@ -0,0 +1,232 @@
+"""
+Cache shared by all worker processes of one deployment.
+
+With several uvicorn / gunicorn workers every process used to call Gemini
+again for a PDF another worker had already extracted. AI responses are now
+kept in a local SQLite database (WAL, one short-lived connection per call,
+like the result store), so any worker can serve them:
+
+  <SHARED_CACHE_DIR>/shared_cache.sqlite3   (default <ASSETS_DIR>/cache)
+
+Entries are keyed by (namespace, key); AI responses use the "ai" namespace
+and the key <kind>:<model>:<PDF SHA-256>. The oldest-used entries are
+dropped beyond SHARED_CACHE_MAX_MB, and entries older than AI_CACHE_TTL
+seconds are not served.
+
+Parsed masters are not shared through this cache. Each worker builds its
+own DataFrames: the Arrow snapshot is memory mapped, but to_pandas() copies
+the strings into object columns. Only the gunicorn --preload mode
+(gunicorn.conf.py) loads the parsed masters and template bytes once, before
+the fork, so the workers share them copy-on-write. With plain
+`uvicorn --workers N` every worker holds its own copy.
+
+    SHARED_CACHE=0              (disabled: every worker calls the model itself)
+    SHARED_CACHE_DIR=<path>
+    SHARED_CACHE_MAX_MB=256
+    AI_CACHE_TTL=604800         (seconds; 0 disables the AI response cache)
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from api.metrics import Counter, REGISTRY
+from api.model_backend import ModelBackend
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+"""
+DB_FILENAME = "shared_cache.sqlite3"
+
+SHARED_CACHE = Counter(
+    "mamameal_shared_cache_total",
+    "Shared (cross-worker) cache lookups by namespace and outcome (hit / miss / stored / error).",
+    ["namespace", "outcome"],
+)
+REGISTRY.append(SHARED_CACHE)
+
+logger = logging.getLogger(__name__)
+
+
+def shared_cache_enabled():
+    return os.getenv("SHARED_CACHE", "1") != "0"
+
+
+def default_cache_dir():
+    assets_dir = os.getenv("ASSETS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets"))
+    return os.getenv("SHARED_CACHE_DIR") or os.path.join(assets_dir, "cache")
+
+
+class SharedCache:
+    """
+    Byte values in SQLite. Connections are opened per call (never shared
+    between threads or inherited across a fork), so one instance can be used
+    by every thread and, through the file, by every process.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int = 256 * 2**20):
+        self.root_dir = root_dir
+        self.db_path = os.path.join(root_dir, DB_FILENAME)
+        self.max_bytes = max_bytes
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    os.makedirs(self.root_dir, exist_ok=True)
+                    conn = sqlite3.connect(self.db_path, timeout=30)
+                    try:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(SCHEMA)
+                        conn.commit()
+                    finally:
+                        conn.close()
+                    self._initialized = True
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, namespace: str, key: str, max_age: float = 0):
+        """The stored bytes, or None (missing, or older than max_age seconds when max_age > 0)."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE namespace = ? AND key = ?",
+                               (namespace, key)).fetchone()
+            if row is None or (max_age > 0 and now - row[1] > max_age):
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                         (now, namespace, key))
+        return row[0]
+
+    def put(self, namespace: str, key: str, value: bytes):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (namespace, key, value, size, created_at, accessed_at)"
+                         " VALUES (?, ?, ?, ?, ?, ?)", (namespace, key, value, len(value), now, now))
+        if self.max_bytes > 0:
+            self.prune(self.max_bytes)
+
+    def delete(self, namespace: str, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def delete_suffix(self, namespace: str, suffix: str):
+        """Delete every entry of the namespace whose key ends with suffix."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND substr(key, -?) = ?",
+                         (namespace, len(suffix), suffix))
+
+    def prune(self, max_bytes: int):
+        """Drop the least recently used entries until the values fit in max_bytes."""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= max_bytes:
+                return
+            rows = conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed_at").fetchall()
+            drop = []
+            for namespace, key, size in rows:
+                if total <= max_bytes:
+                    break
+                drop.append((namespace, key))
+                total -= size
+            conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", drop)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """The process-wide SharedCache (same file in every worker), or None when SHARED_CACHE=0."""
+    global _shared_cache
+    if not shared_cache_enabled():
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = SharedCache(default_cache_dir(),
+                                        max_bytes=int(float(os.getenv("SHARED_CACHE_MAX_MB", "256")) * 2**20))
+    return _shared_cache
+
+
+# --- AI responses ---
+
+class CachedBackend(ModelBackend):
+    """
+    Wraps a model backend (the Gemini cascade) with the shared cache: a PDF
+    extracted by any worker is not sent to the model again. Only responses
+    that pass the cascade's validation are stored: orders without
+    order_response_problems, seal block lists with one block per block on
+    the pages and no invalid block. Anything else is extracted again on the
+    next call (forget() drops a stored response, e.g. for reextract=true).
+    """
+
+    def __init__(self, backend, cache, ttl=None):
+        self.backend = backend
+        # Same name as the wrapped backend: the result store matches extractions by it
+        self.name = backend.name
+        self.cache = cache
+        self.ttl = float(os.getenv("AI_CACHE_TTL", "604800")) if ttl is None else ttl
+
+    @property
+    def available(self):
+        return self.backend.available
+
+    def _key(self, kind, pdf_bytes, model_name):
+        return f"{kind}:{model_name or self.name}:{hashlib.sha256(pdf_bytes).hexdigest()}"
+
+    def _cached(self, kind, pdf_bytes, model_name, extract, valid):
+        if self.ttl <= 0:
+            return extract(pdf_bytes, model_name=model_name)
+        key = self._key(kind, pdf_bytes, model_name)
+        try:
+            data = self.cache.get("ai", key, max_age=self.ttl)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed: {e}")
+            SHARED_CACHE.inc(namespace="ai", outcome="error")
+            data = None
+        if data is not None:
+            SHARED_CACHE.inc(namespace="ai", outcome="hit")
+            return json.loads(data)
+        SHARED_CACHE.inc(namespace="ai", outcome="miss")
+
+        response = extract(pdf_bytes, model_name=model_name)
+        if valid(response):
+            try:
+                self.cache.put("ai", key, json.dumps(response, ensure_ascii=False).encode("utf-8"))
+                SHARED_CACHE.inc(namespace="ai", outcome="stored")
+            except Exception as e:
+                # Never fail the request because the cache could not be written
+                logger.warning(f"Shared cache write failed: {e}")
+                SHARED_CACHE.inc(namespace="ai", outcome="error")
+        return response
+
+    def extract_order(self, pdf_bytes, model_name=None):
+        from api.model_cascade import order_response_problems
+        return self._cached("order", pdf_bytes, model_name, self.backend.extract_order,
+                            lambda response: not order_response_problems(response))
+
+    def extract_seal(self, pdf_bytes, model_name=None):
+        from api.model_cascade import expected_seal_blocks, seal_response_problems
+        return self._cached("seal", pdf_bytes, model_name, self.backend.extract_seal,
+                            lambda blocks: not seal_response_problems(blocks, expected_seal_blocks(pdf_bytes)))
+
+    def forget(self, pdf_bytes):
+        """Drop the cached responses of this PDF (all kinds / models are re-extracted on the next call)."""
+        try:
+            self.cache.delete_suffix("ai", f":{hashlib.sha256(pdf_bytes).hexdigest()}")
+        except Exception as e:
+            # Best effort like the reads / writes: the re-extraction still runs
+            logger.warning(f"Shared cache delete failed: {e}")
+            SHARED_CACHE.inc(namespace="ai", outcome="error")
@@ -0,0 +1,155 @@
+"""
+Size-bounded uploads for the FastAPI endpoints.
+
+Starlette already spools multipart file parts to a temporary file (kept in
+memory only up to 1MB), but nothing limited the size of a request, so
+parallel uploads of large seal PDFs could fill memory / disk.
+UploadLimitMiddleware caps the request body per upload endpoint: a
+Content-Length above the cap is refused with 413 before anything is read,
+and a body that streams past it (chunked, or a wrong Content-Length) is cut
+off with 413 while it is parsed.
+
+Replaced files (templates) are copied from the spooled upload to a temp file
+next to the destination, validated there and only then renamed over the
+live file, so a bad or interrupted upload never replaces a working one.
+
+    MAX_PDF_UPLOAD_MB=50        (/api/seal, /api/order-invoice)
+    MAX_MASTER_UPLOAD_MB=20     (/api/masters/upload)
+    MAX_TEMPLATE_UPLOAD_MB=20   (/api/templates/upload)
+"""
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+from fastapi import HTTPException
+
+from api.metrics import Counter, REGISTRY
+
+UPLOAD_REJECTED = Counter(
+    "mamameal_upload_rejected_total",
+    "Uploads refused with 413 (over the endpoint's size cap).",
+    ["endpoint"],
+)
+REGISTRY.append(UPLOAD_REJECTED)
+
+TEMPLATE_EXTENSIONS = (".xlsx", ".xlsm")
+
+
+def _megabytes(name, default):
+    return int(float(os.getenv(name, default)) * 2**20)
+
+
+def upload_limits():
+    """Request body cap in bytes per upload endpoint path."""
+    pdf = _megabytes("MAX_PDF_UPLOAD_MB", "50")
+    return {
+        "/api/seal": pdf,
+        "/api/order-invoice": pdf,
+        "/api/masters/upload": _megabytes("MAX_MASTER_UPLOAD_MB", "20"),
+        "/api/templates/upload": _megabytes("MAX_TEMPLATE_UPLOAD_MB", "20"),
+    }
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Upload too large (limit {limit / 2**20:.0f}MB)")
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware: 413 for request bodies above the cap of their path (see upload_limits)."""
+
+    def __init__(self, app, limits=None):
+        self.app = app
+        self.limits = upload_limits() if limits is None else limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope.get("headers") or []).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            UPLOAD_REJECTED.inc(endpoint=scope["path"])
+            await self._reject(send, UploadTooLarge(limit))
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    UPLOAD_REJECTED.inc(endpoint=scope["path"])
+                    # Raised inside the form parsing; FastAPI passes HTTPExceptions through as responses
+                    raise UploadTooLarge(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _reject(send, error):
+        body = json.dumps({"detail": error.detail}).encode("utf-8")
+        await send({"type": "http.response.start", "status": error.status_code,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                # The body was not read: the client must not reuse the connection
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def validate_template(path, expected_filename):
+    """Reason the workbook at path cannot replace the template expected_filename, or None."""
+    ext = os.path.splitext(expected_filename)[1].lower()
+    if ext not in TEMPLATE_EXTENSIONS:
+        return None
+    if not zipfile.is_zipfile(path):
+        return "not an Excel workbook"
+    if ext == ".xlsm":
+        with zipfile.ZipFile(path) as archive:
+            if "xl/vbaProject.bin" not in archive.namelist():
+                return "no macros (save the template as .xlsm)"
+    from openpyxl import load_workbook
+    try:
+        # Without keep_vba: it would read every archive member into memory
+        wb = load_workbook(path, read_only=True)
+    except Exception as e:
+        return f"cannot be opened ({e})"
+    try:
+        if not wb.sheetnames:
+            return "no sheets"
+    finally:
+        wb.close()
+    return None
+
+
+def replace_from_upload(source, dest_path, validate=None):
+    """
+    Copy a file object (the spooled UploadFile.file) to dest_path atomically:
+    temp file in the same directory -> validate(temp path) -> fsync -> rename.
+    Returns None, or validate's reason the upload was refused (dest_path untouched).
+    """
+    from api.master_utils import fsync_dir
+    directory = os.path.dirname(dest_path) or "."
+    # Same extension as the destination: openpyxl picks the format by it
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(dest_path)}.",
+                                    suffix=f".upload{os.path.splitext(dest_path)[1]}")
+    try:
+        source.seek(0)
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(source, f, 1024 * 1024)
+            f.flush()
+            os.fsync(f.fileno())
+        problem = validate(tmp_path) if validate else None
+        if problem:
+            return problem
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    fsync_dir(directory)
+    return None
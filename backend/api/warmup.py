@@ -0,0 +1,119 @@
+"""
+Startup warm-up for the FastAPI backend.
+
+Right after a deploy the first order request used to pay for the pandas /
+pdfplumber / openpyxl imports, master CSV parsing, template loading, the
+workbook worker processes and Gemini client creation all at once. The
+warm-up does that work in a background thread started from the app lifespan,
+and /ready reports when it is finished.
+
+With gunicorn --preload (gunicorn.conf.py) preload_for_fork runs first, in
+the master process: the workers inherit the loaded read-only data and their
+own warm-up only starts what cannot cross a fork (worker pools, clients).
+"""
+import gc
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+
+class WarmupState:
+    """Progress of the warm-up, shared with the /ready endpoint."""
+
+    # pending -> running -> ready | failed, or skipped when disabled
+    FINISHED = ("ready", "failed", "skipped")
+
+    def __init__(self):
+        self.status = "pending"
+        self.stages = {}
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "stages": {name: round(sec, 3) for name, sec in self.stages.items()},
+                "error": self.error,
+            }
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] = time.perf_counter() - start
+
+
+warmup_state = WarmupState()
+
+
+def run_warmup(get_pipeline, api_key=None, state=warmup_state):
+    """
+    Preload every cache the order pipeline uses.
+    get_pipeline: callable returning the shared OrderPipeline (created lazily).
+    """
+    state.status = "running"
+    try:
+        # Heavy imports (pandas, openpyxl, pdfplumber) happen when the pipeline is created
+        with state.stage("imports"):
+            pipeline = get_pipeline()
+
+        # Parsed masters + bento matcher index (first start: write the master snapshots)
+        with state.stage("masters"):
+            from api.master_utils import migrate_master_snapshots
+            migrate_master_snapshots(pipeline.assets_dir)
+            pipeline.load_masters()
+
+        # Template bytes cache + workbook worker processes
+        with state.stage("templates"):
+            from api.workbook_utils import warm_workbook_pool
+            warm_workbook_pool(pipeline.template_paths())
+
+        if api_key:
+            with state.stage("gemini"):
+                from google.genai import types  # noqa: F401
+                from api.ai_processor import get_genai_client
+                get_genai_client(api_key)
+
+        state.status = "ready"
+    except Exception as e:
+        # Not fatal: requests still work, they just fill the caches themselves
+        print(f"Warm-up failed: {e}")
+        traceback.print_exc()
+        state.error = str(e)
+        state.status = "failed"
+
+
+def preload_for_fork(get_pipeline):
+    """
+    Load the read-only data every worker needs (imports, parsed masters and
+    bento index, template bytes) before gunicorn forks its workers, which
+    then share those pages copy-on-write. Starts no threads or processes.
+    """
+    pipeline = get_pipeline()
+    from api.master_utils import migrate_master_snapshots
+    migrate_master_snapshots(pipeline.assets_dir)
+    pipeline.load_masters()
+    from api.workbook_utils import read_template_bytes
+    for path in pipeline.template_paths():
+        read_template_bytes(path)
+    # Keep the garbage collector from touching (and so copying) the inherited objects
+    gc.collect()
+    gc.freeze()
+
+
+def start_warmup(get_pipeline, api_key=None, state=warmup_state):
+    """Run the warm-up in a daemon thread so startup and /health are not delayed."""
+    thread = threading.Thread(
+        target=run_warmup, args=(get_pipeline, api_key, state), name="warmup", daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,273 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from openpyxl import load_workbook
+
+from api.pdf_utils import safe_write_df, paste_dataframe_to_sheet
+from api.metrics import span, collect_spans, record_spans, register_rss_pids
+
+# 数出表 and 納品書 are built from the same DataFrames but share no workbook
+# state, so they are filled in separate worker processes (openpyxl is pure
+# Python, threads would just take turns on the GIL). With a single CPU the
+# workers only add memory, so the default follows the CPU count (1 = no pool).
+WORKBOOK_WORKERS = int(os.getenv("WORKBOOK_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Seconds to wait for a worker before giving up on the pool for this request
+WORKBOOK_TIMEOUT = float(os.getenv("WORKBOOK_TIMEOUT", "300"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _mp_context():
+    # Never plain fork: the app process has threads (request threadpool,
+    # warm-up, RSS sampler) whose locks a forked child could inherit held.
+    # The forkserver starts from a clean process that only imports this module.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKBOOK_WORKERS, mp_context=_mp_context())
+        return _pool
+
+
+def worker_pids():
+    """Process ids of the running workbook workers."""
+    pool = _pool
+    if pool is None:
+        return []
+    return list((getattr(pool, "_processes", None) or {}).keys())
+
+
+# Worker memory counts towards the request's peak RSS
+register_rss_pids(worker_pids)
+
+
+def _reset_pool(terminate=False):
+    """Drop the pool (terminate: kill its workers too, e.g. when one hangs)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    if terminate:
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# path -> ((path, mtime, size), file bytes)
+_template_cache = {}
+_template_lock = threading.Lock()
+
+
+def read_template_bytes(path):
+    """Template file contents, cached in memory until the file changes."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    with _template_lock:
+        cached = _template_cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    with open(path, "rb") as f:
+        data = f.read()
+    with _template_lock:
+        _template_cache[path] = (key, data)
+    return data
+
+
+def _open_template(template_file, **kwargs):
+    """load_workbook for a path or the raw bytes of a template."""
+    if isinstance(template_file, bytes):
+        template_file = io.BytesIO(template_file)
+    return load_workbook(template_file, **kwargs)
+
+
+def _warm_worker():
+    return os.getpid()
+
+
+def warm_workbook_pool(template_paths):
+    """
+    Load the templates into the in-memory cache and start the worker
+    processes, so the first order request does not pay for either.
+    """
+    for path in template_paths:
+        read_template_bytes(path)
+    if WORKBOOK_WORKERS > 1:
+        pool = _get_pool()
+        futures = [pool.submit(_warm_worker) for _ in range(WORKBOOK_WORKERS)]
+        return [f.result(WORKBOOK_TIMEOUT) for f in futures]
+    return []
+
+
+def _write_paste_sheet(wb, df_paste_sheet):
+    if "貼り付け用" not in wb.sheetnames:
+        return
+    ws = wb["貼り付け用"]
+    for r_idx, row in df_paste_sheet.iterrows():
+        for c_idx, value in enumerate(row):
+            ws.cell(row=r_idx + 1, column=c_idx + 1, value=value)
+
+
+def _replace_sheet(wb, sheet_name, df):
+    """Clear a master sheet and paste the DataFrame (header included)."""
+    if df.empty or sheet_name not in wb.sheetnames:
+        return
+    ws = wb[sheet_name]
+    if ws.max_row > 0: ws.delete_rows(1, ws.max_row)
+    paste_dataframe_to_sheet(ws, df)
+
+
+def build_template_workbook(template_file, df_product_master, df_customer_master,
+                            df_paste_sheet, df_bento_sheet, df_client_sheet,
+                            bento_header_names, client_header=True):
+    """
+    数出表 (template.xlsm: パスまたはバイト列) を作成し、xlsm のバイト列を返す。
+    client_header=False ならクライアント抽出に見出し行を書かず 1 行目からデータを書く (Streamlit 版の配置)
+    """
+    with span("template_load"):
+        template_wb = _open_template(template_file, keep_vba=True)
+
+    with span("template_fill"):
+        _fill_template_workbook(template_wb, df_product_master, df_customer_master,
+                                df_paste_sheet, df_bento_sheet, df_client_sheet, bento_header_names,
+                                client_header)
+
+    with span("template_save"):
+        out_template = io.BytesIO()
+        template_wb.save(out_template)
+    return out_template.getvalue()
+
+
+def _fill_template_workbook(template_wb, df_product_master, df_customer_master,
+                            df_paste_sheet, df_bento_sheet, df_client_sheet, bento_header_names,
+                            client_header=True):
+    # Paste Masters
+    _replace_sheet(template_wb, "商品マスタ", df_product_master)
+    _replace_sheet(template_wb, "得意先マスタ", df_customer_master)
+
+    # Write Data
+    _write_paste_sheet(template_wb, df_paste_sheet)
+
+    if df_bento_sheet is not None and "注文弁当の抽出" in template_wb.sheetnames:
+        safe_write_df(template_wb["注文弁当の抽出"], df_bento_sheet)
+
+    if df_client_sheet is not None and "クライアント抽出" in template_wb.sheetnames:
+        ws_client = template_wb["クライアント抽出"]
+        if not client_header:
+            # Streamlit layout: the fixed columns of the DataFrame from Row 1, no header row
+            safe_write_df(ws_client, df_client_sheet)
+            return
+
+        # Write DATA starting at Row 2 (leaving Row 1 for headers)
+        # This ensures we don't overwrite our new dynamic headers
+        safe_write_df(ws_client, df_client_sheet, start_row=2)
+
+        # --- Dynamic Header Injection (Explicit Write) ---
+        # Manually write headers to Row 1 because safe_write_df reads values only
+        # The structure is: ID | Client | CustomerName | Student_Cols... | Teacher_Cols...
+        ws_client.cell(row=1, column=1, value='クライアントID')
+        ws_client.cell(row=1, column=2, value='クライアント名')
+        ws_client.cell(row=1, column=3, value='クライアント名（顧客向け）')
+
+        if bento_header_names:
+            num_cols = len(bento_header_names)
+            for i in range(num_cols):
+                b_name = bento_header_names[i]
+
+                # Student Header (Starts at Col 4 = D列)
+                ws_client.cell(row=1, column=4+i, value=f"{b_name}\n(園児)")
+
+                # Teacher Header (Starts after Student Block)
+                ws_client.cell(row=1, column=4+num_cols+i, value=f"{b_name}\n(先生)")
+        # -------------------------------------------------
+
+
+def build_nouhinsyo_workbook(nouhinsyo_file, df_product_master, df_customer_master,
+                             df_paste_sheet, df_bento_sheet, df_client_sheet):
+    """納品書 (nouhinsyo.xlsx: パスまたはバイト列) を作成し、xlsx のバイト列を返す"""
+    with span("nouhinsyo_load"):
+        nouhinsyo_wb = _open_template(nouhinsyo_file)
+
+    with span("nouhinsyo_fill"):
+        _fill_nouhinsyo_workbook(nouhinsyo_wb, df_product_master, df_customer_master,
+                                 df_paste_sheet, df_bento_sheet, df_client_sheet)
+
+    with span("nouhinsyo_save"):
+        out_nouhin = io.BytesIO()
+        nouhinsyo_wb.save(out_nouhin)
+    return out_nouhin.getvalue()
+
+
+def _fill_nouhinsyo_workbook(nouhinsyo_wb, df_product_master, df_customer_master,
+                             df_paste_sheet, df_bento_sheet, df_client_sheet):
+    _replace_sheet(nouhinsyo_wb, "得意先マスタ", df_customer_master)
+
+    _write_paste_sheet(nouhinsyo_wb, df_paste_sheet)
+
+    # Bento for Nouhinsyo
+    df_bento_for_nouhin = None
+    if df_bento_sheet is not None:
+        master_df = df_product_master.copy()
+        if not master_df.empty and '商品名' in master_df.columns:
+            master_map = master_df.drop_duplicates(subset=['商品予定名']).set_index('商品予定名')['商品名'].to_dict()
+            df_bento_for_nouhin = df_bento_sheet.copy()
+            df_bento_for_nouhin['商品名'] = df_bento_for_nouhin['商品予定名'].map(master_map)
+            df_bento_for_nouhin = df_bento_for_nouhin[['商品予定名', 'パン箱入数', '商品名']]
+
+    if df_bento_for_nouhin is not None and "注文弁当の抽出" in nouhinsyo_wb.sheetnames:
+        safe_write_df(nouhinsyo_wb["注文弁当の抽出"], df_bento_for_nouhin)
+
+    if df_client_sheet is not None and "クライアント抽出" in nouhinsyo_wb.sheetnames:
+        safe_write_df(nouhinsyo_wb["クライアント抽出"], df_client_sheet)
+
+
+def _run_with_spans(fn, *args):
+    """Worker-side wrapper: returns (result, spans, memory) so measurements reach the parent."""
+    with collect_spans(observe=False) as trace:
+        result = fn(*args)
+    return result, trace.spans, trace.memory
+
+
+def build_order_workbooks(template_path, nouhinsyo_path, df_product_master, df_customer_master,
+                          df_paste_sheet, df_bento_sheet, df_client_sheet, bento_header_names,
+                          client_header=True):
+    """
+    数出表と納品書を並列に作成する (client_header: build_template_workbook を参照)。
+    Returns (template_bytes, nouhinsyo_bytes).
+    Falls back to sequential generation when worker processes are unavailable.
+    """
+    # Templates are read through the in-memory cache and handed to the workers as bytes
+    template_args = (read_template_bytes(template_path), df_product_master, df_customer_master,
+                     df_paste_sheet, df_bento_sheet, df_client_sheet, bento_header_names, client_header)
+    nouhinsyo_args = (read_template_bytes(nouhinsyo_path), df_product_master, df_customer_master,
+                      df_paste_sheet, df_bento_sheet, df_client_sheet)
+
+    if WORKBOOK_WORKERS > 1:
+        try:
+            pool = _get_pool()
+            template_future = pool.submit(_run_with_spans, build_template_workbook, *template_args)
+            nouhinsyo_future = pool.submit(_run_with_spans, build_nouhinsyo_workbook, *nouhinsyo_args)
+            template_bytes, template_spans, template_memory = template_future.result(WORKBOOK_TIMEOUT)
+            nouhinsyo_bytes, nouhinsyo_spans, nouhinsyo_memory = nouhinsyo_future.result(WORKBOOK_TIMEOUT)
+            record_spans(template_spans + nouhinsyo_spans, template_memory + nouhinsyo_memory)
+            return template_bytes, nouhinsyo_bytes
+        except FutureTimeoutError:
+            print(f"Workbook worker did not answer within {WORKBOOK_TIMEOUT:g}s, building sequentially")
+            _reset_pool(terminate=True)
+        except (BrokenProcessPool, OSError) as e:
+            print(f"Workbook pool unavailable, building sequentially: {e}")
+            _reset_pool()
+
+    return build_template_workbook(*template_args), build_nouhinsyo_workbook(*nouhinsyo_args)
@@ -0,0 +1,159 @@
+"""
+Overload check of the admission control (api.admission).
+
+Starts `uvicorn main:app` twice with the replay model backend (recorded
+responses, REPLAY_LATENCY per AI call), once with ADMISSION=0 and once with
+ORDER_CONCURRENCY=--concurrency / ORDER_QUEUE=--queue, and sends a burst of
+--burst simultaneous order uploads (sample PDFs, api/assets/pdf/) to each.
+/health is polled during the burst.
+
+With admission control every request must either succeed or be refused
+with 429 / 503 and a Retry-After header; refusals must come back quickly,
+at most concurrency + queue requests may be admitted, and the latency of
+the admitted ones stays bounded by the queue instead of growing with the
+burst.
+
+Usage (from backend/):
+    python bench/admission_bench.py [--burst 24] [--concurrency 2] [--queue 4] [--latency 1]
+"""
+import argparse
+import glob
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+sys.path.insert(0, BENCH_DIR)
+
+from load_test import multipart_body, percentile  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def post(url, filename, data, timeout=600):
+    body, content_type = multipart_body(filename, data)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status, None, time.perf_counter() - start
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get("Retry-After"), time.perf_counter() - start
+    except (urllib.error.URLError, ConnectionError, TimeoutError) as e:
+        return f"error: {e}", None, time.perf_counter() - start
+
+
+def start_server(env):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+                            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base + "/ready", timeout=5):
+                return proc, base
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not become ready")
+
+
+def burst(base, pdfs, n):
+    health = []
+    done = threading.Event()
+
+    def poll_health():
+        while not done.is_set():
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base + "/health", timeout=60):
+                    pass
+            except (urllib.error.URLError, OSError):
+                pass
+            health.append(time.perf_counter() - start)
+            time.sleep(0.1)
+
+    poller = threading.Thread(target=poll_health)
+    poller.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        results = list(pool.map(lambda i: post(base + "/api/order-invoice", *pdfs[i % len(pdfs)]), range(n)))
+    wall = time.perf_counter() - start
+    done.set()
+    poller.join()
+    return results, wall, health
+
+
+def report(label, results, wall, health):
+    ok = [s for status, _, s in results if status == 200]
+    refused = [(status, retry, s) for status, retry, s in results if status in (429, 503)]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    line = f"{label:12s} {statuses} wall {wall:5.1f}s"
+    if ok:
+        line += f" | ok p50 {statistics.median(ok):5.1f}s p95 {percentile(ok, 95):5.1f}s max {max(ok):5.1f}s"
+    if refused:
+        line += f" | refused max {max(s for _, _, s in refused):5.2f}s"
+    if health:
+        line += f" | /health max {max(health):5.2f}s"
+    print(line)
+    return ok, refused
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=24, help="simultaneous order uploads")
+    parser.add_argument("--concurrency", type=int, default=2, help="ORDER_CONCURRENCY")
+    parser.add_argument("--queue", type=int, default=4, help="ORDER_QUEUE")
+    parser.add_argument("--latency", type=float, default=1.0, help="REPLAY_LATENCY (seconds per AI call)")
+    args = parser.parse_args()
+
+    pdfs = []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        if "シール" not in os.path.basename(path):
+            with open(path, "rb") as f:
+                pdfs.append((os.path.basename(path), f.read()))
+    if not pdfs:
+        sys.exit(f"No sample order PDFs in {PDF_DIR}")
+
+    env = dict(os.environ, MODEL_BACKEND="replay", REPLAY_LATENCY=str(args.latency), RESULT_STORE="0",
+               TIMING_LOG="0", ORDER_CONCURRENCY=str(args.concurrency), ORDER_QUEUE=str(args.queue),
+               ADMISSION_QUEUE_TIMEOUT="600")
+    failures = 0
+    for label, admission in (("unlimited", "0"), ("admission", "1")):
+        proc, base = start_server(dict(env, ADMISSION=admission))
+        try:
+            results, wall, health = burst(base, pdfs, args.burst)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+        ok, refused = report(label, results, wall, health)
+        if admission == "1":
+            others = [status for status, _, _ in results if status not in (200, 429, 503)]
+            missing_retry = [r for r in refused if not r[1]]
+            if others or missing_retry or len(ok) > args.concurrency + args.queue or not refused:
+                print(f"  unexpected: {len(others)} other statuses, {len(missing_retry)} refusals without "
+                      f"Retry-After, {len(ok)} admitted (limit {args.concurrency + args.queue})")
+                failures += 1
+    print("OK" if not failures else f"{failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
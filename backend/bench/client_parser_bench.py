@@ -0,0 +1,168 @@
+"""
+Parity and speed check of the client-row parser (api.pdf_utils.parse_client_rows).
+
+parse_client_rows replaced the row loop of extract_detailed_client_info_from_pdf
+(which re-joined rows and re-scanned a +-3 row window per client with
+extract_meal_numbers_from_row). The previous loop is kept below as
+legacy_parse_client_rows; both must give identical output on:
+
+  - the layout rows of every page of the sample order PDFs (api/assets/pdf/)
+  - synthetic order PDFs (bench/synth_order_pdf.py), several scales
+  - --fuzz random row grids (digits, names, blanks, 園名 / 10001 markers)
+
+Then both parsers are timed on synthetic row grids of --sizes clients
+(layout rows built directly, no PDF) to show the scaling.
+
+Usage (from backend/):
+    python bench/client_parser_bench.py [--sizes 1000,10000,100000] [--fuzz 2000]
+"""
+import argparse
+import glob
+import io
+import os
+import random
+import re
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from api.pdf_utils import (  # noqa: E402
+    extract_meal_numbers_from_row, extract_text_with_layout, iter_pages, open_pdf, parse_client_rows
+)
+
+
+def legacy_parse_client_rows(rows):
+    """The per-page loop of extract_detailed_client_info_from_pdf before parse_client_rows."""
+    client_data = []
+    garden_row_idx = -1
+    for i, row in enumerate(rows):
+        if '園名' in ''.join(str(c) for c in row if c):
+            garden_row_idx = i
+            break
+    if garden_row_idx == -1:
+        return client_data
+    current_client_id, current_client_name = None, None
+    for i in range(garden_row_idx + 1, len(rows)):
+        row = rows[i]
+        if '10001' in ''.join(str(c) for c in row if c): break
+        if not any(str(c).strip() for c in row): continue
+        if row and row[0]:
+            left_cell = str(row[0]).strip()
+            if re.match(r'^\d+$', left_cell):
+                if current_client_id and current_client_name:
+                    client_info = extract_meal_numbers_from_row(rows, i - 1, current_client_id, current_client_name)
+                    if client_info: client_data.append(client_info)
+                current_client_id, current_client_name = left_cell, None
+            elif not re.match(r'^\d+$', left_cell) and current_client_id:
+                current_client_name = left_cell
+    if current_client_id and current_client_name:
+        client_info = extract_meal_numbers_from_row(rows, len(rows) - 1, current_client_id, current_client_name)
+        if client_info: client_data.append(client_info)
+    return client_data
+
+
+def pdf_pages_rows(pdf_bytes):
+    with open_pdf(io.BytesIO(pdf_bytes)) as pdf:
+        return [extract_text_with_layout(page) for page in iter_pages(pdf)]
+
+
+def synthetic_rows(clients, bento_cols, seed=0):
+    """Layout rows of one huge page: headers, ID / name row pairs, end rows."""
+    rng = random.Random(seed)
+    width = bento_cols + 2
+    rows = [["日付", "＊＊＊ 数出表 ＊＊＊"] + [""] * (width - 2),
+            ["園名"] + [f"弁当{i}" for i in range(bento_cols)] + ["おやつ"],
+            [""] + ["飯あり"] * bento_cols + [""]]
+    client_id = 20000
+    for c in range(clients):
+        # Neither the IDs nor the joined rows may contain the 10001 end marker
+        client_id += 1
+        while "1000" in str(client_id):
+            client_id += 1
+        counts = [str(rng.randint(2, 80)) if rng.random() < 0.3 else "" for _ in range(bento_cols)]
+        teachers = [str(rng.randint(2, 5)) if rng.random() < 0.1 else "" for _ in range(bento_cols)]
+        name = "テスト園" + "".join("アイウエオカキクケコ"[int(d)] for d in str(c))
+        rows.append([str(client_id)] + counts + [""])
+        rows.append([name] + teachers + [""])
+    rows.append(["10000"] + [""] * (width - 1))
+    rows.append(["10001"] + [""] * (width - 1))
+    return rows
+
+
+def fuzz_rows(rng):
+    vocab = ["", "", "", " ", "園名", "10001", "100", "01", "1", "0", "12", "３", "ｘ", "A園", "B小学校",
+             "20001", "20002", "名", "園", " 7 ", "様"]
+    width = rng.randint(1, 6)
+    return [[rng.choice(vocab) for _ in range(rng.randint(0, width))] for _ in range(rng.randint(0, 40))]
+
+
+def best_time(fn, rows, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="clients per synthetic grid")
+    parser.add_argument("--bento-cols", type=int, default=24)
+    parser.add_argument("--fuzz", type=int, default=2000, help="random grids for the parity check")
+    args = parser.parse_args()
+
+    from synth_order_pdf import generate_order_pdf
+
+    mismatches = 0
+    pages = []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        if "シール" in os.path.basename(path):
+            continue
+        with open(path, "rb") as f:
+            pages += [(os.path.basename(path), rows) for rows in pdf_pages_rows(f.read())]
+    for clients, cols, n_pages in ((60, 15, 1), (300, 24, 5)):
+        pdf, _ = generate_order_pdf(clients, cols, n_pages)
+        pages += [(f"synthetic {clients}x{cols}x{n_pages}", rows) for rows in pdf_pages_rows(pdf)]
+    clients_seen = 0
+    for name, rows in pages:
+        expected = legacy_parse_client_rows(rows)
+        clients_seen += len(expected)
+        if parse_client_rows(rows) != expected:
+            mismatches += 1
+            print(f"MISMATCH: {name}")
+    print(f"PDF pages: {len(pages)} pages, {clients_seen} clients, {mismatches} mismatches")
+
+    rng = random.Random(0)
+    fuzz_bad = 0
+    for _ in range(args.fuzz):
+        rows = fuzz_rows(rng)
+        if parse_client_rows(rows) != legacy_parse_client_rows(rows):
+            fuzz_bad += 1
+            if fuzz_bad <= 3:
+                print(f"MISMATCH (fuzz): {rows}")
+    print(f"fuzz: {args.fuzz} grids, {fuzz_bad} mismatches")
+    mismatches += fuzz_bad
+
+    print(f"\n{'clients':>8s} {'legacy':>10s} {'parser':>10s} {'speedup':>8s}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        rows = synthetic_rows(size, args.bento_cols)
+        if parse_client_rows(rows) != legacy_parse_client_rows(rows):
+            mismatches += 1
+            print(f"MISMATCH: synthetic grid {size}")
+        legacy_s = best_time(legacy_parse_client_rows, rows)
+        new_s = best_time(parse_client_rows, rows)
+        print(f"{size:8d} {legacy_s * 1000:8.1f}ms {new_s * 1000:8.1f}ms {legacy_s / new_s:7.2f}x")
+
+    print("OK" if not mismatches else f"{mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Import-time profile of the FastAPI app (cold start).
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter and reports
+the total import time, the slowest modules, and whether any heavy library was
+pulled in at import time (they should load lazily on first use).
+
+Usage (from backend/):
+    python bench/import_time.py [--top 15] [--max-ms 800]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that must NOT be imported by `import main`
+HEAVY_MODULES = ["pandas", "openpyxl", "pdfplumber", "pypdfium2", "google.genai"]
+
+LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def profile_import(module="main"):
+    """Return [(module, self_us, cumulative_us, depth)] for `import module`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    entries = []
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if m:
+            self_us, cum_us, indent, name = m.groups()
+            entries.append((name, int(self_us), int(cum_us), len(indent) // 2))
+    return entries
+
+
+def time_health_check():
+    """Wall time of a cold interpreter doing `import main` + /health."""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import main; main.health_check()"],
+        cwd=BACKEND_DIR, check=True, capture_output=True
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to list")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if `import main` exceeds this")
+    args = parser.parse_args()
+
+    entries = profile_import()
+    total_ms = next(cum for name, _, cum, depth in entries if name == "main" and depth == 0) / 1000
+
+    print(f"import main: {total_ms:.1f} ms")
+    print(f"cold start + /health: {time_health_check() * 1000:.1f} ms")
+    print(f"\nTop {args.top} modules by cumulative time:")
+    for name, self_us, cum_us, depth in sorted(entries, key=lambda e: e[2], reverse=True)[:args.top]:
+        print(f"  {cum_us / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name}")
+
+    imported = {name for name, *_ in entries}
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+    failed = False
+    if heavy:
+        print(f"\nNG: heavy modules imported eagerly: {', '.join(heavy)}")
+        failed = True
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"\nNG: import main took {total_ms:.1f} ms (budget {args.max_ms} ms)")
+        failed = True
+    if not failed:
+        print("\nOK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
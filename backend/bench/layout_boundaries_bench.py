@@ -0,0 +1,120 @@
+"""
+Parity and speed check of the column boundary detection of
+extract_text_with_layout (api.pdf_utils.get_vertical_boundaries).
+
+The boundaries used to need a second page.extract_words() for the text
+extent; now the words extracted for the rows are reused. The previous
+function is kept below as legacy_extract_text_with_layout; both must give
+identical rows on every page of:
+
+  - the sample order PDFs (api/assets/pdf/)
+  - synthetic order PDFs (bench/synth_order_pdf.py)
+
+with both PDF text backends. Each document is processed --repeat times and
+the time of both variants is printed.
+
+Usage (from backend/):
+    python bench/layout_boundaries_bench.py [--repeat 5]
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from api.pdf_utils import (  # noqa: E402
+    extract_text_with_layout, get_line_groups, iter_pages, open_pdf, split_line_using_boundaries
+)
+
+
+def legacy_get_vertical_boundaries(page, tolerance=2):
+    lines = page.lines
+    v_lines_x = sorted(list(set(round(line['x0'], 1) for line in lines if line['height'] > 0 and line['width'] < tolerance)))
+    words = page.extract_words()
+    if not words: return v_lines_x
+    doc_left = min(word['x0'] for word in words)
+    doc_right = max(word['x1'] for word in words)
+    boundaries = sorted(list(set([round(doc_left, 1)] + v_lines_x + [round(doc_right, 1)])))
+    merged = []
+    if boundaries:
+        merged.append(boundaries[0])
+        for b in boundaries[1:]:
+            if b - merged[-1] > tolerance * 2:
+                merged.append(b)
+    return merged
+
+
+def legacy_extract_text_with_layout(page):
+    words = page.extract_words(x_tolerance=3, y_tolerance=3, keep_blank_chars=False)
+    if not words: return []
+    boundaries = legacy_get_vertical_boundaries(page)
+    if len(boundaries) < 2:
+        text = page.extract_text(layout=False, x_tolerance=3, y_tolerance=3)
+        return [[line] for line in text.split('\n') if line.strip()] if text else []
+    row_groups = get_line_groups(words, y_tolerance=1.5)
+    result_rows = []
+    for group in row_groups:
+        sorted_group = sorted(group, key=lambda w: w['x0'])
+        columns = split_line_using_boundaries(sorted_group, boundaries)
+        if any(cell.strip() for cell in columns):
+            result_rows.append(columns)
+    return result_rows
+
+
+def layout_rows(pdf_bytes, backend, fn):
+    """Rows of every page, and the time spent in fn (the page is parsed before the clock starts)."""
+    rows, elapsed = [], 0.0
+    with open_pdf(io.BytesIO(pdf_bytes), backend) as pdf:
+        for page in iter_pages(pdf):
+            page.chars, page.lines
+            start = time.perf_counter()
+            rows.append(fn(page))
+            elapsed += time.perf_counter() - start
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="uploads of each document")
+    args = parser.parse_args()
+
+    from synth_order_pdf import generate_order_pdf
+
+    docs = []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        if "シール" in os.path.basename(path):
+            continue
+        with open(path, "rb") as f:
+            docs.append((os.path.basename(path), f.read()))
+    for clients, cols, n_pages in ((60, 15, 1), (300, 24, 5)):
+        docs.append((f"synthetic {clients}x{cols}x{n_pages}", generate_order_pdf(clients, cols, n_pages)[0]))
+
+    mismatches = 0
+    print(f"{'document':40s} {'backend':>10s} {'legacy':>9s} {'reused':>9s} {'speedup':>8s}")
+    for backend in ("pdfplumber", "pdfium"):
+        for name, data in docs:
+            legacy_s = new_s = 0.0
+            for _ in range(args.repeat):
+                expected, elapsed = layout_rows(data, backend, legacy_extract_text_with_layout)
+                legacy_s += elapsed
+                actual, elapsed = layout_rows(data, backend, extract_text_with_layout)
+                new_s += elapsed
+                if actual != expected:
+                    mismatches += 1
+                    print(f"MISMATCH: {name} ({backend})")
+            print(f"{name[:40]:40s} {backend:>10s} {legacy_s * 1000:7.1f}ms {new_s * 1000:7.1f}ms"
+                  f" {legacy_s / new_s:7.2f}x")
+
+    print("OK" if not mismatches else f"{mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Throughput / latency test against a running backend, without Gemini.
+
+Start the server with the replay model backend (recorded responses, with
+an artificial delay that mimics the Gemini call):
+
+    MODEL_BACKEND=replay REPLAY_LATENCY=8 REPLAY_JITTER=4 \\
+        python -m uvicorn main:app --port 8000
+
+then, from backend/:
+
+    python bench/load_test.py [--url http://127.0.0.1:8000] [--endpoint order]
+                              [--requests 20] [--concurrency 4]
+
+Every request uploads one of the sample PDFs in api/assets/pdf/ (those have
+recorded responses in bench/recorded_responses.json). Only the standard
+library is used, so it also runs outside the backend's virtualenv.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PDF_DIR = os.path.join(os.path.dirname(os.path.dirname(BENCH_DIR)), "api", "assets", "pdf")
+
+ENDPOINTS = {
+    "order": ("/api/order-invoice", lambda name: "シール" not in name),
+    "seal": ("/api/seal", lambda name: "シール" in name),
+}
+
+
+def multipart_body(filename, data):
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode()
+    return head + data + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def post_pdf(url, filename, data, timeout):
+    body, content_type = multipart_body(filename, data)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, TimeoutError) as e:
+        status = f"error: {e}"
+    return status, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="order")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    path, wanted = ENDPOINTS[args.endpoint]
+    pdfs = []
+    for pdf_path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        if wanted(os.path.basename(pdf_path)):
+            with open(pdf_path, "rb") as f:
+                pdfs.append((os.path.basename(pdf_path), f.read()))
+    if not pdfs:
+        sys.exit(f"No sample PDFs for '{args.endpoint}' in {PDF_DIR}")
+
+    url = args.url.rstrip("/") + path
+    results = []
+    lock = threading.Lock()
+
+    def one(i):
+        name, data = pdfs[i % len(pdfs)]
+        status, seconds = post_pdf(url, name, data, args.timeout)
+        with lock:
+            results.append((status, seconds))
+            print(f"  #{i + 1:3d} {name}: {status} in {seconds:.2f}s")
+
+    print(f"POST {url}: {args.requests} requests, concurrency {args.concurrency}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - start
+
+    ok = [s for status, s in results if status == 200]
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = {
+        "requests": len(results),
+        "statuses": statuses,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+    }
+    if ok:
+        summary.update({
+            "p50_s": round(statistics.median(ok), 2),
+            "p95_s": round(percentile(ok, 95), 2),
+            "max_s": round(max(ok), 2),
+        })
+    print(json.dumps(summary, indent=1))
+    sys.exit(0 if len(ok) == len(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
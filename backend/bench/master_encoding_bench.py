@@ -0,0 +1,150 @@
+"""
+Parse count and parity check of the master CSV encoding handling
+(api.master_utils: detect_encoding / parse_master_csv / save_master_file).
+
+The previous loader parsed a CSV with each of utf-8-sig, utf-8, cp932 and
+shift_jis until one worked (three full parses for our cp932 masters). It is
+kept below as legacy_parse_master_csv. For each master CSV in the assets
+directory, re-encoded as cp932, UTF-8, UTF-8 with BOM and Shift_JIS (where
+the text fits), in a temporary directory:
+
+  - parses   pd.read_csv calls of the legacy loader and of parse_master_csv
+             on the file as is (no metadata: encoding detected from a sample)
+  - upload   save_master_file: the saved CSV must be UTF-8, its metadata must
+             record the source encoding, and parse_master_csv must parse it
+             once
+  - the frames of all three must be identical
+
+Snapshots are disabled here (MASTER_SNAPSHOTS=0) so every load parses.
+
+Usage (from backend/):
+    python bench/master_encoding_bench.py [--assets api/assets]
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ["MASTER_SNAPSHOTS"] = "0"
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import pandas as pd  # noqa: E402
+
+from api import master_utils  # noqa: E402
+from api.master_utils import (  # noqa: E402
+    find_master_file, parse_master_csv, read_master_metadata, save_master_file
+)
+
+ENCODINGS = ["cp932", "utf-8", "utf-8-sig", "shift_jis"]
+
+
+def legacy_parse_master_csv(path):
+    encodings = ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis']
+    for encoding in encodings:
+        try:
+            df = pd.read_csv(path, encoding=encoding, dtype=str).fillna('')
+            if not df.empty:
+                df.columns = df.columns.str.strip()
+                return df
+        except Exception:
+            continue
+    return None
+
+
+class CountingReadCsv:
+    """Counts pd.read_csv calls (both loaders look it up on the pandas module)."""
+
+    def __init__(self):
+        self.calls = 0
+        self.original = pd.read_csv
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return self.original(*args, **kwargs)
+
+    def run(self, fn, *args):
+        self.calls = 0
+        pd.read_csv = master_utils.pd.read_csv = self
+        try:
+            start = time.perf_counter()
+            result = fn(*args)
+            return result, self.calls, time.perf_counter() - start
+        finally:
+            pd.read_csv = master_utils.pd.read_csv = self.original
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assets", default=os.path.join(BACKEND_DIR, "api", "assets"))
+    args = parser.parse_args()
+
+    counter = CountingReadCsv()
+    failures = 0
+    tmp = tempfile.mkdtemp(prefix="master_encoding_")
+    try:
+        print(f"{'master':36s} {'encoding':>10s} {'legacy':>14s} {'detected':>14s} {'uploaded':>14s}")
+        for src in sorted(glob.glob(os.path.join(args.assets, "*マスタ*.csv"))):
+            text = legacy_parse_master_csv(src)
+            if text is None:
+                continue
+            with open(src, "rb") as f:
+                raw = f.read()
+            source_text = raw.decode(master_utils.detect_encoding(raw))
+            pattern = "商品マスタ" if "商品マスタ" in os.path.basename(src) else "得意先マスタ"
+            for encoding in ENCODINGS:
+                try:
+                    data = source_text.encode(encoding)
+                except UnicodeEncodeError:
+                    print(f"{os.path.basename(src)[:36]:36s} {encoding:>10s} (text does not fit)")
+                    continue
+                work = os.path.join(tmp, encoding)
+                os.makedirs(work, exist_ok=True)
+                path = os.path.join(work, os.path.basename(src))
+                with open(path, "wb") as f:
+                    f.write(data)
+
+                legacy, legacy_n, legacy_s = counter.run(legacy_parse_master_csv, path)
+                detected, detected_n, detected_s = counter.run(parse_master_csv, path)
+
+                upload_dir = os.path.join(work, "upload")
+                os.makedirs(upload_dir, exist_ok=True)
+                save_master_file(upload_dir, data, os.path.basename(src), pattern)
+                saved = find_master_file(upload_dir, pattern)
+                with open(saved, "rb") as f:
+                    saved_bytes = f.read()
+                metadata = read_master_metadata(saved) or {}
+                uploaded, uploaded_n, uploaded_s = counter.run(parse_master_csv, saved)
+
+                problems = []
+                if not (legacy.equals(detected) and legacy.equals(uploaded)):
+                    problems.append("frames differ")
+                try:
+                    saved_bytes.decode("utf-8")
+                except UnicodeDecodeError:
+                    problems.append("saved file is not UTF-8")
+                if saved_bytes.startswith(b"\xef\xbb\xbf"):
+                    problems.append("saved file has a BOM")
+                if metadata.get("source_encoding") is None or metadata.get("encoding") != "utf-8":
+                    problems.append(f"metadata {metadata}")
+                if detected_n != 1 or uploaded_n != 1:
+                    problems.append("more than one parse")
+                failures += bool(problems)
+                print(f"{os.path.basename(src)[:36]:36s} {encoding:>10s}"
+                      f" {legacy_n}x {legacy_s * 1000:8.1f}ms {detected_n}x {detected_s * 1000:8.1f}ms"
+                      f" {uploaded_n}x {uploaded_s * 1000:8.1f}ms"
+                      f"  {metadata.get('source_encoding')}{'  ' + '; '.join(problems) if problems else ''}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print("OK" if not failures else f"{failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Parity and speed check of the master snapshots (api.master_utils).
+
+For each master CSV in the assets directory, and for synthetic customer
+masters of --sizes rows (cp932, like the real exports), in a temporary
+directory:
+
+  - parse     parse_master_csv (pandas, encoding trial-and-error)
+  - snapshot  read_master_csv with an up-to-date <csv>.arrow snapshot
+  - cold      the same in a fresh interpreter (imports included), as after a
+              deploy / worker restart
+
+The snapshot's DataFrame must equal the parsed one (values, columns, dtypes).
+Also checks that a replaced CSV invalidates its snapshot.
+
+Usage (from backend/):
+    python bench/master_snapshot_bench.py [--sizes 10000,50000] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from api.master_utils import (  # noqa: E402
+    parse_master_csv, read_master_csv, snapshot_is_current, snapshot_path, write_master_snapshot
+)
+
+COLD_LOAD = (
+    "import sys, time; start = time.perf_counter(); sys.path.insert(0, {backend!r}); "
+    "from api.master_utils import read_master_csv; df = read_master_csv({path!r}); "
+    "print(time.perf_counter() - start, len(df))"
+)
+
+
+def synthetic_customer_csv(path, rows, seed=0):
+    rng = random.Random(seed)
+    header = ["得意先ＣＤ", "得意先名", "得意先名カナ", "得意先略称", "郵便番号", "住所１", "住所２", "電話番号",
+              "請求先ＣＤ", "締日", "売掛区分", "備考", "更新日時"]
+    lines = [",".join(header)]
+    for i in range(rows):
+        name = f"テスト保育園{i}号館"
+        lines.append(",".join([
+            str(10 + i), name, f"ﾃｽﾄﾎｲｸｴﾝ{i}", name[:6], f"{rng.randint(800, 899)}-{rng.randint(0, 9999):04d}",
+            f"福岡県福岡市{rng.randint(1, 9)}-{rng.randint(1, 30)}", "", f"092-{rng.randint(100, 999)}-{i % 10000:04d}",
+            str(10 + i), str(rng.choice([10, 20, 99])), "1", "" if rng.random() < 0.7 else "備考あり",
+            "2025/08/27 16:54:39",
+        ]))
+    with open(path, "w", encoding="cp932", newline="") as f:
+        f.write("\r\n".join(lines) + "\r\n")
+
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def cold_time(path, repeat, snapshots):
+    env = dict(os.environ, MASTER_SNAPSHOTS="1" if snapshots else "0")
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", COLD_LOAD.format(backend=BACKEND_DIR, path=path)],
+                             capture_output=True, text=True, check=True, env=env).stdout.split()
+        best = float(out[0]) if best is None else min(best, float(out[0]))
+    return best
+
+
+def same_frame(a, b):
+    return a.equals(b) and list(a.columns) == list(b.columns) and list(a.dtypes) == list(b.dtypes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,50000", help="rows of the synthetic customer masters")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--assets", default=os.path.join(BACKEND_DIR, "api", "assets"))
+    args = parser.parse_args()
+
+    failures = 0
+    tmp = tempfile.mkdtemp(prefix="master_snapshots_")
+    try:
+        paths = []
+        for src in sorted(glob.glob(os.path.join(args.assets, "*マスタ*.csv"))):
+            dst = os.path.join(tmp, os.path.basename(src))
+            shutil.copy2(src, dst)
+            paths.append(dst)
+        for size in (int(s) for s in args.sizes.split(",") if s):
+            path = os.path.join(tmp, f"得意先マスタ一覧_synthetic_{size}.csv")
+            synthetic_customer_csv(path, size)
+            paths.append(path)
+
+        print(f"{'master':44s} {'rows':>7s} {'parse':>9s} {'snapshot':>9s} {'speedup':>8s}"
+              f" {'cold parse':>11s} {'cold snap':>10s}")
+        for path in paths:
+            parse_s, parsed = best_time(lambda: parse_master_csv(path), args.repeat)
+            if parsed is None:
+                print(f"{os.path.basename(path)[:44]:44s} could not be parsed")
+                failures += 1
+                continue
+            cold_parse_s = cold_time(path, args.repeat, snapshots=False)
+            write_master_snapshot(path, parsed)
+            snap_s, loaded = best_time(lambda: read_master_csv(path), args.repeat)
+            cold_snap_s = cold_time(path, args.repeat, snapshots=True)
+            ok = snapshot_is_current(path) and same_frame(parsed, loaded)
+            failures += not ok
+            print(f"{os.path.basename(path)[:44]:44s} {len(parsed):7d} {parse_s * 1000:7.1f}ms {snap_s * 1000:7.1f}ms"
+                  f" {parse_s / snap_s:7.1f}x {cold_parse_s * 1000:9.0f}ms {cold_snap_s * 1000:8.0f}ms"
+                  f"{'' if ok else '  MISMATCH'}")
+
+        # A replaced CSV must not be served from the old snapshot
+        path = paths[0]
+        df = read_master_csv(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n")
+        os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        stale = snapshot_is_current(path)
+        failures += stale
+        print(f"\nreplaced CSV: snapshot {'still used (STALE)' if stale else 'invalidated'}")
+        del df
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print("OK" if not failures else f"{failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Concurrency check of master uploads (api.master_utils.save_master_file,
+versioned directories + CURRENT pointer) against readers.
+
+A copy of the assets masters goes to a temporary directory. --readers
+threads then resolve and load the masters in a loop, the way requests do
+(find_master_file + read_master_csv, and OrderPipeline.load_masters),
+while one writer uploads --uploads new versions, alternating between two
+contents (the original master and one with an extra row).
+
+Every read must return one of the two complete frames: a missing file,
+None, an empty frame or any other frame counts as a failure. The same run
+is repeated with legacy_save_master_file, the previous upload (delete the
+old CSVs, then write the new one in place), to show the failures it allows.
+
+Usage (from backend/):
+    python bench/master_swap_bench.py [--readers 4] [--uploads 40] [--keep 2]
+"""
+import argparse
+import glob
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import pandas as pd  # noqa: E402
+
+from api.master_utils import (  # noqa: E402
+    MASTER_PATTERNS, find_master_file, normalize_to_utf8, read_master_csv, save_master_file, versions_dir
+)
+
+CUSTOMER_PATTERN = MASTER_PATTERNS[1]
+
+
+def legacy_save_master_file(base_path, file_content, filename, file_pattern):
+    """save_master_file before versioning: remove the current CSVs, then write the new one in place."""
+    search_path = os.path.join(base_path, f'*{file_pattern}*.csv')
+    for f in glob.glob(search_path) + glob.glob(search_path + ".*"):
+        os.remove(f)
+    with open(os.path.join(base_path, os.path.basename(filename)), "wb") as f:
+        f.write(normalize_to_utf8(file_content)[0])
+    return True
+
+
+def run(label, save, assets, contents, readers, uploads, pipeline_reads):
+    from api.order_pipeline import OrderPipeline
+
+    work = tempfile.mkdtemp(prefix="master_swap_")
+    try:
+        for path in glob.glob(os.path.join(assets, "*マスタ*.csv")):
+            shutil.copy(path, work)
+        expected = []
+        for data in contents:
+            df = pd.read_csv(io.BytesIO(normalize_to_utf8(data)[0]), encoding="utf-8", dtype=str).fillna('')
+            df.columns = df.columns.str.strip()
+            expected.append(df)
+        pipeline = OrderPipeline(assets_dir=work, model_backend=object())
+
+        stop = threading.Event()
+        stats = {"reads": 0, "failures": 0, "examples": []}
+        lock = threading.Lock()
+
+        def check(df, where):
+            ok = df is not None and not df.empty and any(df.equals(e) for e in expected)
+            with lock:
+                stats["reads"] += 1
+                if not ok:
+                    stats["failures"] += 1
+                    if len(stats["examples"]) < 3:
+                        stats["examples"].append(f"{where}: {'None' if df is None else f'{len(df)} rows'}")
+
+        def reader(i):
+            while not stop.is_set():
+                try:
+                    if pipeline_reads and i % 2:
+                        check(pipeline.load_masters().customer, "load_masters")
+                    else:
+                        path = find_master_file(work, CUSTOMER_PATTERN)
+                        check(read_master_csv(path) if path else None, "find_master_file")
+                except Exception as e:
+                    with lock:
+                        stats["reads"] += 1
+                        stats["failures"] += 1
+                        if len(stats["examples"]) < 3:
+                            stats["examples"].append(f"{type(e).__name__}: {e}")
+
+        filename = os.path.basename(find_master_file(work, CUSTOMER_PATTERN))
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for n in range(uploads):
+            save(work, contents[(n + 1) % 2], filename, CUSTOMER_PATTERN)
+            time.sleep(0.005)
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        final = read_master_csv(find_master_file(work, CUSTOMER_PATTERN))
+        if final is None or not final.equals(expected[uploads % 2]):
+            stats["failures"] += 1
+            stats["examples"].append("last upload is not current")
+        root = versions_dir(work, CUSTOMER_PATTERN)
+        kept = len([d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d))]) if os.path.isdir(root) else 0
+        print(f"{label:10s} {uploads} uploads, {stats['reads']} reads in {elapsed:.1f}s,"
+              f" {stats['failures']} failed, {kept} version dirs"
+              f"{'  (' + '; '.join(stats['examples']) + ')' if stats['examples'] else ''}")
+        return stats["failures"], kept
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assets", default=os.path.join(BACKEND_DIR, "api", "assets"))
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--uploads", type=int, default=40)
+    parser.add_argument("--keep", type=int, default=2, help="MASTER_VERSIONS_KEEP")
+    args = parser.parse_args()
+    os.environ["MASTER_VERSIONS_KEEP"] = str(args.keep)
+
+    source = find_master_file(args.assets, CUSTOMER_PATTERN)
+    if source is None:
+        sys.exit(f"No {CUSTOMER_PATTERN} CSV in {args.assets}")
+    with open(source, "rb") as f:
+        original = f.read()
+    text = normalize_to_utf8(original)[0].decode("utf-8")
+    extra_row = text.rstrip("\r\n").splitlines()[-1]
+    changed = (text.rstrip("\r\n") + "\n" + extra_row + "\n").encode("utf-8")
+    contents = [original, changed]
+
+    # Snapshot writes racing the legacy deletes log a warning each time
+    logging.disable(logging.WARNING)
+    run("legacy", legacy_save_master_file, args.assets, contents, args.readers, args.uploads, False)
+    logging.disable(logging.NOTSET)
+    failures, kept = run("versioned", save_master_file, args.assets, contents, args.readers, args.uploads, True)
+    # The current version plus at most `keep` older ones
+    if kept > args.keep + 1:
+        print(f"pruning: {kept} version dirs kept, expected at most {args.keep + 1}")
+        failures += 1
+    print("OK" if not failures else f"{failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Memory budget check for order requests on the bundled sample PDFs.
+
+Each sample order PDF goes through the same stages as POST /api/order-invoice
+(OrderPipeline.run with recorded AI responses, then base64 encoding). Two
+fresh interpreters are used so the measurements do not disturb each other:
+
+  rss    peak RSS of the app process + workbook workers while a request runs
+         (sampled like the request middleware does), tracemalloc off
+  alloc  per-stage peak Python allocations with MEMORY_PROFILE=1 (tracemalloc)
+
+The results are checked against bench/memory_budget.json; any value above
+its budget fails the run. Budgets are written with --save-budget as the
+measured values times --headroom.
+
+Usage (from backend/):
+    python bench/memory_budget.py [--workers 2]
+    python bench/memory_budget.py --save-budget [--headroom 1.3]
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+BUDGET_PATH = os.path.join(BENCH_DIR, "memory_budget.json")
+
+
+def measure(mode):
+    """Runs inside the child interpreter; prints one JSON result line."""
+    sys.path.insert(0, BACKEND_DIR)
+    import base64
+    from api.metrics import start_trace, span, rss_sampler, total_rss
+    from api.model_backend import ReplayBackend
+    from api.order_pipeline import OrderPipeline
+    from api.workbook_utils import warm_workbook_pool
+
+    assets_dir = os.getenv("ASSETS_DIR", os.path.join(BACKEND_DIR, "api", "assets"))
+    pipeline = OrderPipeline(assets_dir, header_source="ai", model_backend=ReplayBackend())
+    pipeline.load_masters()
+    warm_workbook_pool(pipeline.template_paths())
+
+    pdfs = [p for p in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))) if "シール" not in os.path.basename(p)]
+    result = {"idle_rss_mb": round((total_rss() or 0) / 2**20, 1), "peak_rss_mb": 0, "stage_alloc_peak_mb": {}}
+    for path in pdfs:
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+        trace = start_trace()
+        with rss_sampler.window() as rss:
+            order = pipeline.run(pdf_bytes)
+            with span("encode"):
+                encoded = (base64.b64encode(order.template_bytes).decode(),
+                           base64.b64encode(order.nouhinsyo_bytes).decode())
+            del order, encoded
+        if rss.peak is not None:
+            result["peak_rss_mb"] = max(result["peak_rss_mb"], round(rss.peak / 2**20, 1))
+        for stage, mb in trace.memory_dict().items():
+            peaks = result["stage_alloc_peak_mb"]
+            peaks[stage] = max(peaks.get(stage, 0), mb)
+    if mode == "rss":
+        del result["stage_alloc_peak_mb"]
+    print(json.dumps(result))
+
+
+def run_child(mode, workers):
+    env = dict(os.environ, WORKBOOK_WORKERS=str(workers), TIMING_LOG="0",
+               MEMORY_PROFILE="1" if mode == "alloc" else "0")
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", mode],
+                          cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKBOOK_WORKERS", "2")))
+    parser.add_argument("--budget", default=BUDGET_PATH)
+    parser.add_argument("--save-budget", action="store_true")
+    parser.add_argument("--headroom", type=float, default=1.3)
+    parser.add_argument("--measure", choices=["rss", "alloc"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure)
+        return
+
+    rss = run_child("rss", args.workers)
+    alloc = run_child("alloc", args.workers)
+    measured = {"peak_rss_mb": rss["peak_rss_mb"], "stage_alloc_peak_mb": alloc["stage_alloc_peak_mb"]}
+
+    print(f"idle RSS (app + {args.workers} workbook workers): {rss['idle_rss_mb']:.1f} MB")
+    print(f"peak RSS during a request:                {rss['peak_rss_mb']:.1f} MB")
+    print("peak Python allocations per stage (tracemalloc):")
+    for stage, mb in sorted(alloc["stage_alloc_peak_mb"].items(), key=lambda kv: -kv[1]):
+        print(f"  {stage:16s} {mb:8.1f} MB")
+
+    if args.save_budget:
+        budget = {
+            "workers": args.workers,
+            "peak_rss_mb": round(measured["peak_rss_mb"] * args.headroom),
+            "stage_alloc_peak_mb": {k: round(max(v * args.headroom, 1.0), 1)
+                                    for k, v in measured["stage_alloc_peak_mb"].items()},
+        }
+        with open(args.budget, "w", encoding="utf-8") as f:
+            json.dump(budget, f, indent=1)
+            f.write("\n")
+        print(f"\nBudget saved to {args.budget}")
+        return
+
+    if not os.path.exists(args.budget):
+        print("\nNo budget to check against (use --save-budget)")
+        return
+    with open(args.budget, encoding="utf-8") as f:
+        budget = json.load(f)
+
+    over = []
+    if measured["peak_rss_mb"] > budget["peak_rss_mb"]:
+        over.append(f"peak RSS {measured['peak_rss_mb']:.1f} MB > {budget['peak_rss_mb']} MB")
+    for stage, limit in budget.get("stage_alloc_peak_mb", {}).items():
+        value = measured["stage_alloc_peak_mb"].get(stage)
+        if value is not None and value > limit:
+            over.append(f"{stage} {value:.1f} MB > {limit} MB")
+    print()
+    for line in over:
+        print(f"NG: {line}")
+    print("OK" if not over else f"{len(over)} over budget")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
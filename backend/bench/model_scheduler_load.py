@@ -0,0 +1,206 @@
+"""
+Load test of the Gemini call scheduler (api.model_scheduler) against a local
+fake Gemini server.
+
+The fake server speaks the generateContent REST API used by google-genai
+(POST /v1beta/models/<model>:generateContent) and:
+
+  - enforces its own quota (--server-rps, token bucket): calls above it get
+    429 RESOURCE_EXHAUSTED with a RetryInfo retryDelay, like the real API
+  - injects random 429 / 503 errors (--error-rate)
+  - answers after --latency seconds (+ up to --jitter)
+
+The real process_order_pdf_with_ai / generate_seal_data functions are called
+(GEMINI_BASE_URL points their client at the fake server) from --concurrency
+threads, once with the scheduler disabled (one-shot calls, as before) and
+once with it enabled, and the success rate / throughput / latency of both
+runs are printed. Fails (exit 1) when a scheduled call fails.
+
+Usage (from backend/):
+    python bench/model_scheduler_load.py [--calls 40] [--concurrency 8]
+        [--server-rps 4] [--error-rate 0.1] [--latency 0.3] [--jitter 0.3]
+        [--rpm 120] [--max-concurrency 4]
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+sys.path.insert(0, BACKEND_DIR)
+
+ORDER_RESPONSE = {"bento_headers": ["キャラ弁(学食) 飯あり 100", "赤 飯なし"], "clients": []}
+SEAL_RESPONSE = {"blocks": [{"client_name": "テスト様", "preparations": [], "class_name": "さくら",
+                             "meal_count": "35", "date": "12/10", "grade": "年長"}]}
+
+
+class FakeGemini:
+    def __init__(self, rps, error_rate, latency, jitter):
+        self.rps = rps
+        self.error_rate = error_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens = float(rps)
+        self.updated = time.monotonic()
+        self.stats = {"requests": 0, "quota_429": 0, "injected": 0, "ok": 0}
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """Server-side quota: False when the caller is over the rate."""
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            self.tokens = min(self.rps, self.tokens + (now - self.updated) * self.rps)
+            self.updated = now
+            if self.tokens < 1:
+                self.stats["quota_429"] += 1
+                return False
+            self.tokens -= 1
+            return True
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not fake.admit():
+                    self.send_json(429, {"error": {
+                        "code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Quota exceeded (fake)",
+                        "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                                     "retryDelay": f"{1 / fake.rps:.2f}s"}],
+                    }})
+                    return
+                time.sleep(fake.latency + random.uniform(0, fake.jitter))
+                if random.random() < fake.error_rate:
+                    fake.count("injected")
+                    status = random.choice([429, 503])
+                    self.send_json(status, {"error": {
+                        "code": status, "message": "Injected error (fake)",
+                        "status": "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"}})
+                    return
+                prompt = json.dumps(request, ensure_ascii=False)
+                answer = SEAL_RESPONSE if "シール" in prompt else ORDER_RESPONSE
+                fake.count("ok")
+                self.send_json(200, {"candidates": [{
+                    "content": {"role": "model", "parts": [{"text": json.dumps(answer, ensure_ascii=False)}]},
+                    "finishReason": "STOP", "index": 0,
+                }]})
+
+        return Handler
+
+
+def load_pdfs():
+    pdfs = []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        with open(path, "rb") as f:
+            pdfs.append(("seal" if "シール" in os.path.basename(path) else "order", f.read()))
+    return pdfs
+
+
+def run_calls(pdfs, calls, concurrency):
+    from api.ai_processor import process_order_pdf_with_ai
+    from api.seal_utils import generate_seal_data
+
+    results = []
+    lock = threading.Lock()
+
+    def one(i):
+        kind, pdf_bytes = pdfs[i % len(pdfs)]
+        start = time.perf_counter()
+        try:
+            if kind == "seal":
+                ok = bool(generate_seal_data(pdf_bytes, model_name="gemini-fake-seal", api_key="fake"))
+            else:
+                ok = bool(process_order_pdf_with_ai(pdf_bytes, "fake", model_name="gemini-fake-order"))
+        except Exception:
+            ok = False
+        with lock:
+            results.append((ok, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    # The extraction functions log / print every failed call: keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(calls)))
+    wall = time.perf_counter() - start
+    ok_times = [s for ok, s in results if ok]
+    summary = {"ok": len(ok_times), "failed": len(results) - len(ok_times), "wall_s": round(wall, 2),
+               "throughput_cps": round(len(ok_times) / wall, 2) if wall else None}
+    if ok_times:
+        summary["p50_s"] = round(statistics.median(ok_times), 2)
+        summary["p95_s"] = round(sorted(ok_times)[min(len(ok_times) - 1, int(0.95 * len(ok_times)))], 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument("--server-rps", type=float, default=4.0, help="fake server quota (requests/s)")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="injected 429/503 probability")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--rpm", type=float, default=120, help="scheduler GEMINI_RPM per model")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="scheduler GEMINI_CONCURRENCY per model")
+    args = parser.parse_args()
+
+    fake = FakeGemini(args.server_rps, args.error_rate, args.latency, args.jitter)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.setdefault("TIMING_LOG", "0")
+    logging.disable(logging.CRITICAL)
+
+    from api import model_scheduler
+    from api.model_scheduler import ModelScheduler
+
+    pdfs = load_pdfs()
+    if not pdfs:
+        sys.exit(f"No sample PDFs in {PDF_DIR}")
+
+    print(f"fake server: quota {args.server_rps}/s, error rate {args.error_rate:.0%}, "
+          f"latency {args.latency}+{args.jitter}s; {args.calls} calls from {args.concurrency} threads")
+    report = {}
+    for label, enabled in (("one-shot", False), ("scheduled", True)):
+        model_scheduler._scheduler = ModelScheduler(
+            rpm=args.rpm, burst=args.max_concurrency, concurrency=args.max_concurrency,
+            max_retries=8, backoff_base=0.25, backoff_max=5.0, enabled=enabled)
+        before = dict(fake.stats)
+        summary = run_calls(pdfs, args.calls, args.concurrency)
+        summary["server"] = {k: fake.stats[k] - before[k] for k in fake.stats}
+        report[label] = summary
+        print(f"{label:10s} {json.dumps(summary, ensure_ascii=False)}")
+
+    server.shutdown()
+    sys.exit(1 if report["scheduled"]["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Parity and speed check of the PDF text backends (api.pdf_text_backend):
+"pdfium" (PdfiumPDF, pypdfium2) against "pdfplumber" (pdfminer.six).
+
+For every page of the sample PDFs (api/assets/pdf/, orders and seals) and of
+synthetic order PDFs (bench/synth_order_pdf.py) the backends must give the
+same:
+
+  - words       page.extract_words(x_tolerance=3, y_tolerance=3) text, and
+                x0 / x1 / top within --tolerance points
+  - boundaries  get_vertical_boundaries (ruling lines + text extent)
+  - rows        extract_text_with_layout (the rows / columns the client
+                parser reads)
+  - clients     extract_detailed_client_info_from_pdf / the paste sheet
+  - text        ai_processor.extract_text_from_pdf_bytes
+
+Pages with a non-embedded font are read with pdfplumber by the pdfium
+backend too (see api.pdf_text_backend); the count of pages PDFium actually
+read is printed per document (the synthetic PDFs use a non-embedded font).
+
+Then the layout extraction (extract_detailed_client_info_from_pdf) and the
+plain text extraction are timed per document with both backends.
+
+Usage (from backend/):
+    python bench/pdf_text_backend_bench.py [--repeat 3] [--tolerance 0.05]
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from api.ai_processor import extract_text_from_pdf_bytes  # noqa: E402
+from api.pdf_utils import (  # noqa: E402
+    extract_detailed_client_info_from_pdf, extract_text_with_layout, get_vertical_boundaries, iter_pages,
+    open_pdf, pdf_to_excel_data_for_paste_sheet
+)
+
+
+def page_views(pdf_bytes, backend):
+    views = []
+    with open_pdf(io.BytesIO(pdf_bytes), backend) as pdf:
+        for page in iter_pages(pdf):
+            words = page.extract_words(x_tolerance=3, y_tolerance=3, keep_blank_chars=False)
+            views.append({
+                "words": sorted((w["top"], w["x0"], w["x1"], w["text"]) for w in words),
+                "boundaries": get_vertical_boundaries(page),
+                "rows": extract_text_with_layout(page),
+                "backend": getattr(page, "backend", backend),
+            })
+    return views
+
+
+def compare_words(expected, actual, tolerance):
+    """First difference between two sorted word lists, or None."""
+    if len(expected) != len(actual):
+        return f"{len(actual)} words, expected {len(expected)}"
+    for (top, x0, x1, text), (top2, x02, x12, text2) in zip(expected, actual):
+        if text != text2:
+            return f"word {text2!r}, expected {text!r}"
+        if max(abs(top - top2), abs(x0 - x02), abs(x1 - x12)) > tolerance:
+            return (f"word {text!r} at ({x02:.2f}, {x12:.2f}, {top2:.2f}), "
+                    f"expected ({x0:.2f}, {x1:.2f}, {top:.2f})")
+    return None
+
+
+def document_diffs(pdf_bytes, tolerance):
+    """(differences, pages read with PDFium, pages)"""
+    diffs = []
+    plumber, pdfium = page_views(pdf_bytes, "pdfplumber"), page_views(pdf_bytes, "pdfium")
+    native = sum(view["backend"] == "pdfium" for view in pdfium)
+    if len(plumber) != len(pdfium):
+        return [f"{len(pdfium)} pages, expected {len(plumber)}"], native, len(plumber)
+    for number, (expected, actual) in enumerate(zip(plumber, pdfium), start=1):
+        problem = compare_words(expected["words"], actual["words"], tolerance)
+        if problem:
+            diffs.append(f"page {number}: {problem}")
+        for key in ("boundaries", "rows"):
+            if expected[key] != actual[key]:
+                diffs.append(f"page {number}: {key} differ")
+    for label, fn in (
+        ("clients", lambda backend: extract_detailed_client_info_from_pdf(io.BytesIO(pdf_bytes), backend=backend)),
+        ("paste sheet", lambda backend: _frame_rows(pdf_to_excel_data_for_paste_sheet(io.BytesIO(pdf_bytes),
+                                                                                     backend=backend))),
+        ("text", lambda backend: extract_text_from_pdf_bytes(pdf_bytes, backend=backend)),
+    ):
+        if fn("pdfplumber") != fn("pdfium"):
+            diffs.append(f"{label} differ")
+    return diffs, native, len(plumber)
+
+
+def _frame_rows(df):
+    return None if df is None else df.values.tolist()
+
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.05, help="max word coordinate difference (points)")
+    args = parser.parse_args()
+
+    from synth_order_pdf import generate_order_pdf
+
+    docs = []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        with open(path, "rb") as f:
+            docs.append((os.path.basename(path), f.read()))
+    for clients, cols, n_pages in ((60, 15, 1), (300, 24, 5)):
+        docs.append((f"synthetic {clients}x{cols}x{n_pages}", generate_order_pdf(clients, cols, n_pages)[0]))
+
+    mismatches = 0
+    for name, data in docs:
+        diffs, native, pages = document_diffs(data, args.tolerance)
+        mismatches += bool(diffs)
+        print(f"{name[:48]:48s} {'OK' if not diffs else 'MISMATCH':8s} {native}/{pages} pages read with PDFium")
+        for diff in diffs[:5]:
+            print(f"    {diff}")
+
+    print(f"\n{'document':48s} {'layout plumber':>15s} {'pdfium':>9s} {'speedup':>8s}"
+          f" {'text plumber':>13s} {'pdfium':>9s} {'speedup':>8s}")
+    for name, data in docs:
+        times = {}
+        for backend in ("pdfplumber", "pdfium"):
+            times["layout", backend] = best_time(
+                lambda: extract_detailed_client_info_from_pdf(io.BytesIO(data), backend=backend), args.repeat)
+            times["text", backend] = best_time(
+                lambda: extract_text_from_pdf_bytes(data, backend=backend), args.repeat)
+        line = f"{name[:48]:48s}"
+        for kind, width in (("layout", 15), ("text", 13)):
+            plumber_s, pdfium_s = times[kind, "pdfplumber"], times[kind, "pdfium"]
+            line += (f" {plumber_s * 1000:{width - 2}.0f}ms {pdfium_s * 1000:7.0f}ms"
+                     f" {plumber_s / pdfium_s:7.2f}x")
+        print(line)
+
+    print("OK" if not mismatches else f"{mismatches} documents differ")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
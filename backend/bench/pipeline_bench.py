@@ -0,0 +1,264 @@
+"""
+Benchmark suite over the bundled sample PDFs, masters and templates.
+
+Measures the hot paths of the order / seal pipelines against the real
+fixtures in api/assets/pdf/ (repo root) and backend/api/assets/:
+
+  layout_text      extract_text_with_layout, every page of each order PDF
+  client_extract   extract_detailed_client_info_from_pdf
+  bento_match      match_bento_data for the recorded headers (with index)
+  masters_load     parsing both master CSVs + building the lookup indexes
+  order_pipeline   OrderPipeline.run end to end (AI replayed, workbooks included)
+  seal_excel       create_seal_excel for the recorded seal blocks
+
+Gemini is never called: the AI steps go through api.model_backend.ReplayBackend,
+which serves the responses in bench/recorded_responses.json (keyed by the
+SHA-256 of the PDF). `--record` refreshes that file, from Gemini when
+GOOGLE_API_KEY is set, otherwise from the rule-based extractors.
+
+Results are compared with bench/baseline.json; a benchmark fails when its
+median is more than --tolerance slower than the baseline. Baselines are
+machine specific: re-create them with --save-baseline on the machine that
+runs the comparison.
+
+Usage (from backend/):
+    python bench/pipeline_bench.py [--repeat 5] [--only order_pipeline,...]
+    python bench/pipeline_bench.py --save-baseline
+    python bench/pipeline_bench.py --record
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from api.model_backend import DEFAULT_REPLAY_RESPONSES, GeminiBackend, ReplayBackend, pdf_hash  # noqa: E402
+
+ASSETS_DIR = os.getenv("ASSETS_DIR", os.path.join(BACKEND_DIR, "api", "assets"))
+PDF_DIR = os.path.join(REPO_DIR, "api", "assets", "pdf")
+RECORDED_PATH = DEFAULT_REPLAY_RESPONSES
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def load_fixtures():
+    """(order_pdfs, seal_pdfs) as lists of (filename, bytes)."""
+    orders, seals = [], []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        with open(path, "rb") as f:
+            item = (os.path.basename(path), f.read())
+        (seals if "シール" in item[0] else orders).append(item)
+    return orders, seals
+
+
+# --- Recorded AI responses ---
+
+def _rule_based_order_response(pdf_bytes):
+    from api.pdf_utils import extract_table_from_pdf_for_bento, extract_bento_headers_from_table
+    tables = extract_table_from_pdf_for_bento(io.BytesIO(pdf_bytes))
+    headers = extract_bento_headers_from_table(max(tables, key=len)) if tables else []
+    return {"bento_headers": headers, "clients": []}
+
+
+def _rule_based_seal_response(pdf_bytes):
+    """Seal blocks from the text rows (client line / preparation line / date line)."""
+    import pdfplumber
+    blocks = []
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        for page in pdf.pages:
+            lines = (page.extract_text() or "").splitlines()
+            for i, line in enumerate(lines):
+                names = [n.strip() + "様" for n in line.split("様")[:-1]]
+                if not names or i + 2 >= len(lines):
+                    continue
+                preps = lines[i + 1].split()
+                dates = re.findall(r"\d{1,2}/\d{1,2}", lines[i + 2])
+                per_block = max(len(preps) // len(names), 1)
+                for j, name in enumerate(names):
+                    blocks.append({
+                        "client_name": name,
+                        "preparations": preps[j * per_block:(j + 1) * per_block],
+                        "class_name": "",
+                        "meal_count": "",
+                        "date": dates[j] if j < len(dates) else "",
+                        "grade": "",
+                    })
+    return blocks
+
+
+def record_responses(orders, seals):
+    """Write bench/recorded_responses.json for every fixture PDF."""
+    api_key = os.getenv("GOOGLE_API_KEY")
+    recorded = {}
+    for kind, items in (("order", orders), ("seal", seals)):
+        for name, pdf_bytes in items:
+            if api_key:
+                gemini = GeminiBackend(api_key)
+                response = gemini.extract_order(pdf_bytes) if kind == "order" else gemini.extract_seal(pdf_bytes)
+                source = "gemini"
+            else:
+                response = _rule_based_order_response(pdf_bytes) if kind == "order" else _rule_based_seal_response(pdf_bytes)
+                source = "rule-based"
+            recorded[pdf_hash(pdf_bytes)] = {"file": name, "kind": kind, "source": source, "response": response}
+            print(f"recorded {kind} {name} ({source})")
+    with open(RECORDED_PATH, "w", encoding="utf-8") as f:
+        json.dump(recorded, f, ensure_ascii=False, indent=1)
+        f.write("\n")
+
+
+# --- Benchmarks ---
+
+def bench_layout_text(orders, seals, replay):
+    import pdfplumber
+    from api.pdf_utils import extract_text_with_layout
+
+    def run():
+        for _, pdf_bytes in orders:
+            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+                for page in pdf.pages:
+                    extract_text_with_layout(page)
+    return run
+
+
+def bench_client_extract(orders, seals, replay):
+    from api.pdf_utils import extract_detailed_client_info_from_pdf
+
+    def run():
+        for _, pdf_bytes in orders:
+            extract_detailed_client_info_from_pdf(io.BytesIO(pdf_bytes))
+    return run
+
+
+def bench_bento_match(orders, seals, replay):
+    from api.order_pipeline import OrderPipeline, bento_search_key
+    from api.pdf_utils import match_bento_data
+    masters = OrderPipeline(ASSETS_DIR).load_masters()
+    keys = [bento_search_key(h) for _, pdf_bytes in orders
+            for h in replay.extract_order(pdf_bytes)["bento_headers"]]
+
+    def run():
+        for key in keys:
+            match_bento_data([key], masters.product, index=masters.bento_index)
+    return run
+
+
+def bench_masters_load(orders, seals, replay):
+    from api.order_pipeline import OrderPipeline
+
+    def run():
+        # Fresh pipeline: no cached masters
+        OrderPipeline(ASSETS_DIR).load_masters()
+    return run
+
+
+def bench_order_pipeline(orders, seals, replay):
+    from api.order_pipeline import OrderPipeline
+    pipeline = OrderPipeline(ASSETS_DIR, header_source="ai", model_backend=replay)
+    pipeline.load_masters()
+
+    def run():
+        for _, pdf_bytes in orders:
+            pipeline.run(pdf_bytes)
+    return run
+
+
+def bench_seal_excel(orders, seals, replay):
+    from api.seal_utils import create_seal_excel
+    blocks = [replay.extract_seal(pdf_bytes) for _, pdf_bytes in seals]
+
+    def run():
+        for b in blocks:
+            create_seal_excel(b)
+    return run
+
+
+BENCHMARKS = {
+    "layout_text": bench_layout_text,
+    "client_extract": bench_client_extract,
+    "bento_match": bench_bento_match,
+    "masters_load": bench_masters_load,
+    "order_pipeline": bench_order_pipeline,
+    "seal_excel": bench_seal_excel,
+}
+
+
+def measure(run, repeat, warmup=1):
+    for _ in range(warmup):
+        run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(times), "min_s": min(times), "repeat": repeat}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (after 1 warm-up run)")
+    parser.add_argument("--only", default=None, help="comma separated benchmark names")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown vs baseline (0.3 = +30%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--record", action="store_true", help="refresh recorded_responses.json and exit")
+    args = parser.parse_args()
+
+    orders, seals = load_fixtures()
+    if not orders:
+        sys.exit(f"No order PDFs found in {PDF_DIR}")
+    if args.record:
+        record_responses(orders, seals)
+        return
+
+    replay = ReplayBackend(RECORDED_PATH)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    results = {}
+    for name in names:
+        results[name] = measure(BENCHMARKS[name](orders, seals, replay), args.repeat)
+        print(f"{name:16s} median {results[name]['median_s'] * 1000:9.1f} ms   min {results[name]['min_s'] * 1000:9.1f} ms")
+
+    if args.save_baseline:
+        baseline = {"machine": f"{platform.node()} {platform.machine()} cpus={os.cpu_count()}",
+                    "python": platform.python_version(), "benchmarks": results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=1)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline to compare against (use --save-baseline)")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["benchmarks"]
+
+    print(f"\nvs baseline (tolerance +{args.tolerance:.0%}):")
+    failed = False
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"  {name:16s} (no baseline)")
+            continue
+        ratio = result["median_s"] / baseline[name]["median_s"]
+        status = "OK"
+        if ratio > 1 + args.tolerance:
+            status, failed = "NG", True
+        print(f"  {name:16s} {ratio:6.2f}x  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
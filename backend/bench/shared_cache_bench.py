@@ -0,0 +1,200 @@
+"""
+Cross-worker checks of api.shared_cache and of the gunicorn --preload mode.
+
+AI cache: --workers separate processes (like uvicorn / gunicorn workers)
+extract every sample PDF (api/assets/pdf/) through CachedBackend over one
+SharedCache in a temporary directory. The model is the replay backend
+(recorded responses, --latency seconds per call). The first worker runs
+alone and fills the cache; the others then run together and must get the
+same responses without calling the model, except for the PDFs whose
+recorded response fails validation (never cached, e.g. the rule-based seal
+recordings without meal counts): those are extracted by every worker. The
+model calls without the cache (every worker calls it for every PDF) are
+printed for comparison.
+
+Preload (--gunicorn, needs gunicorn installed): starts
+`gunicorn -c gunicorn.conf.py main:app` with --workers workers, with and
+without GUNICORN_PRELOAD, waits for /ready and prints the time until then
+and the summed PSS of the master and worker processes.
+
+Usage (from backend/):
+    python bench/shared_cache_bench.py [--workers 4] [--latency 0.2] [--gunicorn]
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+sys.path.insert(0, BACKEND_DIR)
+
+
+def load_pdfs():
+    pdfs = []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        with open(path, "rb") as f:
+            pdfs.append(("seal" if "シール" in os.path.basename(path) else "order", f.read()))
+    return pdfs
+
+
+def worker(cache_dir, latency):
+    """One worker process: extract every sample PDF; returns (model calls, responses, seconds)."""
+    from api.model_backend import ReplayBackend
+    from api.shared_cache import CachedBackend, SharedCache
+
+    replay = ReplayBackend(latency=latency)
+    backend = CachedBackend(replay, SharedCache(cache_dir), ttl=3600)
+    start = time.perf_counter()
+    responses = [backend.extract_seal(data) if kind == "seal" else backend.extract_order(data)
+                 for kind, data in load_pdfs()]
+    return replay.calls, responses, time.perf_counter() - start
+
+
+def uncacheable_pdfs():
+    """Sample PDFs whose recorded response fails the validation CachedBackend applies before storing."""
+    from api.model_backend import ReplayBackend
+    from api.model_cascade import expected_seal_blocks, order_response_problems, seal_response_problems
+    replay = ReplayBackend()
+    count = 0
+    for kind, data in load_pdfs():
+        if kind == "seal":
+            count += bool(seal_response_problems(replay.extract_seal(data), expected_seal_blocks(data)))
+        else:
+            count += bool(order_response_problems(replay.extract_order(data)))
+    return count
+
+
+def ai_cache_check(workers, latency):
+    uncached = uncacheable_pdfs()
+    cache_dir = tempfile.mkdtemp(prefix="shared_cache_")
+    try:
+        # spawn: fresh interpreters, nothing inherited, like separate worker processes
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers) as pool:
+            first = pool.apply(worker, (cache_dir, latency))
+            rest = pool.starmap(worker, [(cache_dir, latency)] * (workers - 1))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    n_pdfs = len(first[1])
+    failures = 0
+    print(f"{'worker':>8s} {'model calls':>12s} {'seconds':>8s}")
+    for i, (calls, responses, seconds) in enumerate([first] + rest):
+        same = responses == first[1]
+        print(f"{i:8d} {calls:12d} {seconds:8.2f}{'' if same else '  RESPONSES DIFFER'}")
+        failures += not same
+        if i and calls != uncached:
+            failures += 1
+    total = sum(r[0] for r in [first] + rest)
+    print(f"model calls: {total} with the shared cache, {workers * n_pdfs} without ({n_pdfs} PDFs x {workers} workers;"
+          f" {uncached} PDFs with a response that fails validation are not cached)")
+    if first[0] != n_pdfs:
+        # A response that fails validation is never cached
+        print(f"first worker made {first[0]} calls for {n_pdfs} PDFs")
+        failures += 1
+    return failures
+
+
+# --- gunicorn --preload ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid):
+    pids, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                todo += [int(c) for c in f.read().split()]
+        except OSError:
+            pass
+    return pids
+
+
+def pss(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def gunicorn_run(workers, preload, timeout=120):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_PRELOAD="1" if preload else "0",
+               MODEL_BACKEND="replay", WORKBOOK_WORKERS="1", RESULT_STORE="0")
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+                            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready_at, ready_hits = None, 0
+        deadline = time.time() + timeout
+        # /ready is per worker: wait until `workers` answers in a row are 200
+        while time.time() < deadline and ready_hits < workers * 3:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=5) as response:
+                    ready_hits += response.status == 200
+                    if ready_at is None:
+                        ready_at = time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, OSError):
+                ready_hits = 0
+                time.sleep(0.1)
+        if ready_hits < workers * 3:
+            return None
+        time.sleep(1)
+        pids = process_tree(proc.pid)
+        return ready_at, len(pids), sum(pss(p) for p in pids)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def preload_check(workers):
+    print(f"\n{'gunicorn':12s} {'ready':>8s} {'processes':>10s} {'PSS':>10s}")
+    failures = 0
+    for preload in (False, True):
+        result = gunicorn_run(workers, preload)
+        label = "--preload" if preload else "no preload"
+        if result is None:
+            print(f"{label:12s} did not become ready")
+            failures += 1
+            continue
+        ready_s, n, total = result
+        print(f"{label:12s} {ready_s:7.1f}s {n:10d} {total / 2**20:8.0f}MB")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="replayed model call seconds")
+    parser.add_argument("--gunicorn", action="store_true", help="also compare gunicorn with / without --preload")
+    args = parser.parse_args()
+
+    failures = ai_cache_check(max(args.workers, 2), args.latency)
+    if args.gunicorn:
+        failures += preload_check(args.workers)
+    print("OK" if not failures else f"{failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+"""
+Parity check of the Streamlit 数出表・納品書 tab (OrderPipeline with
+header_source="table", sheet_layout="streamlit") against the conversion the
+app ran before it used the shared pipeline.
+
+The previous tab code and the root api/pdf_utils.py helpers it imported are
+kept below (legacy_convert). Both convert every sample order PDF
+(api/assets/pdf/) and --synth synthetic ones (bench/synth_order_pdf.py) with
+the root assets the app uses (api/assets/: template.xlsm without a 貼り付け用
+sheet, nouhinsyo.xlsx, the master CSVs, copied to a temporary directory).
+Every cell of every sheet of both workbooks must be equal. The workbooks are
+built in-process unless WORKBOOK_WORKERS is set.
+
+The previous code wrote the 貼り付け用 sheet of template.xlsm unconditionally
+and failed with a KeyError on the root template; legacy_convert skips the
+sheet when a workbook does not have it, as the pipeline does.
+
+Usage (from backend/):
+    python bench/streamlit_parity_bench.py [--synth 3]
+"""
+import argparse
+import glob
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unicodedata
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+ROOT_ASSETS = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets")
+PDF_DIR = os.path.join(ROOT_ASSETS, "pdf")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import pandas as pd  # noqa: E402
+import pdfplumber  # noqa: E402
+from openpyxl import load_workbook  # noqa: E402
+
+
+# --- The previous Streamlit conversion (streamlit_app.py + root api/pdf_utils.py) ---
+
+def legacy_load_master_csv(base_path, file_pattern):
+    list_of_files = glob.glob(os.path.join(base_path, f'*{file_pattern}*.csv'))
+    if not list_of_files:
+        return pd.DataFrame(), None
+    latest_file = max(list_of_files, key=os.path.getmtime)
+    for encoding in ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis']:
+        try:
+            df = pd.read_csv(latest_file, encoding=encoding, dtype=str).fillna('')
+            if not df.empty:
+                df.columns = df.columns.str.strip()
+                return df, os.path.basename(latest_file)
+        except Exception:
+            continue
+    return pd.DataFrame(), None
+
+
+def legacy_safe_write_df(worksheet, df, start_row=1):
+    num_cols = df.shape[1]
+    if worksheet.max_row >= start_row:
+        for row_idx in range(start_row, worksheet.max_row + 2):
+            for col_idx in range(1, num_cols + 2):
+                worksheet.cell(row=row_idx, column=col_idx).value = None
+    for r_idx, row_data in enumerate(df.itertuples(index=False), start=start_row):
+        for c_idx, value in enumerate(row_data, start=1):
+            worksheet.cell(row=r_idx, column=c_idx, value=value)
+
+
+def legacy_paste_dataframe_to_sheet(ws, df, start_row=1, start_col=1):
+    for c_idx, col_name in enumerate(df.columns, start=start_col):
+        ws.cell(row=start_row, column=c_idx, value=col_name)
+    for r_idx, row in df.iterrows():
+        for c_idx, value in enumerate(row, start=start_col):
+            ws.cell(row=start_row + r_idx + 1, column=c_idx, value=value)
+
+
+def legacy_match_bento_data(pdf_bento_list, master_df):
+    if master_df is None or master_df.empty:
+        return [[name, "", "", ""] for name in pdf_bento_list]
+    master_df.columns = master_df.columns.str.strip()
+    required_cols = ['商品予定名', 'パン箱入数', '売価単価', '弁当区分']
+    if not all(col in master_df.columns for col in required_cols):
+        missing = ", ".join([col for col in required_cols if col not in master_df.columns])
+        return [[name, "", f"マスタ列不足: {missing}", ""] for name in pdf_bento_list]
+    master_tuples = master_df[required_cols].astype(str).to_records(index=False).tolist()
+    norm_master = [(unicodedata.normalize('NFKC', name).replace(" ", ""), name, pan_box, price, bento_type)
+                   for name, pan_box, price, bento_type in master_tuples]
+    matched_results = []
+    for pdf_name in pdf_bento_list:
+        pdf_name_stripped = pdf_name.strip()
+        norm_pdf = unicodedata.normalize('NFKC', pdf_name_stripped).replace(" ", "")
+        result_data = [pdf_name_stripped, "", "", ""]
+        best_match = None
+        for norm_m, orig_m, pan_box, price, bento_type in norm_master:
+            if norm_m == norm_pdf:
+                best_match = [orig_m, pan_box, price, bento_type]
+                break
+        if not best_match:
+            candidates = [(orig_m, pan_box, price, bento_type)
+                          for norm_m, orig_m, pan_box, price, bento_type in norm_master
+                          if norm_m and norm_m in norm_pdf]
+            if candidates:
+                best_match = max(candidates, key=lambda x: len(x[0]))
+        if best_match:
+            result_data = best_match
+        matched_results.append(result_data)
+    return matched_results
+
+
+def legacy_get_line_groups(words, y_tolerance=1.2):
+    if not words: return []
+    sorted_words = sorted(words, key=lambda w: w['top'])
+    groups, current_group = [], [sorted_words[0]]
+    for word in sorted_words[1:]:
+        if abs(word['top'] - current_group[-1]['top']) <= y_tolerance:
+            current_group.append(word)
+        else:
+            groups.append(sorted(current_group, key=lambda w: w['x0']))
+            current_group = [word]
+    groups.append(sorted(current_group, key=lambda w: w['x0']))
+    return groups
+
+
+def legacy_get_vertical_boundaries(page, tolerance=2):
+    v_lines_x = sorted(set(round(line['x0'], 1) for line in page.lines
+                           if line['height'] > 0 and line['width'] < tolerance))
+    words = page.extract_words()
+    if not words: return v_lines_x
+    doc_left = min(word['x0'] for word in words)
+    doc_right = max(word['x1'] for word in words)
+    boundaries = sorted(set([round(doc_left, 1)] + v_lines_x + [round(doc_right, 1)]))
+    merged = []
+    if boundaries:
+        merged.append(boundaries[0])
+        for b in boundaries[1:]:
+            if b - merged[-1] > tolerance * 2:
+                merged.append(b)
+    return merged
+
+
+def legacy_split_line_using_boundaries(line, boundaries):
+    columns = [""] * (len(boundaries) - 1)
+    for word in line:
+        word_center = (word['x0'] + word['x1']) / 2
+        for i in range(len(boundaries) - 1):
+            if boundaries[i] <= word_center < boundaries[i + 1]:
+                columns[i] = (columns[i] + " " + word["text"]).strip()
+                break
+    return columns
+
+
+def legacy_extract_text_with_layout(page):
+    words = page.extract_words(x_tolerance=3, y_tolerance=3, keep_blank_chars=False)
+    if not words: return []
+    boundaries = legacy_get_vertical_boundaries(page)
+    if len(boundaries) < 2:
+        text = page.extract_text(layout=False, x_tolerance=3, y_tolerance=3)
+        return [[line] for line in text.split('\n') if line.strip()] if text else []
+    result_rows = []
+    for group in legacy_get_line_groups(words, y_tolerance=1.5):
+        columns = legacy_split_line_using_boundaries(sorted(group, key=lambda w: w['x0']), boundaries)
+        if any(cell.strip() for cell in columns):
+            result_rows.append(columns)
+    return result_rows
+
+
+def legacy_extract_meal_numbers_from_row(rows, row_idx, client_id, client_name):
+    client_info = {'client_id': client_id, 'client_name': client_name, 'student_meals': [], 'teacher_meals': []}
+    rows_to_check = []
+    for i in range(max(0, row_idx - 3), min(len(rows), row_idx + 3)):
+        if i < len(rows) and rows[i]:
+            left_cell = str(rows[i][0]).strip()
+            if left_cell == client_id: rows_to_check.append(('id', rows[i]))
+            elif left_cell == client_name: rows_to_check.append(('name', rows[i]))
+    all_numbers = []
+    for row_type, row in rows_to_check:
+        for cell in row[1:]:
+            cell_str = str(cell).strip()
+            if cell_str and re.match(r'^\d+$', cell_str):
+                all_numbers.append({'number': int(cell_str), 'row_type': row_type})
+            elif cell_str and not re.match(r'^\d+$', cell_str):
+                break
+    client_info['student_meals'] = [item['number'] for item in all_numbers if item['row_type'] == 'id'][:3]
+    client_info['teacher_meals'] = [item['number'] for item in all_numbers if item['row_type'] == 'name'][:2]
+    return client_info
+
+
+def legacy_extract_detailed_client_info_from_pdf(pdf_file_obj):
+    client_data = []
+    try:
+        with pdfplumber.open(pdf_file_obj) as pdf:
+            for page in pdf.pages:
+                rows = legacy_extract_text_with_layout(page)
+                if not rows: continue
+                garden_row_idx = -1
+                for i, row in enumerate(rows):
+                    if '園名' in ''.join(str(c) for c in row if c):
+                        garden_row_idx = i
+                        break
+                if garden_row_idx == -1: continue
+                current_client_id, current_client_name = None, None
+                for i in range(garden_row_idx + 1, len(rows)):
+                    row = rows[i]
+                    if '10001' in ''.join(str(c) for c in row if c): break
+                    if not any(str(c).strip() for c in row): continue
+                    if row and row[0]:
+                        left_cell = str(row[0]).strip()
+                        if re.match(r'^\d+$', left_cell):
+                            if current_client_id and current_client_name:
+                                client_info = legacy_extract_meal_numbers_from_row(
+                                    rows, i - 1, current_client_id, current_client_name)
+                                if client_info: client_data.append(client_info)
+                            current_client_id, current_client_name = left_cell, None
+                        elif not re.match(r'^\d+$', left_cell) and current_client_id:
+                            current_client_name = left_cell
+                if current_client_id and current_client_name:
+                    client_info = legacy_extract_meal_numbers_from_row(
+                        rows, len(rows) - 1, current_client_id, current_client_name)
+                    if client_info: client_data.append(client_info)
+    except Exception:
+        pass
+    return client_data
+
+
+def legacy_export_detailed_client_data_to_dataframe(client_data):
+    df_data = []
+    for info in client_data:
+        s, t = info['student_meals'], info['teacher_meals']
+        df_data.append({'クライアント名': info['client_name'],
+                        '園児の給食の数1': s[0] if len(s) > 0 else '',
+                        '園児の給食の数2': s[1] if len(s) > 1 else '',
+                        '園児の給食の数3': s[2] if len(s) > 2 else '',
+                        '先生の給食の数1': t[0] if len(t) > 0 else '',
+                        '先生の給食の数2': t[1] if len(t) > 1 else ''})
+    return pd.DataFrame(df_data)
+
+
+def legacy_pdf_to_excel_data_for_paste_sheet(pdf_file):
+    try:
+        with pdfplumber.open(pdf_file) as pdf:
+            if not pdf.pages: return None
+            rows = legacy_extract_text_with_layout(pdf.pages[0])
+            if not rows: return None
+            df = pd.DataFrame(rows)
+            df.replace({None: ""}, inplace=True)
+            return df
+    except Exception:
+        return None
+
+
+def legacy_extract_table_from_pdf_for_bento(pdf_file_obj):
+    tables = []
+    with pdfplumber.open(pdf_file_obj) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text()
+            if not text or not any(kw in text for kw in ["園名", "飯あり", "キャラ弁"]): continue
+            if not page.lines: continue
+            table = page.extract_table({"vertical_strategy": "lines", "horizontal_strategy": "lines"})
+            if table: tables.append(table)
+    return tables
+
+
+def legacy_find_correct_anchor_for_bento(table, target_row_text="赤"):
+    for r_idx, row in enumerate(table):
+        if target_row_text in ''.join(str(c) for c in row if c):
+            if r_idx + 1 < len(table):
+                for c_idx, cell in enumerate(table[r_idx + 1]):
+                    if cell and "飯なし" in cell: return c_idx
+    return -1
+
+
+def legacy_extract_bento_range_for_bento(table, start_col):
+    bento_list, end_col = [], -1
+    for row in table:
+        if "おやつ" in ''.join(str(c) for c in row if c):
+            for c_idx, cell in enumerate(row):
+                if cell and "おやつ" in cell: end_col = c_idx; break
+            if end_col != -1: break
+    if end_col == -1 or start_col >= end_col: return []
+    header_row_idx = -1
+    for r_idx, row in enumerate(table):
+        if any(c and "飯なし" in c for c in row):
+            if r_idx > 0: header_row_idx = r_idx - 1; break
+    if header_row_idx == -1: return []
+    header_row = table[header_row_idx]
+    for col in range(start_col + 1, end_col):
+        cell_text = header_row[col] if col < len(header_row) else ""
+        if cell_text and str(cell_text).strip(): bento_list.append(str(cell_text).strip())
+    return bento_list
+
+
+def legacy_clear_sheet(ws):
+    if ws.max_row > 0:
+        ws.delete_rows(1, ws.max_row)
+
+
+def legacy_write_paste_sheet(wb, df_paste_sheet):
+    # The previous code indexed wb["貼り付け用"] directly (KeyError on the root template.xlsm)
+    if "貼り付け用" not in wb.sheetnames:
+        return
+    ws_paste = wb["貼り付け用"]
+    for r_idx, row in df_paste_sheet.iterrows():
+        for c_idx, value in enumerate(row):
+            ws_paste.cell(row=r_idx + 1, column=c_idx + 1, value=value)
+
+
+def legacy_convert(assets_dir, pdf_bytes):
+    """The 変換開始 handler of the Streamlit tab before the shared pipeline."""
+    df_product_master, _ = legacy_load_master_csv(assets_dir, "商品マスタ")
+    df_customer_master, _ = legacy_load_master_csv(assets_dir, "得意先マスタ")
+    template_wb = load_workbook(os.path.join(assets_dir, "template.xlsm"), keep_vba=True)
+    nouhinsyo_wb = load_workbook(os.path.join(assets_dir, "nouhinsyo.xlsx"))
+
+    if not df_product_master.empty and "商品マスタ" in template_wb.sheetnames:
+        ws = template_wb["商品マスタ"]
+        legacy_clear_sheet(ws)
+        legacy_paste_dataframe_to_sheet(ws, df_product_master)
+    if not df_customer_master.empty and "得意先マスタ" in template_wb.sheetnames:
+        ws = template_wb["得意先マスタ"]
+        legacy_clear_sheet(ws)
+        legacy_paste_dataframe_to_sheet(ws, df_customer_master)
+
+    df_paste_sheet = legacy_pdf_to_excel_data_for_paste_sheet(io.BytesIO(pdf_bytes))
+    if df_paste_sheet is None:
+        raise ValueError("PDFデータの抽出に失敗しました。")
+
+    df_bento_sheet = None
+    tables = legacy_extract_table_from_pdf_for_bento(io.BytesIO(pdf_bytes))
+    if tables:
+        main_table = max(tables, key=len)
+        anchor_col = legacy_find_correct_anchor_for_bento(main_table)
+        if anchor_col != -1:
+            bento_list = legacy_extract_bento_range_for_bento(main_table, anchor_col)
+            if bento_list:
+                matched_data = legacy_match_bento_data(bento_list, df_product_master)
+                df_bento_sheet = pd.DataFrame(matched_data, columns=['商品予定名', 'パン箱入数', '売価単価', '弁当区分'])
+
+    df_client_sheet = None
+    client_data = legacy_extract_detailed_client_info_from_pdf(io.BytesIO(pdf_bytes))
+    if client_data:
+        df_client_sheet = legacy_export_detailed_client_data_to_dataframe(client_data)
+
+    legacy_write_paste_sheet(template_wb, df_paste_sheet)
+    if df_bento_sheet is not None and "注文弁当の抽出" in template_wb.sheetnames:
+        legacy_safe_write_df(template_wb["注文弁当の抽出"], df_bento_sheet)
+    if df_client_sheet is not None and "クライアント抽出" in template_wb.sheetnames:
+        legacy_safe_write_df(template_wb["クライアント抽出"], df_client_sheet)
+
+    if not df_customer_master.empty and "得意先マスタ" in nouhinsyo_wb.sheetnames:
+        ws = nouhinsyo_wb["得意先マスタ"]
+        legacy_clear_sheet(ws)
+        legacy_paste_dataframe_to_sheet(ws, df_customer_master)
+    legacy_write_paste_sheet(nouhinsyo_wb, df_paste_sheet)
+
+    df_bento_for_nouhin = None
+    if df_bento_sheet is not None:
+        master_df = df_product_master.copy()
+        if not master_df.empty and '商品名' in master_df.columns:
+            master_map = master_df.drop_duplicates(subset=['商品予定名']).set_index('商品予定名')['商品名'].to_dict()
+            df_bento_for_nouhin = df_bento_sheet.copy()
+            df_bento_for_nouhin['商品名'] = df_bento_for_nouhin['商品予定名'].map(master_map)
+            df_bento_for_nouhin = df_bento_for_nouhin[['商品予定名', 'パン箱入数', '商品名']]
+    if df_bento_for_nouhin is not None and "注文弁当の抽出" in nouhinsyo_wb.sheetnames:
+        legacy_safe_write_df(nouhinsyo_wb["注文弁当の抽出"], df_bento_for_nouhin)
+    if df_client_sheet is not None and "クライアント抽出" in nouhinsyo_wb.sheetnames:
+        legacy_safe_write_df(nouhinsyo_wb["クライアント抽出"], df_client_sheet)
+
+    out_template, out_nouhin = io.BytesIO(), io.BytesIO()
+    template_wb.save(out_template)
+    nouhinsyo_wb.save(out_nouhin)
+    return out_template.getvalue(), out_nouhin.getvalue()
+
+
+# --- Comparison ---
+
+def workbook_cells(data, keep_vba):
+    wb = load_workbook(io.BytesIO(data), keep_vba=keep_vba)
+    # ArrayFormula objects compare by identity: compare their formula text
+    return {ws.title: [[getattr(v, "text", v) for v in row] for row in ws.iter_rows(values_only=True)]
+            for ws in wb.worksheets}
+
+
+def diff_workbooks(legacy, new, keep_vba):
+    a, b = workbook_cells(legacy, keep_vba), workbook_cells(new, keep_vba)
+    if list(a) != list(b):
+        return [f"sheets {list(a)} != {list(b)}"]
+    diffs = []
+    for sheet in a:
+        rows_a, rows_b = a[sheet], b[sheet]
+        for r in range(max(len(rows_a), len(rows_b))):
+            row_a = rows_a[r] if r < len(rows_a) else []
+            row_b = rows_b[r] if r < len(rows_b) else []
+            for c in range(max(len(row_a), len(row_b))):
+                va = row_a[c] if c < len(row_a) else None
+                vb = row_b[c] if c < len(row_b) else None
+                if va != vb:
+                    diffs.append(f"{sheet}!R{r + 1}C{c + 1}: {va!r} != {vb!r}")
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synth", type=int, default=3, help="synthetic order PDFs (0: sample PDFs only)")
+    args = parser.parse_args()
+
+    cases = []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        if "シール" not in os.path.basename(path):
+            with open(path, "rb") as f:
+                cases.append((os.path.basename(path), f.read()))
+    if args.synth:
+        from synth_order_pdf import generate_order_pdf
+        for seed in range(args.synth):
+            clients, bento_cols, pages = 30 + 20 * seed, 10 + 3 * seed, 1 + seed
+            cases.append((f"synthetic {clients} clients x {bento_cols} bentos, {pages}p",
+                          generate_order_pdf(clients, bento_cols, pages, seed)[0]))
+
+    work = tempfile.mkdtemp(prefix="streamlit_parity_")
+    for name in ["template.xlsm", "nouhinsyo.xlsx"] + [os.path.basename(p) for p in
+                                                       glob.glob(os.path.join(ROOT_ASSETS, "*マスタ*.csv"))]:
+        shutil.copy(os.path.join(ROOT_ASSETS, name), work)
+    os.environ.setdefault("WORKBOOK_WORKERS", "1")
+
+    from api.order_pipeline import OrderPipeline
+    pipeline = OrderPipeline(work, header_source="table", sheet_layout="streamlit")
+    failures = 0
+    try:
+        for label, pdf_bytes in cases:
+            legacy = legacy_convert(work, pdf_bytes)
+            result = pipeline.run(pdf_bytes)
+            diffs = (diff_workbooks(legacy[0], result.template_bytes, keep_vba=True)
+                     + diff_workbooks(legacy[1], result.nouhinsyo_bytes, keep_vba=False))
+            bento = result.sheets.bento_sheet
+            clients = result.sheets.client_sheet
+            print(f"{label:45s} {0 if bento is None else len(bento):3d} bentos "
+                  f"{0 if clients is None else len(clients):4d} clients  "
+                  f"{'same cells' if not diffs else f'{len(diffs)} DIFFERENT cells'}")
+            for diff in diffs[:5]:
+                print(f"    {diff}")
+            failures += bool(diffs)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print("OK" if not failures else f"{failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+Synthetic 数出表 order PDFs for scaling tests.
+
+Generates order PDFs with the layout of the real ones in api/assets/pdf/
+(A3 portrait, ActiveReports style):
+
+  - title line (日付 / ＊＊＊ 数出表 ＊＊＊ / PAGE n)
+  - 3 header rows: bento name / 飯あり・おにぎり… / 100・三角…, 園名 on the left,
+    おやつ and a remarks column on the right
+  - one row pair per client: client ID + student counts, then client name +
+    teacher counts, alternate pairs shaded
+  - the 10000 / 10001 end rows and the totals on the last page
+
+at any scale: --clients x --bento-cols x --pages. Text uses a non-embedded
+Adobe-Japan1 CID font (HeiseiKakuGo-W5) with a ToUnicode map, so pdfplumber
+and pdfium both extract it. The generator also returns the client rows it
+wrote, so extraction results can be checked.
+
+Usage (from backend/):
+    python bench/synth_order_pdf.py --clients 300 --bento-cols 24 --pages 4 -o /tmp/order.pdf
+    python bench/synth_order_pdf.py --sweep [--json results.json]
+
+--sweep profiles extract_detailed_client_info_from_pdf and the two workbook
+builders (wall time and tracemalloc peak) over a grid of scales. Times are
+taken with tracemalloc running, so compare them across scales, not with
+bench/pipeline_bench.py.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unicodedata
+import zlib
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# --- Page geometry (points, measured from 25.12.03【ママミール】.pdf) ---
+PAGE_W, PAGE_H = 841.92, 1190.52
+TABLE_LEFT, TABLE_RIGHT = 28.7, 819.6
+NAME_COL_RIGHT = 160.2          # 園名 column
+SNACK_COL_RIGHT = 666.5         # end of the bento + おやつ columns, remarks start here
+DEFAULT_COL_W = 26.65
+TABLE_TOP = 35.8
+HEADER_ROWS = (36.7, 45.4, 54.7)  # tops of the 3 header text rows
+BODY_TOP = 62.3
+TABLE_BOTTOM = 1149.0
+ROW_PITCH = 15.3                # one client = ID row + name row
+NAME_ROW_OFFSET = 7.9
+FONT_SIZE = 6.96
+
+# Header of the first 10 bento columns, as in the real PDFs
+FIXED_BENTO_COLUMNS = [
+    ("キャラ弁（学食）", "飯あり", "100"), ("キャラ弁（学食）", "飯あり", "150"),
+    ("キャラ弁当", "飯あり", "120"), ("キャラ弁当", "おにぎり", "三角"), ("キャラ弁当", "飯なし", ""),
+    ("赤", "飯あり", "120"), ("赤", "飯あり", "100"), ("赤", "おにぎり", "三角"),
+    ("赤", "おにぎり", "半俵"), ("赤", "飯なし", ""),
+]
+EXTRA_BENTO_NAMES = ["パンカップ", "クリスマス", "配膳スマ", "めん給食", "どんぶり給",
+                     "オレンジ", "赤パン", "食育うど"]
+
+AREAS = ["博多", "博多南", "春日", "大野", "志免", "香椎", "天神", "百道", "姪浜", "野間",
+         "高宮", "吉塚", "筑紫野", "須玖", "月の浦", "泉ヶ丘"]
+KINDS = ["幼稚園", "保育園", "キッズ", "こども園", "プリスクール", "小学校"]
+SUFFIXES = ["", "", "", " 週3ｺｰｽ", " 週5ｺｰｽ", " web", "（補助教員） web", " 先生"]
+REMARKS = ["", "", "", "ｱﾚ1", "スープ付き", "おかわり用保温箱2K×1", "先生+2（実）", "ももゼリー付き"]
+
+# --- PDF writing ---
+
+_CID_CMAP = None
+
+
+def _cids(text):
+    """Unicode text -> Adobe-Japan1 CIDs (via pdfminer's UniJIS-UCS2-H, shipped with pdfplumber)."""
+    global _CID_CMAP
+    if _CID_CMAP is None:
+        from pdfminer.cmapdb import CMapDB
+        _CID_CMAP = CMapDB.get_cmap("UniJIS-UCS2-H")
+    cids = []
+    for ch in text:
+        decoded = list(_CID_CMAP.decode(ch.encode("utf-16-be")))
+        if not decoded or decoded[0] == 0:
+            raise ValueError(f"Character not in Adobe-Japan1: {ch!r}")
+        cids.append(decoded[0])
+    return cids
+
+
+def _cid_width(cid):
+    # Proportional roman (1-95) and half-width forms (231-632) are half an em
+    return 500 if 1 <= cid <= 95 or 231 <= cid <= 632 else 1000
+
+
+def text_width(text, size=FONT_SIZE):
+    return sum(_cid_width(c) for c in _cids(text)) * size / 1000
+
+
+class _Canvas:
+    """Content stream of one page, with top-left coordinates like pdfplumber."""
+
+    def __init__(self, unicode_for_cid):
+        self.ops = []
+        self.unicode_for_cid = unicode_for_cid
+
+    def text(self, x, top, text, size=FONT_SIZE):
+        if not text:
+            return
+        cids = _cids(text)
+        for cid, ch in zip(cids, text):
+            self.unicode_for_cid.setdefault(cid, ch)
+        baseline = PAGE_H - top - size * 0.88  # font descent is -120/1000
+        hexstr = "".join(f"{c:04X}" for c in cids)
+        self.ops.append(f"BT /F1 {size:.2f} Tf {x:.2f} {baseline:.2f} Td <{hexstr}> Tj ET")
+
+    def text_right(self, right, top, text, size=FONT_SIZE):
+        self.text(right - text_width(text, size), top, text, size)
+
+    def text_center(self, left, right, top, text, size=FONT_SIZE):
+        width = text_width(text, size)
+        if width > right - left - 1:
+            size = size * (right - left - 1) / width
+            width = text_width(text, size)
+        self.text((left + right - width) / 2, top, text, size)
+
+    def line(self, x0, top0, x1, top1):
+        self.ops.append(f"{x0:.2f} {PAGE_H - top0:.2f} m {x1:.2f} {PAGE_H - top1:.2f} l S")
+
+    def shade(self, x0, top, x1, bottom):
+        self.ops.append(f"q 0.92 g {x0:.2f} {PAGE_H - bottom:.2f} {x1 - x0:.2f} {bottom - top:.2f} re f Q")
+
+    def stream(self):
+        return ("0.5 w\n" + "\n".join(self.ops)).encode("ascii")
+
+
+def _write_pdf(pages, unicode_for_cid, title="Synthetic order sheet"):
+    """pages: content streams; unicode_for_cid: {cid: char} of every glyph used -> PDF bytes."""
+    objects = []  # index + 1 = object number
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    # ToUnicode: CID (= code, Identity-H) -> Unicode
+    bfchars = [f"<{cid:04X}> <{ord(ch):04X}>" for cid, ch in sorted(unicode_for_cid.items())]
+    cmap_lines = ["/CIDInit /ProcSet findresource begin", "12 dict begin", "begincmap",
+                  "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+                  "/CMapName /Adobe-Identity-UCS def", "/CMapType 2 def",
+                  "1 begincodespacerange", "<0000> <FFFF>", "endcodespacerange"]
+    for i in range(0, len(bfchars), 100):
+        chunk = bfchars[i:i + 100]
+        cmap_lines += [f"{len(chunk)} beginbfchar"] + chunk + ["endbfchar"]
+    cmap_lines += ["endcmap", "CMapName currentdict /CMap defineresource pop", "end", "end"]
+    to_unicode = "\n".join(cmap_lines).encode("ascii")
+
+    catalog = add(None)
+    pages_obj = add(None)
+    descriptor = add(b"<< /Type /FontDescriptor /FontName /HeiseiKakuGo-W5 /Flags 4 "
+                     b"/FontBBox [-92 -250 1010 922] /ItalicAngle 0 /Ascent 880 /Descent -120 "
+                     b"/CapHeight 737 /StemV 114 >>")
+    cid_font = add(f"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /HeiseiKakuGo-W5 "
+                   f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 5 >> "
+                   f"/FontDescriptor {descriptor} 0 R /DW 1000 /W [1 95 500 231 632 500] >>".encode("ascii"))
+    to_unicode_obj = add(b"<< /Length %d >>\nstream\n" % len(to_unicode) + to_unicode + b"\nendstream")
+    font = add(f"<< /Type /Font /Subtype /Type0 /BaseFont /HeiseiKakuGo-W5 /Encoding /Identity-H "
+               f"/DescendantFonts [{cid_font} 0 R] /ToUnicode {to_unicode_obj} 0 R >>".encode("ascii"))
+
+    page_ids = []
+    for content in pages:
+        data = zlib.compress(content)
+        stream = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data) + data + b"\nendstream")
+        page_ids.append(add(f"<< /Type /Page /Parent {pages_obj} 0 R /MediaBox [0 0 {PAGE_W} {PAGE_H}] "
+                            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {stream} 0 R >>".encode("ascii")))
+    info = add(f"<< /Producer (mamameal synth_order_pdf) /Title ({title}) >>".encode("ascii"))
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_obj} 0 R >>".encode("ascii")
+    objects[pages_obj - 1] = (f"<< /Type /Pages /Count {len(page_ids)} /Kids ["
+                              + " ".join(f"{p} 0 R" for p in page_ids) + "] >>").encode("ascii")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += (b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(objects) + 1, catalog, info, xref))
+    return bytes(out)
+
+
+# --- Order data ---
+
+def bento_columns(count):
+    """[(group, kind, size), ...] for `count` bento columns."""
+    columns = list(FIXED_BENTO_COLUMNS[:count])
+    extra = 0
+    while len(columns) < count:
+        name = EXTRA_BENTO_NAMES[extra] if extra < len(EXTRA_BENTO_NAMES) else f"特別食{extra - len(EXTRA_BENTO_NAMES) + 1}"
+        columns.append((name, "", ""))
+        extra += 1
+    return columns
+
+
+def make_clients(count, bento_cols, rng):
+    """Client rows: {'client_id', 'client_name', 'student_meals': {col: n}, 'teacher_meals': {col: n}, 'remark'}"""
+    clients = []
+    client_id = 100
+    for _ in range(count):
+        client_id += rng.choice([1, 2, 3, 50, 100, 300])
+        # 10000 / 10001 are the end-of-table markers
+        while "10001" in str(client_id) or client_id == 10000:
+            client_id += 1
+        name = rng.choice(AREAS) + rng.choice(KINDS) + rng.choice(SUFFIXES)
+        student, teacher = {}, {}
+        for col in rng.sample(range(bento_cols), k=min(bento_cols, rng.choice([1, 1, 1, 2, 3]))):
+            student[col] = rng.randint(1, 300)
+            if rng.random() < 0.6:
+                teacher[col] = rng.randint(1, 30)
+        clients.append({"client_id": str(client_id), "client_name": name,
+                        "student_meals": student, "teacher_meals": teacher,
+                        "remark": rng.choice(REMARKS)})
+    return clients
+
+
+def _avoid_end_marker(client, bento_cols):
+    """The extractor stops at a row whose joined text contains '10001'; keep counts clear of it."""
+    for key, head in (("student_meals", client["client_id"]), ("teacher_meals", client["client_name"])):
+        meals = client[key]
+        while "10001" in head + "".join(str(meals.get(c, "")) for c in range(bento_cols)) + client["remark"]:
+            col = next(iter(meals))
+            meals[col] += 1
+
+
+def generate_order_pdf(clients=60, bento_cols=15, pages=1, seed=0):
+    """
+    Returns (pdf_bytes, expected) where expected is
+    {'bento_headers': [...], 'clients': [client rows written to the PDF]}.
+    """
+    rng = random.Random(seed)
+    columns = bento_columns(bento_cols)
+    client_rows = make_clients(clients, bento_cols, rng)
+    for client in client_rows:
+        _avoid_end_marker(client, bento_cols)
+
+    per_page = math.ceil(clients / pages) if clients else 0
+    capacity = int((TABLE_BOTTOM - BODY_TOP - 3 * ROW_PITCH) // ROW_PITCH)
+    if per_page > capacity:
+        raise ValueError(f"{per_page} clients per page do not fit (max {capacity}); use more pages")
+
+    col_w = min(DEFAULT_COL_W, (SNACK_COL_RIGHT - NAME_COL_RIGHT) / (bento_cols + 1))
+    col_x = [NAME_COL_RIGHT + i * col_w for i in range(bento_cols + 2)]  # bento columns + おやつ
+    remarks_left = col_x[-1]
+
+    unicode_for_cid = {}
+    page_streams = []
+    for page_no in range(pages):
+        c = _Canvas(unicode_for_cid)
+        page_clients = client_rows[page_no * per_page:(page_no + 1) * per_page]
+        last = page_no == pages - 1
+
+        # Title line
+        c.text(29.5, 23.8, "日付")
+        c.text(59.8, 23.8, "令和07年12月03日")
+        c.text(159.7, 23.8, "水曜日")
+        c.text(349.0, 20.8, "＊＊＊", 10)
+        c.text(404.9, 20.8, "数出表", 14.3)
+        c.text(457.1, 20.8, "＊＊＊", 10)
+        c.text(520.6, 24.6, "上段：園児、下段：先生")
+        c.text(624.3, 24.6, "作成日")
+        c.text(664.4, 24.6, "2025年11月21日")
+        c.text(738.7, 25.3, "PAGE")
+        c.text_right(814.3, 24.6, str(page_no + 1))
+
+        # Header
+        c.text(84.7, 44.0, "園名")
+        header = columns + [("おやつ", "", "")]
+        group_start, group_edges = 0, [NAME_COL_RIGHT]
+        for i, (group, kind, size) in enumerate(header):
+            if i + 1 == len(header) or header[i + 1][0] != group:
+                # Group name in a merged cell over its columns (キャラ弁（学食） spans 2)
+                c.text_center(col_x[group_start], col_x[i + 1], HEADER_ROWS[0], group)
+                group_start = i + 1
+                group_edges.append(col_x[i + 1])
+            c.text_center(col_x[i], col_x[i + 1], HEADER_ROWS[1], kind)
+            c.text_center(col_x[i], col_x[i + 1], HEADER_ROWS[2], size)
+
+        # Body
+        top = BODY_TOP + 0.4
+        for n, client in enumerate(page_clients):
+            if n % 2 == 1:
+                c.shade(TABLE_LEFT, top - 0.8, TABLE_RIGHT, top + ROW_PITCH - 1.3)
+            c.text(29.5, top, client["client_id"])
+            c.text(29.5, top + NAME_ROW_OFFSET, client["client_name"])
+            for col, count in client["student_meals"].items():
+                c.text_right(col_x[col + 1] - 1.9, top, str(count))
+            for col, count in client["teacher_meals"].items():
+                c.text_right(col_x[col + 1] - 1.9, top + NAME_ROW_OFFSET, str(count))
+            c.text(remarks_left + 0.9, top, client["remark"])
+            top += ROW_PITCH
+
+        if last:
+            c.text(29.5, top, "10000")
+            c.text(29.5, top + ROW_PITCH, "10001")
+            top += 2 * ROW_PITCH
+            for col in range(bento_cols):
+                total = sum(cl["student_meals"].get(col, 0) for cl in client_rows)
+                if total:
+                    c.text_right(col_x[col + 1] - 1.9, top, f"{total:,}")
+            c.text(29.5, top + NAME_ROW_OFFSET, "【合計】")
+            grand = sum(sum(cl["student_meals"].values()) for cl in client_rows)
+            c.text_right(NAME_COL_RIGHT - 1.8, top + NAME_ROW_OFFSET, f"{grand:,}")
+
+        # Grid: outer frame, header rules, column rules
+        c.line(TABLE_LEFT, TABLE_TOP, TABLE_RIGHT, TABLE_TOP)
+        c.line(NAME_COL_RIGHT, 44.8, TABLE_RIGHT, 44.8)
+        c.line(NAME_COL_RIGHT, 53.9, TABLE_RIGHT, 53.9)
+        c.line(TABLE_LEFT, BODY_TOP, TABLE_RIGHT, BODY_TOP)
+        c.line(TABLE_LEFT, TABLE_BOTTOM, TABLE_RIGHT, TABLE_BOTTOM)
+        for x in [TABLE_LEFT] + group_edges + [TABLE_RIGHT]:
+            c.line(x, TABLE_TOP, x, 44.8)
+        for x in [TABLE_LEFT] + col_x + [TABLE_RIGHT]:
+            c.line(x, 44.8, x, TABLE_BOTTOM)
+        page_streams.append(c.stream())
+
+    pdf = _write_pdf(page_streams, unicode_for_cid)
+    # Same form as extract_bento_headers_from_table (NFKC: キャラ弁(学食) 飯あり 100)
+    headers = [unicodedata.normalize("NFKC", " ".join(p for p in col if p)) for col in columns]
+    return pdf, {"bento_headers": headers, "clients": client_rows}
+
+
+# --- Checking and profiling ---
+
+def check_extraction(extracted, expected, bento_cols):
+    """Mismatches between extract_detailed_client_info_from_pdf output and the generated rows."""
+    problems = []
+    if len(extracted) != len(expected["clients"]):
+        problems.append(f"{len(extracted)} clients extracted, {len(expected['clients'])} written")
+    for got, want in zip(extracted, expected["clients"]):
+        for key in ("student_meals", "teacher_meals"):
+            want_row = [want[key].get(c, "") for c in range(bento_cols)]
+            if got.get(key, [])[:bento_cols] != want_row or got["client_id"] != want["client_id"]:
+                problems.append(f"{want['client_id']} {key}: {got.get(key, [])[:bento_cols]} != {want_row}")
+    return problems
+
+
+def profile(fn, *args):
+    """(result, seconds, tracemalloc peak MiB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn(*args)
+        return result, time.perf_counter() - start, tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def profile_scale(clients, bento_cols, pages, seed=0):
+    import io
+    from api.order_pipeline import OrderPipeline, OrderExtraction
+    from api.pdf_utils import extract_detailed_client_info_from_pdf
+    from api.workbook_utils import build_template_workbook, build_nouhinsyo_workbook, read_template_bytes
+
+    pdf, expected = generate_order_pdf(clients, bento_cols, pages, seed)
+    extracted, extract_s, extract_mb = profile(extract_detailed_client_info_from_pdf, io.BytesIO(pdf))
+    problems = check_extraction(extracted, expected, bento_cols)
+
+    assets_dir = os.getenv("ASSETS_DIR", os.path.join(BACKEND_DIR, "api", "assets"))
+    pipeline = OrderPipeline(assets_dir, header_source="table")
+    masters = pipeline.load_masters()
+    sheets = pipeline.build_sheets(OrderExtraction(expected["bento_headers"], extracted), masters)
+    template_path, nouhinsyo_path = pipeline.template_paths()
+    common = (masters.product, masters.customer, sheets.paste_sheet, sheets.bento_sheet, sheets.client_sheet)
+    _, template_s, template_mb = profile(build_template_workbook, read_template_bytes(template_path),
+                                         *common, sheets.bento_headers)
+    _, nouhinsyo_s, nouhinsyo_mb = profile(build_nouhinsyo_workbook, read_template_bytes(nouhinsyo_path), *common)
+    return {
+        "clients": clients, "bento_cols": bento_cols, "pages": pages, "pdf_kb": round(len(pdf) / 1024, 1),
+        "extract_s": round(extract_s, 3), "extract_peak_mb": round(extract_mb, 1),
+        "template_s": round(template_s, 3), "template_peak_mb": round(template_mb, 1),
+        "nouhinsyo_s": round(nouhinsyo_s, 3), "nouhinsyo_peak_mb": round(nouhinsyo_mb, 1),
+        "extraction_ok": not problems,
+    }
+
+
+SWEEP = [(30, 10, 1), (60, 15, 1), (60, 30, 1), (240, 15, 4), (600, 20, 10), (1200, 30, 20)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=60)
+    parser.add_argument("--bento-cols", type=int, default=15)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the PDF here")
+    parser.add_argument("--check", action="store_true", help="run the layout extractor on the PDF and compare")
+    parser.add_argument("--sweep", action="store_true", help="profile extraction + workbooks over a grid of scales")
+    parser.add_argument("--json", help="write sweep results to this file")
+    args = parser.parse_args()
+
+    if args.sweep:
+        results = []
+        print(f"{'clients':>7} {'cols':>4} {'pages':>5} {'pdf KB':>7} | {'extract':>14} | {'数出表':>14} | {'納品書':>14} | ok")
+        for clients, bento_cols, pages in SWEEP:
+            r = profile_scale(clients, bento_cols, pages, args.seed)
+            results.append(r)
+            print(f"{clients:7d} {bento_cols:4d} {pages:5d} {r['pdf_kb']:7.1f} | "
+                  f"{r['extract_s']:6.2f}s {r['extract_peak_mb']:5.1f}MB | "
+                  f"{r['template_s']:6.2f}s {r['template_peak_mb']:5.1f}MB | "
+                  f"{r['nouhinsyo_s']:6.2f}s {r['nouhinsyo_peak_mb']:5.1f}MB | {'OK' if r['extraction_ok'] else 'NG'}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=1)
+        sys.exit(0 if all(r["extraction_ok"] for r in results) else 1)
+
+    pdf, expected = generate_order_pdf(args.clients, args.bento_cols, args.pages, args.seed)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(pdf)
+        print(f"Wrote {args.output} ({len(pdf) / 1024:.1f} KB, {args.clients} clients, "
+              f"{args.bento_cols} bento columns, {args.pages} pages)")
+    if args.check:
+        import io
+        from api.pdf_utils import extract_detailed_client_info_from_pdf
+        problems = check_extraction(extract_detailed_client_info_from_pdf(io.BytesIO(pdf)), expected, args.bento_cols)
+        for p in problems[:20]:
+            print("NG:", p)
+        print("extraction OK" if not problems else f"{len(problems)} mismatches")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
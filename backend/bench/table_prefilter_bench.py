@@ -0,0 +1,121 @@
+"""
+Parity and speed check of the keyword page prefilter of
+extract_table_from_pdf_for_bento (api.pdf_utils.keyword_pages).
+
+Runs the table extraction with prefilter=True (pdfium text layer decides
+which pages are analysed) and prefilter=False (pdfplumber extract_text on
+every page, the previous behaviour) on:
+
+  - each sample order PDF (api/assets/pdf/)
+  - a synthetic multi-page order PDF (bench/synth_order_pdf.py)
+  - "mixed" documents: a sample order PDF followed by --extra-pages pages
+    without an order table (taken from the seal PDFs), like orders sent with
+    cover sheets or notes
+
+The tables must be identical; the time of both variants is printed. Each
+sample order PDF is also run with a text layer pdfium cannot match (the
+prefilter finds no page): the tables must still be found, through the
+extract_text fallback.
+
+Usage (from backend/):
+    python bench/table_prefilter_bench.py [--extra-pages 20] [--repeat 3]
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+PDF_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "api", "assets", "pdf")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import api.pdf_utils as pdf_utils  # noqa: E402
+from api.pdf_utils import extract_table_from_pdf_for_bento  # noqa: E402
+
+
+def concat_pdfs(parts):
+    """[(pdf_bytes, page_indexes or None), ...] -> one PDF (pypdfium2)."""
+    import pypdfium2 as pdfium
+    dst = pdfium.PdfDocument.new()
+    sources = []
+    try:
+        for data, pages in parts:
+            src = pdfium.PdfDocument(data)
+            sources.append(src)
+            dst.import_pages(src, pages)
+        buf = io.BytesIO()
+        dst.save(buf)
+        return buf.getvalue()
+    finally:
+        dst.close()
+        for src in sources:
+            src.close()
+
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--extra-pages", type=int, default=20, help="pages without a table in the mixed documents")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from synth_order_pdf import generate_order_pdf
+
+    orders, notes = [], []
+    for path in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf"))):
+        with open(path, "rb") as f:
+            (notes if "シール" in os.path.basename(path) else orders).append((os.path.basename(path), f.read()))
+
+    docs = list(orders)
+    docs.append(("synthetic 300x24x5", generate_order_pdf(300, 24, 5)[0]))
+    if notes and args.extra_pages:
+        import pypdfium2 as pdfium
+        note_pdf = notes[0][1]
+        note_count = len(pdfium.PdfDocument(note_pdf))
+        note_pages = [i % note_count for i in range(args.extra_pages)]
+        for name, data in orders:
+            docs.append((f"mixed {name} + {args.extra_pages} pages",
+                         concat_pdfs([(note_pdf, note_pages[:len(note_pages) // 2]), (data, None),
+                                      (note_pdf, note_pages[len(note_pages) // 2:])])))
+
+    mismatches = 0
+    print(f"{'document':48s} {'full':>9s} {'prefilter':>10s} {'speedup':>8s}")
+    for name, data in docs:
+        full_s, full = best_time(lambda: extract_table_from_pdf_for_bento(io.BytesIO(data), prefilter=False),
+                                 args.repeat)
+        fast_s, fast = best_time(lambda: extract_table_from_pdf_for_bento(io.BytesIO(data)), args.repeat)
+        same = full == fast
+        mismatches += not same
+        print(f"{name[:48]:48s} {full_s * 1000:7.0f}ms {fast_s * 1000:8.0f}ms {full_s / fast_s:7.2f}x"
+              f"{'' if same else '  MISMATCH'}")
+
+    # Garbled / missing pdfium text: no page matches the keywords
+    keyword_pages = pdf_utils.keyword_pages
+    pdf_utils.keyword_pages = lambda pdf_file, keywords: set()
+    try:
+        for name, data in orders:
+            same = (extract_table_from_pdf_for_bento(io.BytesIO(data))
+                    == extract_table_from_pdf_for_bento(io.BytesIO(data), prefilter=False))
+            mismatches += not same
+            print(f"no prefilter match: {name[:30]:30s} {'same tables' if same else 'MISMATCH'}")
+    finally:
+        pdf_utils.keyword_pages = keyword_pages
+    print("OK" if not mismatches else f"{mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
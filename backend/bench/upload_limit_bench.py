@@ -0,0 +1,138 @@
+"""
+Checks of the bounded upload handling (api.upload_utils) through the app
+(FastAPI TestClient, assets copied to a temporary ASSETS_DIR).
+
+  - caps      a PDF over MAX_PDF_UPLOAD_MB is refused with 413, with and
+              without a Content-Length (chunked body cut off while parsed)
+  - templates each template is uploaded padded to --size MB (an extra zip
+              member) and must replace the live file. The Python heap peak
+              (tracemalloc) of the handler, given the upload as Starlette
+              leaves it (spooled to a temp file), is compared with the
+              previous handler (await file.read(), then write to the live
+              path)
+  - invalid   a broken workbook / an .xlsx sent as the .xlsm template gets
+              400 and leaves the live template unchanged
+
+Usage (from backend/):
+    python bench/upload_limit_bench.py [--size 20]
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+ASSETS = os.path.join(BACKEND_DIR, "api", "assets")
+sys.path.insert(0, BACKEND_DIR)
+
+TEMPLATES = {"suudashiyo": "template.xlsm", "nouhinsyo": "nouhinsyo.xlsx", "seal": "seal.xlsx"}
+
+
+def padded(path, size_mb):
+    """The workbook with an incompressible extra member, so the upload is about size_mb."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(path) as src, zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            dst.writestr(item, src.read(item.filename))
+        dst.writestr("customXml/padding.bin", os.urandom(int(size_mb * 2**20)), zipfile.ZIP_STORED)
+    return buf.getvalue()
+
+
+def digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=20, help="template upload size (MB)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="upload_limit_")
+    for name in TEMPLATES.values():
+        shutil.copy(os.path.join(ASSETS, name), work)
+    os.environ.update(ASSETS_DIR=work, WARMUP_ON_STARTUP="0", RESULT_STORE="0", MAX_PDF_UPLOAD_MB="1",
+                      MAX_TEMPLATE_UPLOAD_MB=str(args.size + 5))
+
+    from fastapi import UploadFile
+    from fastapi.testclient import TestClient
+    import main as app_main
+
+    async def legacy_upload(file, type="seal"):
+        content = await file.read()
+        with open(os.path.join(work, TEMPLATES[type]), "wb") as f:
+            f.write(content)
+        return {}
+
+    def handler_peak(handler, data, name, kind):
+        # The upload as the multipart parser leaves it: a temp file once over 1MB
+        spooled = tempfile.SpooledTemporaryFile(max_size=2**20)
+        spooled.write(data)
+        spooled.seek(0)
+        tracemalloc.start()
+        try:
+            upload = UploadFile(file=spooled, filename=name)
+            if asyncio.iscoroutinefunction(handler):
+                asyncio.run(handler(upload, type=kind))
+            else:
+                handler(upload, type=kind)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            spooled.close()
+
+    client = TestClient(app_main.app)
+    failures = 0
+    try:
+        big = b"%PDF-1.4\n" + b"0" * (2 * 2**20)
+        status = client.post("/api/seal", files={"file": ("big.pdf", big, "application/pdf")}).status_code
+        chunked = client.post("/api/seal", content=iter([big[i:i + 65536] for i in range(0, len(big), 65536)]),
+                              headers={"Content-Type": "multipart/form-data; boundary=x"}).status_code
+        print(f"caps       2MB PDF over a 1MB cap: {status} (Content-Length), {chunked} (chunked)")
+        failures += status != 413 or chunked != 413
+
+        # Imports (openpyxl, pandas via master_utils) on the first upload would count as its peak
+        with open(os.path.join(ASSETS, "template.xlsm"), "rb") as f:
+            handler_peak(app_main.upload_template, f.read(), "template.xlsm", "suudashiyo")
+
+        print(f"\n{'template':14s} {'upload':>8s} {'legacy peak':>15s} {'new peak':>12s}")
+        for kind, name in TEMPLATES.items():
+            data = padded(os.path.join(ASSETS, name), args.size)
+            peaks = []
+            for handler in (legacy_upload, app_main.upload_template):
+                peaks.append(handler_peak(handler, data, name, kind))
+                if digest(os.path.join(work, name)) != hashlib.sha256(data).hexdigest():
+                    print(f"{name}: not replaced by {handler.__name__}")
+                    failures += 1
+            print(f"{name:14s} {len(data) / 2**20:6.1f}MB {peaks[0] / 2**20:13.1f}MB {peaks[1] / 2**20:10.1f}MB")
+
+        live = os.path.join(work, "template.xlsm")
+        before = digest(live)
+        with open(os.path.join(ASSETS, "nouhinsyo.xlsx"), "rb") as f:
+            xlsx = f.read()
+        for label, data in (("broken", b"PK\x03\x04 not really a workbook"), (".xlsx as .xlsm", xlsx)):
+            response = client.post("/api/templates/upload?type=suudashiyo",
+                                   files={"file": ("template.xlsm", data, "application/octet-stream")})
+            unchanged = digest(live) == before
+            print(f"invalid    {label}: {response.status_code}, template {'unchanged' if unchanged else 'REPLACED'}")
+            failures += response.status_code != 400 or not unchanged
+        leftovers = [n for n in os.listdir(work) if n.startswith(".")]
+        if leftovers:
+            print(f"temp files left behind: {leftovers}")
+            failures += 1
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print("OK" if not failures else f"{failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
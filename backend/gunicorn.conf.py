@@ -0,0 +1,41 @@
+"""
+gunicorn settings for running the API with several worker processes.
+
+    gunicorn -c gunicorn.conf.py main:app        (from backend/; pip install gunicorn)
+
+Workers are uvicorn workers, so the app behaves as under `uvicorn main:app`.
+With the preload mode (the default here) the app is imported once in the
+gunicorn master and api.warmup.preload_for_fork loads the parsed masters,
+bento index and template bytes before the workers are forked: the workers
+share that memory copy-on-write instead of each parsing its own copy, and
+are ready sooner. AI responses are shared between workers through
+api.shared_cache. Without preload every worker loads everything itself.
+
+The order / seal handlers are plain `def` endpoints: they run in each
+worker's threadpool (bounded by api.admission), so a slow Gemini call does
+not block the worker's event loop or its heartbeat.
+
+    WEB_CONCURRENCY=2        (worker processes)
+    GUNICORN_PRELOAD=0       (no preload: workers import the app themselves)
+    GUNICORN_TIMEOUT=300     (seconds the event loop may stay unresponsive)
+    PORT=8000
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+# A worker is restarted when its event loop stops answering the heartbeat this long.
+# Requests themselves run in the threadpool, so this only catches a stuck loop.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+
+
+def when_ready(server):
+    # With preload_app the app module is already imported in this (master) process
+    if not preload_app:
+        return
+    from main import get_order_pipeline
+    from api.warmup import preload_for_fork
+    server.log.info("Preloading masters and templates before forking the workers")
+    preload_for_fork(get_order_pipeline)
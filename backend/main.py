@@ -1,11 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Match
+from contextlib import asynccontextmanager
 import os
+import threading
+import time
+from api.metrics import span, start_trace, log_request, render_metrics, rss_sampler, REQUEST_SECONDS, REQUEST_PEAK_RSS
 from dotenv import load_dotenv
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Preload masters / templates / Gemini client in the background (see /ready).
+    # Set WARMUP_ON_STARTUP=0 to disable (e.g. with --reload during development).
+    from api.warmup import start_warmup, warmup_state
+    if os.getenv("WARMUP_ON_STARTUP", "1") != "0":
+        start_warmup(get_order_pipeline, api_key)
+    else:
+        warmup_state.status = "skipped"
+    yield
+
 # Initialize FastAPI
-app = FastAPI(title="Mamameal API")
+app = FastAPI(title="Mamameal API", lifespan=lifespan)
+
+# Size caps for uploads (413); innermost, so the CORS and timing middlewares still wrap the rejections
+from api.upload_utils import UploadLimitMiddleware
+app.add_middleware(UploadLimitMiddleware)
+
+# Concurrency limits + bounded queue for the order / seal endpoints (429 / 503 with Retry-After)
+from api.admission import AdmissionMiddleware
+app.add_middleware(AdmissionMiddleware)
 
 # CORS
 app.add_middleware(
@@ -14,13 +39,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the browser (Next.js frontend) read per-stage timings
+    expose_headers=["Server-Timing"],
 )
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Per-request trace -> Server-Timing header, JSON log line, latency and peak-RSS histograms."""
+    trace = start_trace()
+    start = time.perf_counter()
+    status = 500
+    try:
+        with rss_sampler.window() as rss:
+            response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        endpoint = _endpoint_label(request.scope)
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, status=status)
+        trace.peak_rss = rss.peak
+        if rss.peak is not None:
+            REQUEST_PEAK_RSS.observe(rss.peak, endpoint=endpoint)
+        if trace.spans:
+            log_request(endpoint, status, elapsed, trace)
+    timing = trace.server_timing()
+    response.headers["Server-Timing"] = f"{timing}, total;dur={elapsed * 1000:.1f}" if timing else f"total;dur={elapsed * 1000:.1f}"
+    return response
+
+def _endpoint_label(scope):
+    """
+    Route template of the request (/api/results/{result_id}/rerender), so the
+    metric cardinality stays bounded; "other" for paths no route matches.
+    """
+    route = scope.get("route")
+    if route is None:
+        # Answered before routing (413 / 429 / 503 from the upload and admission middlewares)
+        route = next((r for r in app.routes if r.matches(scope)[0] == Match.FULL), None)
+    return getattr(route, "path", None) or "other"
+
 # Configure Gemini
 api_key = os.getenv("GOOGLE_API_KEY")
 if not api_key:
     print("Warning: GOOGLE_API_KEY not found in environment variables.")
 
+# Gemini, or recorded responses for offline load tests (MODEL_BACKEND=replay)
+from api.model_backend import get_model_backend
+model_backend = get_model_backend(api_key)
+
 
 @app.get("/")
 def read_root():
@@ -30,18 +95,42 @@ def read_root():
 def health_check():
     return {"status": "ok"}
 
-from api.seal_utils import generate_seal_data, create_seal_excel
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: request and per-stage latency histograms."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+def readiness_check():
+    """503 until the startup warm-up has finished, then 200 with per-stage timings."""
+    from api.warmup import warmup_state
+    body = warmup_state.as_dict()
+    if not warmup_state.finished:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+# NOTE: Heavy libraries (pandas, openpyxl, pdfplumber, google-genai) are imported
+# on first use by the endpoints that need them, so cold starts and /health stay fast.
 import base64
 
+# The heavy endpoints are plain `def`: they run in the threadpool, so the event loop
+# stays free to queue or refuse requests (api.admission) while they work.
 @app.post("/api/seal")
-async def create_seal(file: UploadFile = File(...)):
+def create_seal(file: UploadFile = File(...), reextract: bool = False):
+    """reextract=true skips the AI response other workers cached for this PDF."""
     try:
-        content = await file.read()
-        blocks = generate_seal_data(content, api_key=api_key)
-        excel_io = create_seal_excel(blocks)
+        from api.seal_utils import create_seal_excel
+        content = file.file.read()
+        if reextract:
+            model_backend.forget(content)
+        with span("ai_call"):
+            blocks = model_backend.extract_seal(content)
+        with span("seal_excel"):
+            excel_io = create_seal_excel(blocks)
         
         # Return as base64 for now (or streaming response)
-        b64_str = base64.b64encode(excel_io.getvalue()).decode()
+        with span("encode"):
+            b64_str = base64.b64encode(excel_io.getvalue()).decode()
         return {
             "filename": f"{file.filename.replace('.pdf', '')}_seal.xlsx",
             "file_data": b64_str,
@@ -51,241 +140,227 @@ async def create_seal(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Order/Invoice Processing ---
-from api.pdf_utils import (
-    safe_write_df, match_bento_data, paste_dataframe_to_sheet,
-    extract_detailed_client_info_from_pdf
-)
-# Note: Legacy extraction functions removed/unused in favor of AI
-from api.ai_processor import process_order_pdf_with_ai
-from api.master_utils import load_master_csv, save_master_file
-from openpyxl import load_workbook
-import io
-import pandas as pd
-
 # Assets directory - configurable for Railway Volume
 # In Railway, set ASSETS_DIR env var to "/app/api/assets" (Volume mount path)
 ASSETS_DIR = os.getenv("ASSETS_DIR", os.path.join(os.path.dirname(__file__), 'api', 'assets'))
 
+_order_pipeline = None
+_order_pipeline_lock = threading.Lock()
+
+def get_order_pipeline():
+    """Shared pipeline (keeps parsed masters cached between requests), created on first use."""
+    global _order_pipeline
+    with _order_pipeline_lock:
+        if _order_pipeline is None:
+            from api.order_pipeline import OrderPipeline
+            _order_pipeline = OrderPipeline(ASSETS_DIR, api_key=api_key, header_source="ai",
+                                            model_backend=model_backend)
+    return _order_pipeline
+
+# --- Result store (history of conversions, re-download without recomputing) ---
+# RESULT_STORE=0 disables it; RESULTS_KEEP limits how many results are kept (0 = all,
+# about 1.5MB per result: workbooks + PDF).
+RESULTS_DIR = os.getenv("RESULTS_DIR", os.path.join(ASSETS_DIR, "results"))
+
+_result_store = None
+
+def get_result_store():
+    global _result_store
+    if os.getenv("RESULT_STORE", "1") == "0":
+        return None
+    with _order_pipeline_lock:
+        if _result_store is None:
+            from api.result_store import ResultStore
+            _result_store = ResultStore(RESULTS_DIR, max_entries=int(os.getenv("RESULTS_KEEP", "100")))
+    return _result_store
+
+def save_order_result(source_filename, pdf_bytes, result, files, extraction_from=None, pdf_sha256=None):
+    """Record a conversion; returns the result id, or None (store disabled / failed)."""
+    store = get_result_store()
+    if store is None:
+        return None
+    try:
+        from api.order_pipeline import EXTRACTION_VERSION
+        pipeline = get_order_pipeline()
+        # The masters the result was rendered with, even if a new version was uploaded meanwhile
+        # (taken from the key: the paths, no need to load that version again)
+        product, customer = result.master_key or (None, None)
+        inputs = {
+            "product_master": os.path.basename(product[0]) if product else None,
+            "customer_master": os.path.basename(customer[0]) if customer else None,
+            "header_source": pipeline.header_source,
+            "model_backend": pipeline.model_backend.name,
+            "model_name": pipeline.model_name,
+            "extraction_version": EXTRACTION_VERSION,
+        }
+        if extraction_from is not None:
+            # Re-rendered from the extraction of an earlier result
+            inputs["extraction_from"] = extraction_from
+        with span("store"):
+            return store.save_order(source_filename, pdf_bytes, result.extraction, files, inputs=inputs,
+                                    pdf_sha256=pdf_sha256)
+    except Exception as e:
+        # Never fail the conversion because the history could not be written
+        print(f"Error saving result: {e}")
+        return None
+
+def find_cached_extraction(pdf_bytes):
+    """
+    (result_id, OrderExtraction) of an earlier conversion of the same PDF with
+    the same extractor and EXTRACTION_VERSION, or None. An extraction that fails the cascade's order
+    validation (e.g. blank or duplicate bento headers the last model still
+    returned) is never reused: the upload is extracted again.
+    """
+    store = get_result_store()
+    if store is None:
+        return None
+    from api.model_cascade import order_response_problems
+    from api.order_pipeline import EXTRACTION_VERSION, OrderExtraction
+    from api.result_store import sha256
+    pipeline = get_order_pipeline()
+    try:
+        with span("extraction_cache"):
+            found = store.find_extraction(sha256(pdf_bytes), header_source=pipeline.header_source,
+                                          model_backend=pipeline.model_backend.name,
+                                          model_name=pipeline.model_name,
+                                          extraction_version=EXTRACTION_VERSION)
+    except Exception as e:
+        print(f"Error reading result store: {e}")
+        return None
+    if found is None:
+        return None
+    result_id, extraction = found
+    problems = order_response_problems(extraction)
+    if problems:
+        print(f"Stored extraction {result_id} not reused: {', '.join(problems)}")
+        return None
+    return result_id, OrderExtraction.from_dict(extraction)
+
+def order_response(source_filename, pdf_bytes, result, extraction_from=None, pdf_sha256=None):
+    template_filename = f"{source_filename.replace('.pdf', '')}_数出表.xlsm"
+    nouhin_filename = f"{source_filename.replace('.pdf', '')}_納品書.xlsx"
+    result_id = save_order_result(source_filename, pdf_bytes, result, {
+        "template": (template_filename, result.template_bytes),
+        "nouhinsyo": (nouhin_filename, result.nouhinsyo_bytes),
+    }, extraction_from=extraction_from, pdf_sha256=pdf_sha256)
+    with span("encode"):
+        b64_template = base64.b64encode(result.template_bytes).decode()
+        b64_nouhin = base64.b64encode(result.nouhinsyo_bytes).decode()
+
+    return {
+        "result_id": result_id,
+        "extraction_from": extraction_from,
+        "template_file": {
+            "filename": template_filename,
+            "data": b64_template
+        },
+        "nouhinsyo_file": {
+            "filename": nouhin_filename,
+            "data": b64_nouhin
+        }
+    }
+
 @app.post("/api/order-invoice")
-async def process_order(file: UploadFile = File(...)):
+def process_order(file: UploadFile = File(...), reextract: bool = False):
+    """
+    Re-uploading a PDF that was already converted reuses its stored extraction
+    (no AI call, no PDF parsing) and only re-renders with the current masters /
+    templates, unless that extraction failed validation. reextract=true forces
+    a fresh extraction (the frontend's 再読み取り button).
+    """
     try:
-        pdf_bytes = await file.read()
-        
-        # Load Masters
-        df_product_master, _ = load_master_csv(ASSETS_DIR, "商品マスタ")
-        df_customer_master, _ = load_master_csv(ASSETS_DIR, "得意先マスタ")
-        
+        pdf_bytes = file.file.read()
+
+        if reextract:
+            # Also skip the AI responses other workers cached for this PDF
+            model_backend.forget(pdf_bytes)
+        cached = None if reextract else find_cached_extraction(pdf_bytes)
+        if cached is not None:
+            extraction_from, extraction = cached
+            result = get_order_pipeline().rerender(extraction)
+            return order_response(file.filename, pdf_bytes, result, extraction_from=extraction_from)
+
         # --- AI Extraction ---
-        if not api_key:
+        if not model_backend.available:
              raise HTTPException(status_code=500, detail="API Key not configured for AI processing")
 
-        ai_result = process_order_pdf_with_ai(pdf_bytes, api_key)
-        bento_header_names = ai_result.get('bento_headers', [])
-        
-        # 1. Process Clients (Legacy Layout Extraction)
-        # Reverting to original 'mamameal-next' logic as requested by user.
-        # This uses 'extract_text_with_layout' to robustly find rows.
-        df_client_sheet = None
-        client_data_legacy = extract_detailed_client_info_from_pdf(io.BytesIO(pdf_bytes))
-        
-        num_bento_cols = len(bento_header_names) if bento_header_names else 5 # Default to 5 to be safe if no AI headers?
-        
-        # Create lookup dictionary: 得意先CD(A列) -> 得意先名略称(D列)
-        customer_name_map = {}
-        if not df_customer_master.empty:
-            df_customer_master.columns = df_customer_master.columns.str.strip()
-            # A列=得意先CD, B列=得意先名 (column indices 0 and 1)
-            col_names = list(df_customer_master.columns)
-            if len(col_names) >= 2:
-                id_col = col_names[0]      # A列: 得意先CD
-                customer_name_col = col_names[1]  # B列: 得意先名 (顧客向け正式名称)
-                for _, row in df_customer_master.iterrows():
-                    cid = str(row[id_col]).strip()
-                    cname = str(row[customer_name_col]).strip()
-                    if cid and cname:
-                        customer_name_map[cid] = cname
-        
-        client_rows = []
-        for info in client_data_legacy:
-            s_list = info.get('student_meals', [])
-            t_list = info.get('teacher_meals', [])
-            
-            internal_client_name = info['client_name']
-            client_id = str(info.get('client_id', '')).strip()
-            
-            # Lookup customer-facing name using Client ID
-            customer_facing_name = customer_name_map.get(client_id, '')
-            
-            # Add client_id (A列), client_name (B列), customer_facing_name (C列)
-            row = {
-                'クライアントID': info.get('client_id', ''),
-                'クライアント名': internal_client_name,
-                'クライアント名（顧客向け）': customer_facing_name
-            }
-            
-            # Dynamic Columns: Student 1..N (D列から開始)
-            for i in range(num_bento_cols):
-                val = s_list[i] if i < len(s_list) else ''
-                row[f's_{i}'] = val
-                
-            # Dynamic Columns: Teacher 1..N
-            for i in range(num_bento_cols):
-                val = t_list[i] if i < len(t_list) else ''
-                row[f't_{i}'] = val
-            
-            client_rows.append(row)
-            
-        if client_rows:
-            df_client_sheet = pd.DataFrame(client_rows)
-            # Enforce column order: ID, Client, CustomerName, S...S, T...T
-            cols = ['クライアントID', 'クライアント名', 'クライアント名（顧客向け）'] + [f's_{i}' for i in range(num_bento_cols)] + [f't_{i}' for i in range(num_bento_cols)]
-            # Ensure only existing columns are selected (in case df was created differently?)
-            # creating from list of dicts creates all keys.
-            df_client_sheet = df_client_sheet[cols]
-
-        # 2. Process Bentos
-        df_bento_sheet = None
-        # Use 'bento_headers' strings extracted by AI
-        bento_names = ai_result.get('bento_headers', [])
-        
-        if bento_names:
-            matched_data = []
-            for b_name in bento_names:
-                search_key = b_name
-                # User requested grouping logic:
-                # "Charaben..." -> Search "キャラ"
-                # "Red..." -> Search "赤"
-                if "キャラ弁" in b_name:
-                    search_key = "キャラ"
-                elif b_name.startswith("赤 ") or b_name == "赤": # Match "赤 飯あり..."
-                    search_key = "赤"
-                    
-                # Match against Product Master (returns [[Name, Box, Price, Type]])
-                # We use search_key to find the row, but keep b_name for the Excel Name column
-                match_res = match_bento_data([search_key], df_product_master)
-                if match_res:
-                    m_row = match_res[0]
-                    # [Original_AI_Name, Box, Price, Type]
-                    matched_data.append([b_name, m_row[1], m_row[2], m_row[3]])
-            
-            df_bento_sheet = pd.DataFrame(matched_data, columns=['商品予定名', 'パン箱入数', '売価単価', '弁当区分'])
-
-        # 3. Paste Sheet (Legacy) -> Empty
-        df_paste_sheet = pd.DataFrame() 
-
-
-        # 4. Generate Files
-        template_path = os.path.join(ASSETS_DIR, "template.xlsm")
-        nouhinsyo_path = os.path.join(ASSETS_DIR, "nouhinsyo.xlsx")
-        
-        if not os.path.exists(template_path) or not os.path.exists(nouhinsyo_path):
-             raise HTTPException(status_code=500, detail="Template files not found")
+        result = get_order_pipeline().run(pdf_bytes)
+        return order_response(file.filename, pdf_bytes, result)
 
-        # --- Generate Template (Shuushussho) ---
-        template_wb = load_workbook(template_path, keep_vba=True)
-        
-        # Paste Masters
-        if not df_product_master.empty and "商品マスタ" in template_wb.sheetnames:
-            ws = template_wb["商品マスタ"]
-            if ws.max_row > 0: ws.delete_rows(1, ws.max_row)
-            paste_dataframe_to_sheet(ws, df_product_master)
-            
-        if not df_customer_master.empty and "得意先マスタ" in template_wb.sheetnames:
-             ws = template_wb["得意先マスタ"]
-             if ws.max_row > 0: ws.delete_rows(1, ws.max_row)
-             paste_dataframe_to_sheet(ws, df_customer_master)
-
-        # Write Data
-        ws_paste = template_wb["貼り付け用"]
-        for r_idx, row in df_paste_sheet.iterrows():
-            for c_idx, value in enumerate(row):
-                ws_paste.cell(row=r_idx + 1, column=c_idx + 1, value=value)
-        
-        if df_bento_sheet is not None and "注文弁当の抽出" in template_wb.sheetnames:
-            safe_write_df(template_wb["注文弁当の抽出"], df_bento_sheet)
-            
-        if df_client_sheet is not None and "クライアント抽出" in template_wb.sheetnames:
-            ws_client = template_wb["クライアント抽出"]
-            # Write DATA starting at Row 2 (leaving Row 1 for headers)
-            # This ensures we don't overwrite our new dynamic headers
-            safe_write_df(ws_client, df_client_sheet, start_row=2)
-            
-            # --- Dynamic Header Injection (Explicit Write) ---
-            # Manually write headers to Row 1 because safe_write_df reads values only
-            # The structure is: ID | Client | CustomerName | Student_Cols... | Teacher_Cols...
-            ws_client.cell(row=1, column=1, value='クライアントID')
-            ws_client.cell(row=1, column=2, value='クライアント名')
-            ws_client.cell(row=1, column=3, value='クライアント名（顧客向け）')
-            
-            if bento_header_names:
-                num_cols = len(bento_header_names)
-                for i in range(num_cols):
-                    b_name = bento_header_names[i]
-                    
-                    # Student Header (Starts at Col 4 = D列)
-                    ws_client.cell(row=1, column=4+i, value=f"{b_name}\n(園児)")
-                    
-                    # Teacher Header (Starts after Student Block)
-                    ws_client.cell(row=1, column=4+num_cols+i, value=f"{b_name}\n(先生)")
-            # -------------------------------------------------
-            
-        out_template = io.BytesIO()
-        template_wb.save(out_template)
-        b64_template = base64.b64encode(out_template.getvalue()).decode()
-
-        # --- Generate Nouhinsyo ---
-        nouhinsyo_wb = load_workbook(nouhinsyo_path)
-        
-        if not df_customer_master.empty and "得意先マスタ" in nouhinsyo_wb.sheetnames:
-             ws = nouhinsyo_wb["得意先マスタ"]
-             if ws.max_row > 0: ws.delete_rows(1, ws.max_row)
-             paste_dataframe_to_sheet(ws, df_customer_master)
-             
-        ws_paste_n = nouhinsyo_wb["貼り付け用"]
-        for r_idx, row in df_paste_sheet.iterrows():
-            for c_idx, value in enumerate(row):
-                ws_paste_n.cell(row=r_idx + 1, column=c_idx + 1, value=value)
-                
-        # Bento for Nouhinsyo
-        df_bento_for_nouhin = None
-        if df_bento_sheet is not None:
-             master_df = df_product_master.copy()
-             if not master_df.empty and '商品名' in master_df.columns:
-                 master_map = master_df.drop_duplicates(subset=['商品予定名']).set_index('商品予定名')['商品名'].to_dict()
-                 df_bento_for_nouhin = df_bento_sheet.copy()
-                 df_bento_for_nouhin['商品名'] = df_bento_for_nouhin['商品予定名'].map(master_map)
-                 df_bento_for_nouhin = df_bento_for_nouhin[['商品予定名', 'パン箱入数', '商品名']]
-        
-        if df_bento_for_nouhin is not None and "注文弁当の抽出" in nouhinsyo_wb.sheetnames:
-             safe_write_df(nouhinsyo_wb["注文弁当の抽出"], df_bento_for_nouhin)
-        
-        if df_client_sheet is not None and "クライアント抽出" in nouhinsyo_wb.sheetnames:
-             safe_write_df(nouhinsyo_wb["クライアント抽出"], df_client_sheet)
-
-        out_nouhin = io.BytesIO()
-        nouhinsyo_wb.save(out_nouhin)
-        b64_nouhin = base64.b64encode(out_nouhin.getvalue()).decode()
-        
-        return {
-            "template_file": {
-                "filename": f"{file.filename.replace('.pdf', '')}_数出表.xlsm",
-                "data": b64_template
-            },
-            "nouhinsyo_file": {
-                "filename": f"{file.filename.replace('.pdf', '')}_納品書.xlsx",
-                "data": b64_nouhin
-            }
-        }
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/results/{result_id}/rerender")
+def rerender_result(result_id: int):
+    """Regenerate 数出表 / 納品書 from a stored extraction with the current masters and templates."""
+    from api.order_pipeline import OrderExtraction
+    store = get_result_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Result store is disabled")
+    stored = store.get(result_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    try:
+        pdf = store.get_file(result_id, "pdf")
+        result = get_order_pipeline().rerender(OrderExtraction.from_dict(stored["extraction"]))
+        source_filename = stored["source_filename"] or f"{result_id}.pdf"
+        return order_response(source_filename, pdf[1] if pdf else None, result,
+                              extraction_from=result_id, pdf_sha256=stored["pdf_sha256"])
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/results")
+def list_results(limit: int = 50, offset: int = 0, pdf_sha256: str = None):
+    """Past conversions, newest first."""
+    store = get_result_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Result store is disabled")
+    try:
+        return {"results": store.list(limit=min(max(limit, 1), 500), offset=max(offset, 0), pdf_sha256=pdf_sha256)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/results/{result_id}")
+def get_result(result_id: int):
+    """One conversion with its extraction output (bento headers, client rows)."""
+    store = get_result_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Result store is disabled")
+    result = store.get(result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return result
+
+@app.get("/api/results/{result_id}/files/{key}")
+def download_result_file(result_id: int, key: str):
+    """Stored file: key = template (数出表) | nouhinsyo (納品書) | pdf (uploaded PDF)."""
+    from urllib.parse import quote
+    from api.result_store import media_type_for
+    store = get_result_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Result store is disabled")
+    try:
+        stored = store.get_file(result_id, key)
+    except FileNotFoundError:
+        stored = None
+    if stored is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    filename, data = stored
+    return Response(
+        content=data,
+        media_type=media_type_for(filename),
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+    )
+
+# Plain `def` as well: encoding detection, the snapshot write and fsync stay off the event loop
 @app.post("/api/masters/upload")
-async def upload_master(file: UploadFile = File(...), type: str = "product"):
+def upload_master(file: UploadFile = File(...), type: str = "product"):
     try:
-        content = await file.read()
+        from api.master_utils import save_master_file
         file_pattern = "商品マスタ" if type == "product" else "得意先マスタ"
         if type not in ["product", "customer"]:
              raise HTTPException(status_code=400, detail="Invalid type. Use 'product' or 'customer'.")
@@ -296,11 +371,15 @@ async def upload_master(file: UploadFile = File(...), type: str = "product"):
         if type == "customer" and "得意先マスタ一覧" not in file.filename:
              raise HTTPException(status_code=400, detail="Filename must contain '得意先マスタ一覧'")
 
+        content = file.file.read()
         success = save_master_file(ASSETS_DIR, content, file.filename, file_pattern)
         if success:
+            get_order_pipeline().invalidate()
             return {"message": "File saved successfully"}
         else:
             raise HTTPException(status_code=500, detail="Failed to save file")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -308,11 +387,10 @@ async def upload_master(file: UploadFile = File(...), type: str = "product"):
 def get_master_info():
     """Get current master file names."""
     try:
-        _, product_filename = load_master_csv(ASSETS_DIR, "商品マスタ")
-        _, customer_filename = load_master_csv(ASSETS_DIR, "得意先マスタ")
+        masters = get_order_pipeline().load_masters()
         return {
-            "product": product_filename or "未設定",
-            "customer": customer_filename or "未設定"
+            "product": masters.product_filename or "未設定",
+            "customer": masters.customer_filename or "未設定"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -343,20 +421,24 @@ def get_template_info():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/templates/upload")
-async def upload_template(file: UploadFile = File(...), type: str = "seal"):
+def upload_template(file: UploadFile = File(...), type: str = "seal"):
     """Upload a template file."""
     try:
         if type not in TEMPLATE_FILES:
             raise HTTPException(status_code=400, detail=f"Invalid template type. Use: {list(TEMPLATE_FILES.keys())}")
         
         expected_filename, label = TEMPLATE_FILES[type]
-        content = await file.read()
-        
-        # Save template file
+        from api.upload_utils import replace_from_upload, validate_template
+
+        # Streamed from the spooled upload, checked, then swapped in: a broken upload keeps the old template
         save_path = os.path.join(ASSETS_DIR, expected_filename)
-        with open(save_path, "wb") as f:
-            f.write(content)
-        
+        problem = replace_from_upload(file.file, save_path,
+                                      validate=lambda path: validate_template(path, expected_filename))
+        if problem:
+            raise HTTPException(status_code=400, detail=f"{label}として使えないファイルです: {problem}")
+
         return {"message": f"{label}を更新しました"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
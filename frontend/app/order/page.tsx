@@ -1,7 +1,7 @@
 "use client";
 
 import { useState } from "react";
-import { Upload, FileDown, Loader2, ArrowLeft, Sparkles } from "lucide-react";
+import { Upload, FileDown, Loader2, ArrowLeft, Sparkles, RefreshCw } from "lucide-react";
 import Link from "next/link";
 import axios from "axios";
 import { motion } from "framer-motion";
@@ -41,8 +41,7 @@ export default function OrderPage() {
         }
     };
 
-    const handleSubmit = async (e: React.FormEvent) => {
-        e.preventDefault();
+    const convert = async (reextract: boolean) => {
         if (!file) return;
 
         setIsLoading(true);
@@ -54,8 +53,10 @@ export default function OrderPage() {
 
         try {
             // Use 127.0.0.1 to avoid localhost IPv6 issues
+            // reextract: ignore the stored reading of this PDF and ask the AI again
             const response = await axios.post(`${API_URL}/api/order-invoice`, formData, {
                 headers: { "Content-Type": "multipart/form-data" },
+                params: reextract ? { reextract: true } : undefined,
             });
             setResult(response.data);
         } catch (err: any) {
@@ -66,6 +67,11 @@ export default function OrderPage() {
         }
     };
 
+    const handleSubmit = (e: React.FormEvent) => {
+        e.preventDefault();
+        convert(false);
+    };
+
     const downloadFile = (fileData: string, filename: string) => {
         const link = document.createElement("a");
         link.href = `data:application/vnd.ms-excel.sheet.macroEnabled.12;base64,${fileData}`;
@@ -165,6 +171,19 @@ export default function OrderPage() {
                                 <span className="w-2 h-2 bg-green-500 rounded-full mr-2"></span>
                                 完了しました
                             </h3>
+                            {result.extraction_from && (
+                                <div className="mb-4 p-4 bg-gray-50 rounded-lg text-sm text-gray-600 flex items-center justify-between gap-4">
+                                    <span>以前の読み取り結果を再利用しました（現在のマスタ・テンプレートで作成）。内容が正しくない場合は再読み取りしてください。</span>
+                                    <button
+                                        onClick={() => convert(true)}
+                                        disabled={isLoading}
+                                        className="shrink-0 inline-flex items-center px-3 py-2 rounded-lg border border-gray-200 hover:border-orange-500 hover:text-orange-600 transition-colors disabled:opacity-50"
+                                    >
+                                        <RefreshCw className="w-4 h-4 mr-1" />
+                                        AIで再読み取り
+                                    </button>
+                                </div>
+                            )}
                             <div className="grid gap-4 md:grid-cols-2">
                                 <button
                                     onClick={() => downloadFile(result.template_file.data, result.template_file.filename)}
@@ -1,7 +1,7 @@
 "use client";
 
 import { useState } from "react";
-import { Upload, FileDown, Loader2, ArrowLeft, Sparkles } from "lucide-react";
+import { Upload, FileDown, Loader2, ArrowLeft, Sparkles, RefreshCw } from "lucide-react";
 import Link from "next/link";
 import axios from "axios";
 import { motion } from "framer-motion";
@@ -41,8 +41,7 @@ export default function SealPage() {
         }
     };
 
-    const handleSubmit = async (e: React.FormEvent) => {
-        e.preventDefault();
+    const convert = async (reextract: boolean) => {
         if (!file) return;
 
         setIsLoading(true);
@@ -53,8 +52,10 @@ export default function SealPage() {
         formData.append("file", file);
 
         try {
+            // reextract: ignore the cached AI reading of this PDF
             const response = await axios.post(`${API_URL}/api/seal`, formData, {
                 headers: { "Content-Type": "multipart/form-data" },
+                params: reextract ? { reextract: true } : undefined,
             });
             setResult(response.data);
         } catch (err: any) {
@@ -65,6 +66,11 @@ export default function SealPage() {
         }
     };
 
+    const handleSubmit = (e: React.FormEvent) => {
+        e.preventDefault();
+        convert(false);
+    };
+
     const downloadFile = (fileData: string, filename: string) => {
         const link = document.createElement("a");
         link.href = `data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,${fileData}`;
@@ -169,6 +175,15 @@ export default function SealPage() {
                                 </div>
                             </button>
 
+                            <button
+                                onClick={() => convert(true)}
+                                disabled={isLoading}
+                                className="mt-3 inline-flex items-center text-sm text-gray-500 hover:text-pink-600 transition-colors disabled:opacity-50"
+                            >
+                                <RefreshCw className="w-4 h-4 mr-1" />
+                                内容が正しくない場合: AIで再読み取り
+                            </button>
+
                             <div className="mt-6">
                                 <h4 className="font-bold text-gray-700 mb-2 text-sm">解析結果プレビュー</h4>
                                 <div className="bg-gray-50 rounded-xl p-4 text-xs font-mono text-gray-600 max-h-60 overflow-y-auto">
@@ -1,37 +1,29 @@
 import streamlit as st
 import os
+import sys
 import json
 import base64
+import hashlib
 import io
 import pandas as pd
 import google.generativeai as genai
 from openpyxl import load_workbook, Workbook
 from dotenv import load_dotenv
-import unicodedata
-import glob
 
-# Try to import pdf_utils with error handling for Streamlit Cloud
+# The order pipeline lives in backend/api and is shared with the FastAPI backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+# Try to import the pipeline with error handling for Streamlit Cloud
 try:
-    from api.pdf_utils import (
-        safe_write_df, pdf_to_excel_data_for_paste_sheet, extract_table_from_pdf_for_bento,
-        find_correct_anchor_for_bento, extract_bento_range_for_bento, match_bento_data, 
-        extract_detailed_client_info_from_pdf, export_detailed_client_data_to_dataframe,
-        paste_dataframe_to_sheet
-    )
+    from api.order_pipeline import OrderPipeline
+    from api.master_utils import save_master_file
+    from api.model_backend import get_model_backend
+    from api.model_scheduler import get_model_scheduler
+    from api.model_cascade import SealCascade
     PDF_UTILS_AVAILABLE = True
 except Exception as e:
     PDF_UTILS_AVAILABLE = False
     PDF_UTILS_ERROR = str(e)
-    # Define dummy functions
-    def safe_write_df(*args, **kwargs): pass
-    def pdf_to_excel_data_for_paste_sheet(*args, **kwargs): return None
-    def extract_table_from_pdf_for_bento(*args, **kwargs): return []
-    def find_correct_anchor_for_bento(*args, **kwargs): return -1
-    def extract_bento_range_for_bento(*args, **kwargs): return []
-    def match_bento_data(*args, **kwargs): return []
-    def extract_detailed_client_info_from_pdf(*args, **kwargs): return []
-    def export_detailed_client_data_to_dataframe(*args, **kwargs): return pd.DataFrame()
-    def paste_dataframe_to_sheet(*args, **kwargs): pass
 
 # Load environment variables
 load_dotenv()
@@ -126,58 +118,14 @@ ICON_TAG = """<svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" vie
 ICON_SETTINGS = """<svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="#f97316" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><circle cx="12" cy="12" r="3"></circle><path d="M19.4 15a1.65 1.65 0 0 0 .33 1.82l.06.06a2 2 0 0 1 0 2.83 2 2 0 0 1-2.83 0l-.06-.06a1.65 1.65 0 0 0-1.82-.33 1.65 1.65 0 0 0-1 1.51V21a2 2 0 0 1-2 2 2 2 0 0 1-2-2v-.09A1.65 1.65 0 0 0 9 19.4a1.65 1.65 0 0 0-1.82.33l-.06.06a2 2 0 0 1-2.83 0 2 2 0 0 1 0-2.83l.06-.06a1.65 1.65 0 0 0 .33-1.82 1.65 1.65 0 0 0-1.51-1H3a2 2 0 0 1-2-2 2 2 0 0 1 2-2h.09A1.65 1.65 0 0 0 4.6 9a1.65 1.65 0 0 0-.33-1.82l-.06-.06a2 2 0 0 1 0-2.83 2 2 0 0 1 2.83 0l.06.06a1.65 1.65 0 0 0 1.82.33H9a1.65 1.65 0 0 0 1-1.51V3a2 2 0 0 1 2-2 2 2 0 0 1 2 2v.09a1.65 1.65 0 0 0 1 1.51 1.65 1.65 0 0 0 1.82-.33l.06-.06a2 2 0 0 1 2.83 0 2 2 0 0 1 0 2.83l-.06.06a1.65 1.65 0 0 0-.33 1.82V9a1.65 1.65 0 0 0 1.51 1H21a2 2 0 0 1 2 2 2 2 0 0 1-2 2h-.09a1.65 1.65 0 0 0-1.51 1z"></path></svg>"""
 ICON_MAIN = """<svg xmlns="http://www.w3.org/2000/svg" width="32" height="32" viewBox="0 0 24 24" fill="none" stroke="#ea580c" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M3 9l9-7 9 7v11a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2z"></path><polyline points="9 22 9 12 15 12 15 22"></polyline></svg>"""
 
-# --- Utility Functions ---
-
-def load_master_csv(base_path, file_pattern):
-    """Load master CSV from assets directory."""
-    search_path = os.path.join(base_path, f'*{file_pattern}*.csv')
-    list_of_files = glob.glob(search_path)
-    if not list_of_files:
-        return pd.DataFrame(), None
-    latest_file = max(list_of_files, key=os.path.getmtime)
-    encodings = ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis']
-    for encoding in encodings:
-        try:
-            df = pd.read_csv(latest_file, encoding=encoding, dtype=str).fillna('')
-            if not df.empty:
-                df.columns = df.columns.str.strip()
-                return df, os.path.basename(latest_file)
-        except Exception:
-            continue
-    return pd.DataFrame(), None
-
-def save_master_file(base_path, uploaded_file, file_pattern):
-    """Save uploaded master file to assets directory, removing old ones."""
-    # 1. Delete existing files matching the pattern
-    search_path = os.path.join(base_path, f'*{file_pattern}*.csv')
-    old_files = glob.glob(search_path)
-    for f in old_files:
-        try:
-            os.remove(f)
-        except Exception as e:
-            st.error(f"旧ファイルの削除に失敗しました: {str(e)}")
-            return False
-
-    # 2. Save new file
-    save_path = os.path.join(base_path, uploaded_file.name)
-    try:
-        with open(save_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return True
-    except Exception as e:
-        st.error(f"ファイルの保存に失敗しました: {str(e)}")
-        return False
-
-def clear_sheet(ws):
-    """Clear all cells in a worksheet."""
-    if ws.max_row > 0:
-        ws.delete_rows(1, ws.max_row)
-
 # --- Main App Logic ---
 
 st.markdown(f'<div class="main-header">{ICON_MAIN} ママミール業務ツール</div>', unsafe_allow_html=True)
 
 # Sidebar
+# Seal model choice that runs the fast -> strong model cascade (api.model_cascade)
+AUTO_MODEL = "自動 (高速→高精度)"
+
 with st.sidebar:
     st.header("設定")
     
@@ -197,15 +145,130 @@ with st.sidebar:
     
     model_name = st.selectbox(
         "使用モデル (シール作成用)",
-        ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.0-flash"],
-        index=1,
-        help="gemini-2.5-pro: 最高精度\ngemini-2.5-flash: 高速かつ高精度（推奨）\ngemini-2.0-flash: 安定版"
+        [AUTO_MODEL, "gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.0-flash"],
+        index=0,
+        help="自動: 高速モデルで抽出し、検証に失敗したページだけ高精度モデルで再抽出\n"
+             "gemini-2.5-pro: 最高精度\ngemini-2.5-flash: 高速かつ高精度\ngemini-2.0-flash: 安定版"
     )
 
 ASSETS_DIR = os.path.join(os.path.dirname(__file__), 'api', 'assets')
 if not os.path.exists(ASSETS_DIR):
     os.makedirs(ASSETS_DIR)
 
+# --- Model backend ---
+# The seal tab calls Gemini directly; with MODEL_BACKEND=replay it serves
+# recorded responses instead (offline testing, see backend/api/model_backend.py).
+@st.cache_resource
+def get_seal_model_backend():
+    if not PDF_UTILS_AVAILABLE or os.getenv("MODEL_BACKEND", "gemini").strip().lower() != "replay":
+        return None
+    return get_model_backend()
+
+seal_model_backend = get_seal_model_backend()
+if seal_model_backend is not None:
+    st.sidebar.info(f"モデル: リプレイ (録画済みレスポンス: {os.path.basename(seal_model_backend.responses_path)})")
+
+# --- Cached loaders ---
+# Streamlit re-executes this script on every interaction, so parsed masters,
+# PDF extraction results and rendered workbooks are cached across reruns.
+# Keys: master / template file mtimes and the PDF's SHA-256.
+
+@st.cache_resource
+def get_order_pipeline():
+    """Pipeline shared by all sessions (keeps parsed masters between reruns)."""
+    return OrderPipeline(ASSETS_DIR, header_source="table", sheet_layout="streamlit")
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def extract_order_pdf(pdf_hash, _pdf_bytes):
+    """PDF extraction, cached per PDF hash."""
+    return get_order_pipeline().extract(_pdf_bytes)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def render_order_workbooks(pdf_hash, master_key, template_key, _pdf_bytes):
+    """数出表・納品書のバイト列, cached per PDF hash and master / template version."""
+    pipeline = get_order_pipeline()
+    # The master version of the cache key, even if an upload swapped in a newer one meanwhile
+    masters = pipeline.load_masters(master_key)
+    sheets = pipeline.build_sheets(extract_order_pdf(pdf_hash, _pdf_bytes), masters)
+    return pipeline.render(sheets, masters)
+
+def invalidate_master_caches():
+    """Call after a master upload."""
+    get_order_pipeline().invalidate()
+    render_order_workbooks.clear()
+
+def extract_seal_blocks(pdf_bytes, model_name):
+    """Seal PDF -> blocks, from Gemini or the replay backend (MODEL_BACKEND=replay)."""
+    if seal_model_backend is not None:
+        return seal_model_backend.extract_seal(pdf_bytes, model_name=None if model_name == AUTO_MODEL else model_name)
+    if model_name == AUTO_MODEL:
+        # Page chunks one after another: st.* calls need the script thread
+        return SealCascade(extract_seal_blocks, workers=1).run(pdf_bytes)
+
+    model = genai.GenerativeModel(model_name)
+
+    seal_prompt = """
+このPDFはシール表です。横4つ × 縦5つ(合計約20個)のブロックで構成されています。
+各ブロックには以下の情報が含まれています:
+1. クライアント名 (最上部): 小学校名または幼稚園名 + 「様」
+2. 準備物 (クライアント名のすぐ下): パン箱入数、ご飯150gなど
+3. クラス名 (中央、大きめの文字): チューリップ、さくらなど
+4. 弁当数 (クラス名の下): 数値(例: 35、35+1)
+5. 日付 (ブロック左下): MM/DD形式
+6. 学年 (ブロック右下): 年長、年中など
+
+以下のJSON形式で、全てのブロック情報を抽出してください:
+{
+  "blocks": [
+    {
+      "client_name": "博多南衆参コース様",
+      "preparations": ["パン箱入数", "ご飯150g"],
+      "class_name": "チューリップ",
+      "meal_count": "35",
+      "date": "12/10",
+      "grade": "年長"
+    }
+  ]
+}
+重要: 全てのブロックを抽出してください。完全で有効なJSONのみを返してください。
+"""
+    # Rate limited per model, retried on 429 / 5xx (shared with the backend)
+    response = get_model_scheduler().call(model_name, model.generate_content, [
+        {"mime_type": "application/pdf", "data": pdf_bytes},
+        seal_prompt
+    ], generation_config={"response_mime_type": "application/json"})
+
+    text = response.text.strip()
+    if text.startswith("```json"): text = text[7:]
+    if text.endswith("```"): text = text[:-3]
+
+    # Try to parse JSON, with recovery for truncated responses
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        st.warning(f"AI出力が途中で切れました。部分的なデータを回復中...")
+        # Try to recover partial JSON
+        # Find the last complete block by looking for "},"
+        last_complete = text.rfind("},")
+        if last_complete != -1:
+            # Try to close the JSON properly
+            recovered_text = text[:last_complete + 1] + "]}"
+            try:
+                data = json.loads(recovered_text)
+                st.info(f"部分的なデータを回復しました。")
+            except:
+                # Try another approach - wrap as array
+                recovered_text = text[:last_complete + 1] + "]"
+                try:
+                    data = json.loads(recovered_text)
+                except:
+                    raise e
+        else:
+            raise e
+
+    blocks = data if isinstance(data, list) else data.get('blocks', [])
+    return blocks
+
 # Initialize Session State
 if 'main_process_done' not in st.session_state:
     st.session_state.main_process_done = False
@@ -233,111 +296,20 @@ with tab1:
         if st.button("変換開始", key="btn_order"):
             try:
                 with st.spinner('PDFを解析中...'):
-                    # Load Masters
-                    df_product_master, _ = load_master_csv(ASSETS_DIR, "商品マスタ")
-                    df_customer_master, _ = load_master_csv(ASSETS_DIR, "得意先マスタ")
-                    
-                    pdf_bytes_io = io.BytesIO(uploaded_file_order.getvalue())
                     original_pdf_name = os.path.splitext(uploaded_file_order.name)[0]
-                    
-                    # Load Templates
-                    template_path = os.path.join(ASSETS_DIR, "template.xlsm")
-                    nouhinsyo_path = os.path.join(ASSETS_DIR, "nouhinsyo.xlsx")
-                    
-                    if not os.path.exists(template_path) or not os.path.exists(nouhinsyo_path):
-                        st.error("テンプレートファイルが見つかりません。")
-                        st.stop()
 
-                    template_wb = load_workbook(template_path, keep_vba=True)
-                    nouhinsyo_wb = load_workbook(nouhinsyo_path)
-                    
-                    # 1. Paste Masters to Template (Clear & Paste)
-                    if not df_product_master.empty and "商品マスタ" in template_wb.sheetnames:
-                        ws = template_wb["商品マスタ"]
-                        clear_sheet(ws) # Clear existing
-                        paste_dataframe_to_sheet(ws, df_product_master)
-                        
-                    if not df_customer_master.empty and "得意先マスタ" in template_wb.sheetnames:
-                        ws = template_wb["得意先マスタ"]
-                        clear_sheet(ws) # Clear existing
-                        paste_dataframe_to_sheet(ws, df_customer_master)
+                    pdf_bytes = uploaded_file_order.getvalue()
+                    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
 
-                    # 2. Extract Data from PDF (Rule-based)
-                    df_paste_sheet = pdf_to_excel_data_for_paste_sheet(io.BytesIO(pdf_bytes_io.getvalue()))
-                    
-                    if df_paste_sheet is None:
-                        st.error("PDFデータの抽出に失敗しました。")
-                        st.stop()
-                        
-                    # Extract Bento Data
-                    df_bento_sheet = None
-                    tables = extract_table_from_pdf_for_bento(io.BytesIO(pdf_bytes_io.getvalue()))
-                    if tables:
-                        main_table = max(tables, key=len)
-                        anchor_col = find_correct_anchor_for_bento(main_table)
-                        if anchor_col != -1:
-                            bento_list = extract_bento_range_for_bento(main_table, anchor_col)
-                            if bento_list:
-                                matched_data = match_bento_data(bento_list, df_product_master)
-                                df_bento_sheet = pd.DataFrame(matched_data, columns=['商品予定名', 'パン箱入数', '売価単価', '弁当区分'])
-                    
-                    # Extract Client Data
-                    df_client_sheet = None
-                    client_data = extract_detailed_client_info_from_pdf(io.BytesIO(pdf_bytes_io.getvalue()))
-                    if client_data:
-                        df_client_sheet = export_detailed_client_data_to_dataframe(client_data)
-                        
-                    # 3. Write to Template
-                    ws_paste = template_wb["貼り付け用"]
-                    for r_idx, row in df_paste_sheet.iterrows():
-                        for c_idx, value in enumerate(row):
-                            ws_paste.cell(row=r_idx + 1, column=c_idx + 1, value=value)
-                            
-                    if df_bento_sheet is not None and "注文弁当の抽出" in template_wb.sheetnames:
-                        safe_write_df(template_wb["注文弁当の抽出"], df_bento_sheet)
-                        
-                    if df_client_sheet is not None and "クライアント抽出" in template_wb.sheetnames:
-                        safe_write_df(template_wb["クライアント抽出"], df_client_sheet)
-                        
-                    # 4. Write to Nouhinsyo
-                    # Paste Masters to Nouhinsyo (Clear & Paste)
-                    if not df_customer_master.empty and "得意先マスタ" in nouhinsyo_wb.sheetnames:
-                        ws = nouhinsyo_wb["得意先マスタ"]
-                        clear_sheet(ws) # Clear existing
-                        paste_dataframe_to_sheet(ws, df_customer_master)
-                    
-                    # Note: Nouhinsyo might not have "商品マスタ" sheet, but if it does, we should update it too.
-                    # Based on previous code, it only updated "得意先マスタ".
-                    
-                    ws_paste_n = nouhinsyo_wb["貼り付け用"]
-                    for r_idx, row in df_paste_sheet.iterrows():
-                        for c_idx, value in enumerate(row):
-                            ws_paste_n.cell(row=r_idx + 1, column=c_idx + 1, value=value)
-                            
-                    # Map Bento Names for Nouhinsyo
-                    df_bento_for_nouhin = None
-                    if df_bento_sheet is not None:
-                        master_df = df_product_master.copy()
-                        if not master_df.empty and '商品名' in master_df.columns:
-                            master_map = master_df.drop_duplicates(subset=['商品予定名']).set_index('商品予定名')['商品名'].to_dict()
-                            df_bento_for_nouhin = df_bento_sheet.copy()
-                            df_bento_for_nouhin['商品名'] = df_bento_for_nouhin['商品予定名'].map(master_map)
-                            df_bento_for_nouhin = df_bento_for_nouhin[['商品予定名', 'パン箱入数', '商品名']]
-                            
-                    if df_bento_for_nouhin is not None and "注文弁当の抽出" in nouhinsyo_wb.sheetnames:
-                        safe_write_df(nouhinsyo_wb["注文弁当の抽出"], df_bento_for_nouhin)
-                        
-                    if df_client_sheet is not None and "クライアント抽出" in nouhinsyo_wb.sheetnames:
-                        safe_write_df(nouhinsyo_wb["クライアント抽出"], df_client_sheet)
+                    # Rule-based extraction (no AI) through the shared order pipeline
+                    pipeline = get_order_pipeline()
+                    template_bytes, nouhinsyo_bytes = render_order_workbooks(
+                        pdf_hash, pipeline.master_key(), pipeline.template_key(), pdf_bytes
+                    )
 
-                    # 5. Save to Session State
-                    out_template = io.BytesIO()
-                    template_wb.save(out_template)
-                    st.session_state.template_bytes = out_template.getvalue()
-                    
-                    out_nouhin = io.BytesIO()
-                    nouhinsyo_wb.save(out_nouhin)
-                    st.session_state.nouhinsyo_bytes = out_nouhin.getvalue()
+                    # Save to Session State
+                    st.session_state.template_bytes = template_bytes
+                    st.session_state.nouhinsyo_bytes = nouhinsyo_bytes
                     
                     st.session_state.original_filename = original_pdf_name
                     st.session_state.main_process_done = True
@@ -380,68 +352,8 @@ with tab2:
         if st.button("変換開始", key="btn_seal"):
             try:
                 with st.spinner('AIが解析中... これには数分かかる場合があります。'):
-                    model = genai.GenerativeModel(model_name)
                     pdf_bytes = uploaded_file_seal.getvalue()
-                    
-                    seal_prompt = """
-このPDFはシール表です。横4つ × 縦5つ(合計約20個)のブロックで構成されています。
-各ブロックには以下の情報が含まれています:
-1. クライアント名 (最上部): 小学校名または幼稚園名 + 「様」
-2. 準備物 (クライアント名のすぐ下): パン箱入数、ご飯150gなど
-3. クラス名 (中央、大きめの文字): チューリップ、さくらなど
-4. 弁当数 (クラス名の下): 数値(例: 35、35+1)
-5. 日付 (ブロック左下): MM/DD形式
-6. 学年 (ブロック右下): 年長、年中など
-
-以下のJSON形式で、全てのブロック情報を抽出してください:
-{
-  "blocks": [
-    {
-      "client_name": "博多南衆参コース様",
-      "preparations": ["パン箱入数", "ご飯150g"],
-      "class_name": "チューリップ",
-      "meal_count": "35",
-      "date": "12/10",
-      "grade": "年長"
-    }
-  ]
-}
-重要: 全てのブロックを抽出してください。完全で有効なJSONのみを返してください。
-"""
-                    response = model.generate_content([
-                        {"mime_type": "application/pdf", "data": pdf_bytes},
-                        seal_prompt
-                    ], generation_config={"response_mime_type": "application/json"})
-                    
-                    text = response.text.strip()
-                    if text.startswith("```json"): text = text[7:]
-                    if text.endswith("```"): text = text[:-3]
-                    
-                    # Try to parse JSON, with recovery for truncated responses
-                    try:
-                        data = json.loads(text)
-                    except json.JSONDecodeError as e:
-                        st.warning(f"AI出力が途中で切れました。部分的なデータを回復中...")
-                        # Try to recover partial JSON
-                        # Find the last complete block by looking for "},"
-                        last_complete = text.rfind("},")
-                        if last_complete != -1:
-                            # Try to close the JSON properly
-                            recovered_text = text[:last_complete + 1] + "]}"
-                            try:
-                                data = json.loads(recovered_text)
-                                st.info(f"部分的なデータを回復しました。")
-                            except:
-                                # Try another approach - wrap as array
-                                recovered_text = text[:last_complete + 1] + "]"
-                                try:
-                                    data = json.loads(recovered_text)
-                                except:
-                                    raise e
-                        else:
-                            raise e
-                    
-                    blocks = data if isinstance(data, list) else data.get('blocks', [])
+                    blocks = extract_seal_blocks(pdf_bytes, model_name)
                     
                     # Create Excel
                     seal_path = os.path.join(ASSETS_DIR, "seal.xlsx")
@@ -511,8 +423,10 @@ with tab3:
     
     # Show current files
     st.subheader("現在のマスタファイル")
-    _, prod_file = load_master_csv(ASSETS_DIR, "商品マスタ")
-    _, cust_file = load_master_csv(ASSETS_DIR, "得意先マスタ")
+    prod_file, cust_file = None, None
+    if PDF_UTILS_AVAILABLE:
+        masters = get_order_pipeline().load_masters()
+        prod_file, cust_file = masters.product_filename, masters.customer_filename
     
     col1, col2 = st.columns(2)
     with col1:
@@ -522,7 +436,7 @@ with tab3:
 
     # Uploaders
     st.subheader("マスタ更新")
-    st.markdown("※アップロードすると、古いマスタファイルは削除され、新しいファイルが保存されます。")
+    st.markdown("※アップロードしたファイルがすぐに新しいマスタになります。以前のマスタも直近の数世代分は保存されます。")
     
     up_prod = st.file_uploader("商品マスタをアップロード (CSV)", type=['csv'], key="up_prod")
     if up_prod:
@@ -530,9 +444,12 @@ with tab3:
             st.warning("ファイル名に「商品マスタ一覧」を含めてください。")
         else:
             if st.button("商品マスタを保存"):
-                if save_master_file(ASSETS_DIR, up_prod, "商品マスタ"):
+                if save_master_file(ASSETS_DIR, up_prod.getvalue(), up_prod.name, "商品マスタ"):
+                    invalidate_master_caches()
                     st.success(f"保存しました: {up_prod.name}")
                     st.rerun()
+                else:
+                    st.error("ファイルの保存に失敗しました。")
 
     up_cust = st.file_uploader("得意先マスタをアップロード (CSV)", type=['csv'], key="up_cust")
     if up_cust:
@@ -540,6 +457,9 @@ with tab3:
             st.warning("ファイル名に「得意先マスタ一覧」を含めてください。")
         else:
             if st.button("得意先マスタを保存"):
-                if save_master_file(ASSETS_DIR, up_cust, "得意先マスタ"):
+                if save_master_file(ASSETS_DIR, up_cust.getvalue(), up_cust.name, "得意先マスタ"):
+                    invalidate_master_caches()
                     st.success(f"保存しました: {up_cust.name}")
                     st.rerun()
+                else:
+                    st.error("ファイルの保存に失敗しました。")